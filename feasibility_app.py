@@ -1,10 +1,30 @@
 import flet as ft
+import numpy as np
 import json
 import datetime
-from typing import List, Dict, Optional
-from dataclasses import dataclass, asdict
+import threading
+import itertools
+import atexit
+import os
+import hashlib
+import mmap
+import tempfile
+import shutil
+import base64
+import re
+import bisect
+import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, CancelledError
+from typing import List, Dict, Optional, Set, Tuple, Callable, Any
+from dataclasses import dataclass, asdict, field, fields, replace, MISSING
 from enum import Enum
 
+try:
+    import pymupdf  # Renders drawing previews; previews are skipped without it
+except ImportError:
+    pymupdf = None
+
 # Enums for better data management
 class ProjectStatus(Enum):
     NEW = "Nuevo"
@@ -20,6 +40,13 @@ class Priority(Enum):
     HIGH = "Alta"
     CRITICAL = "Crítica"
 
+class JobStatus(Enum):
+    QUEUED = "En cola"
+    RUNNING = "En ejecución"
+    DONE = "Terminado"
+    FAILED = "Error"
+    CANCELLED = "Cancelado"
+
 class Department(Enum):
     SALES = "Ventas"
     PROJECTS = "Proyectos"
@@ -58,8 +85,9 @@ class ProjectInfo:
     risk_factors: List[str]
     opportunities: List[str]
     comments: List[Dict]
-    technical_drawings_pdf: List[str]
-    technical_drawings_step: List[str]
+    # Attachment references as returned by AttachmentStore.put_file
+    technical_drawings_pdf: List[Dict]
+    technical_drawings_step: List[Dict]
     
     # General Information fields
     offer_number: str = ""
@@ -115,99 +143,3430 @@ class ProjectInfo:
     toolmaker_raw_material: str = ""
     toolmaker_life_guarantee: int = 0
     toolmaker_lead_time_weeks: int = 0
+    toolmaker_name: str = ""
+    # Every quote received; the fields above hold the selected one
+    toolmaker_quotes: List[Dict] = field(default_factory=list)
+    
+    # Parsed from expected_volume whenever it is written
+    expected_volume_sets: float = 0.0
+    expected_volume_unit: str = ""
+    expected_volume_error: str = ""
+    
+    # Concurrency control
+    version: int = 0
+
+@dataclass(frozen=True)
+class ViewQuery:
+    """Immutable dashboard filter owned by a single session"""
+    status: str = "Todos"
+    priority: str = "Todas"
+    search_term: str = ""
+    sort_by: str = ""
+
+@dataclass(frozen=True)
+class ProjectDelta:
+    """One project version, storing only the fields it changed as field -> (old, new)"""
+    version: int
+    timestamp: datetime.datetime
+    author: Optional[str]
+    changes: Dict
+
+class ProjectConflictError(Exception):
+    """Raised when a save is based on a version that another session already changed"""
+    def __init__(self, project_id: int, expected_version: int, current_version: int, fields: List[str]):
+        self.project_id = project_id
+        self.expected_version = expected_version
+        self.current_version = current_version
+        self.fields = fields
+        super().__init__(
+            f"El proyecto fue modificado por otro usuario (versión {expected_version} → {current_version}). "
+            f"Campos en conflicto: {', '.join(fields)}"
+        )
+
+# Maximum number of distinct views kept in the shared get_projects cache
+VIEW_CACHE_SIZE = 256
+
+# Capacity planning assumptions
+WORKING_WEEKS_PER_YEAR = 48
+WORKING_DAYS_PER_WEEK = 5
+SHIFTS_PER_DAY = 3
+DEFAULT_HOURS_PER_SHIFT = 8.0
+PRESS_HOURS_PER_WEEK = WORKING_DAYS_PER_WEEK * SHIFTS_PER_DAY * DEFAULT_HOURS_PER_SHIFT
+
+# expected_volume parsing, e.g. "25,000 sets/año", "1.2M piezas por año", "500 sets/mes",
+# "25000pcs/month" (unit right after the number) and "12,000 sets/año de media" (yearly, not daily)
+def _words(*alternatives: str) -> re.Pattern:
+    """Match whole words only; unlike a regex word boundary, a digit may come right before"""
+    return re.compile(r"(?<![^\W\d_])(?:" + "|".join(alternatives) + r")(?![^\W\d_])", re.IGNORECASE)
+
+VOLUME_NUMBER_RE = re.compile(
+    r"(\d[\d.,\s]*\d|\d)(?!\d)\s*(?:(millones|millón|millon|mil|mm|m|k)(?![^\W\d_]))?", re.IGNORECASE)
+VOLUME_MULTIPLIERS = {"k": 1e3, "mil": 1e3, "m": 1e6, "mm": 1e6, "millon": 1e6, "millón": 1e6, "millones": 1e6}
+VOLUME_UNITS = {
+    "sets": _words(r"sets?", r"juegos?"),
+    "piezas": _words(r"piezas?", r"pzas?", r"pcs", r"pieces?", r"parts?"),
+}
+VOLUME_PERIODS = (
+    (_words(r"d[ií]as?", r"days?", r"diari[oa]s?", r"daily"), "day"),
+    (_words(r"semanas?", r"semanal(es)?", r"weeks?", r"weekly"), "week"),
+    (_words(r"mes(es)?", r"mensual(es)?", r"months?", r"monthly"), "month"),
+    (_words(r"a[ñn]os?", r"anual(es)?", r"years?", r"yearly", r"annual"), "year"),
+)
+# Fields that feed annual_volume(); engines listen to both
+VOLUME_FIELDS = {"yearly_volume_sets", "expected_volume_sets"}
+
+def _parse_number(text: str) -> float:
+    text = re.sub(r"\s", "", text)
+    if "," in text and "." in text:
+        # The later separator is the decimal point
+        if text.rfind(",") > text.rfind("."):
+            text = text.replace(".", "").replace(",", ".")
+        else:
+            text = text.replace(",", "")
+    elif "," in text or "." in text:
+        separator = "," if "," in text else "."
+        groups = text.split(separator)
+        if len(groups) > 2 or len(groups[-1]) == 3:
+            text = text.replace(separator, "")
+        else:
+            text = text.replace(",", ".")
+    return float(text)
+
+def parse_volume(text: str) -> Tuple[float, str, str]:
+    """Return (sets per year, unit, error); error is empty when text was understood"""
+    text = (text or "").strip()
+    if not text:
+        return 0.0, "", "Vacío"
+    match = VOLUME_NUMBER_RE.search(text)
+    if match is None:
+        return 0.0, "", "Sin cantidad"
+    if len(VOLUME_NUMBER_RE.findall(text)) > 1:
+        return 0.0, "", "Varias cantidades"
+    try:
+        quantity = _parse_number(match.group(1))
+    except ValueError:
+        return 0.0, "", "Cantidad ilegible"
+    quantity *= VOLUME_MULTIPLIERS.get((match.group(2) or "").lower(), 1.0)
+    
+    unit = next((name for name, pattern in VOLUME_UNITS.items() if pattern.search(text)), "sets")
+    # A bare number is taken as a yearly volume
+    period = next((name for pattern, name in VOLUME_PERIODS if pattern.search(text[match.end():])), "year")
+    periods_per_year = {
+        "day": WORKING_WEEKS_PER_YEAR * WORKING_DAYS_PER_WEEK,
+        "week": WORKING_WEEKS_PER_YEAR,
+        "month": 12,
+        "year": 1,
+    }[period]
+    return quantity * periods_per_year, unit, ""
+
+def annual_volume(project) -> float:
+    """yearly_volume_sets when filled in, otherwise the volume parsed from expected_volume"""
+    return project.yearly_volume_sets or project.expected_volume_sets
+
+def apply_volume_parse(project) -> Dict:
+    """Refresh the parsed expected_volume fields; return the changes as field -> (old, new)"""
+    value, unit, error = parse_volume(project.expected_volume)
+    changes = {}
+    for name, new in (("expected_volume_sets", value), ("expected_volume_unit", unit), ("expected_volume_error", error)):
+        old = getattr(project, name)
+        if old != new:
+            setattr(project, name, new)
+            changes[name] = (old, new)
+    return changes
+
+VOLUME_MISMATCH_TOLERANCE = 0.2
+
+def volume_data_quality_report(projects: List) -> List[Dict]:
+    """Projects whose expected_volume could not be parsed or disagrees with yearly_volume_sets.
+
+    Works from the values cached at write time, so it never re-parses.
+    """
+    issues = []
+    for project in projects:
+        problem = ""
+        if project.expected_volume_error:
+            problem = project.expected_volume_error
+        elif project.expected_volume_unit and project.expected_volume_unit != "sets":
+            problem = f"Volumen expresado en {project.expected_volume_unit}, no en sets"
+        elif project.yearly_volume_sets and project.expected_volume_sets and abs(
+                project.yearly_volume_sets - project.expected_volume_sets) > VOLUME_MISMATCH_TOLERANCE * project.yearly_volume_sets:
+            problem = f"No coincide con el volumen anual ({project.yearly_volume_sets:,} sets)"
+        if problem:
+            issues.append({
+                "project_id": project.id,
+                "project_name": project.project_name,
+                "expected_volume": project.expected_volume,
+                "problem": problem,
+            })
+    return issues
+
+class SearchIndex:
+    """Extra searchable text per project, such as metadata extracted from attachments"""
+    def __init__(self):
+        self._texts: Dict[int, Dict[str, str]] = {}
+        self._joined: Dict[int, str] = {}
+        self._lock = threading.Lock()
+
+    def set_text(self, project_id: int, source: str, text: str):
+        with self._lock:
+            texts = self._texts.setdefault(project_id, {})
+            texts[source] = text
+            self._joined[project_id] = "\n".join(texts.values()).lower()
+
+    def matches(self, project_id: int, term: str) -> bool:
+        """term must already be lowercase"""
+        return term in self._joined.get(project_id, "")
+
+# State management class
+class FeasibilityState:
+    def __init__(self):
+        self.projects = [
+            ProjectInfo(
+                id=1,
+                project_name="LUCID ATLAS IM",
+                customer_name="LUCID",
+                customer_contact="Nidhishri Tapadia",
+                customer_email="NidhishriTapadia@lucidmotors.com",
+                customer_phone="+1 608 692 6323",
+                project_description="Estampado de rotor y estator para motor IM + Die casting RT + Torneado RT + Lavado RT",
+                expected_volume="25,000 sets/año",
+                target_price=150,
+                target_margin=8.0,
+                delivery_date="2026-03-17",
+                technical_requirements="ISO 9001, IATF 16949, Especificados en dibujos",
+                quality_requirements="Especificados en dibujos",
+                regulatory_requirements="Normas automotrices mexicanas y estadounidenses, Especificados en dibujos",
+                priority=Priority.HIGH.value,
+                status=ProjectStatus.UNDER_REVIEW.value,
+                created_by="Jorge Valdés",
+                created_date="2025-10-16",
+                last_updated="2025-10-16",
+                assigned_departments=[Department.ENGINEERING.value, Department.QUALITY.value, Department.SALES.value, Department.PROJECTS.value],
+                feasibility_score=75,
+                risk_factors=["Alta competencia", "Requisitos técnicos complejos", "Nuevos procesos", "Mucha inversión", "Bajo volumen", "Dibujos no congelados"],
+                opportunities=["Mercado en crecimiento", "Cliente nuevo", "Nuevos procesos"],
+                comments=[
+
+                ],
+                technical_drawings_pdf=[],
+                technical_drawings_step=[]
+            ),
+            
+        ]
+        self.next_id = 3
+        
+        # Bumped on every mutation; cached views are valid only for the revision they were built at
+        self.revision = 0
+        self._view_cache: Dict[ViewQuery, Tuple[int, List[ProjectInfo]]] = {}
+        self.search_index = SearchIndex()
+        
+        # The list lock only guards the project list, the id index and next_id;
+        # field mutations take the lock of the project being edited so sessions
+        # working on different projects never wait on each other
+        self._projects_lock = threading.Lock()
+        self._project_locks: Dict[int, threading.Lock] = {}
+        # Version at which each field of each project was last written
+        self._field_versions: Dict[int, Dict[str, int]] = {}
+        self._index: Dict[int, ProjectInfo] = {}
+        # Dashboard counters kept up to date on every mutation instead of rescanning
+        self._status_counts: Dict[str, int] = {}
+        self._score_total = 0
+        self._volume_total = 0.0
+        # Callbacks notified as listener(event, project_id, changes) on every mutation
+        self._listeners = []
+        # Version history: each project keeps its current object plus the
+        # deltas that led to it, so memory grows with edits, not versions x fields
+        self._history: Dict[int, List[ProjectDelta]] = {}
+        self._created: Dict[int, datetime.datetime] = {}
+        for project in self.projects:
+            project.version = 1
+            self._project_locks[project.id] = threading.Lock()
+            self._index[project.id] = project
+            apply_volume_parse(project)
+            self._created[project.id] = datetime.datetime.min
+            self._status_counts[project.status] = self._status_counts.get(project.status, 0) + 1
+            self._score_total += project.feasibility_score
+            self._volume_total += annual_volume(project)
+
+    def _lock_for(self, project_id: int) -> threading.Lock:
+        with self._projects_lock:
+            return self._project_locks.setdefault(project_id, threading.Lock())
+
+    def get_project(self, project_id: int) -> Optional[ProjectInfo]:
+        return self._index.get(project_id)
+
+    def add_listener(self, listener):
+        """Register listener(event, project_id, changes).
+
+        Listeners run while the project lock is held, so they see changes to
+        one project in order and must return quickly.
+        """
+        self._listeners.append(listener)
+
+    def _notify(self, event: str, project_id: int, changes: Dict):
+        for listener in self._listeners:
+            try:
+                listener(event, project_id, changes)
+            except Exception as e:
+                print(f"Error notifying state listener: {e}")
+
+    def _record_change(self, project_id: int, changes: Dict):
+        # changes maps field -> (old value, new value)
+        project = self._index[project_id]
+        with self._projects_lock:
+            if VOLUME_FIELDS.intersection(changes):
+                old_yearly = changes.get("yearly_volume_sets", (project.yearly_volume_sets,))[0]
+                old_expected = changes.get("expected_volume_sets", (project.expected_volume_sets,))[0]
+                self._volume_total += annual_volume(project) - (old_yearly or old_expected)
+            if "status" in changes:
+                old_status, new_status = changes["status"]
+                self._status_counts[old_status] = self._status_counts.get(old_status, 0) - 1
+                self._status_counts[new_status] = self._status_counts.get(new_status, 0) + 1
+            if "feasibility_score" in changes:
+                old_score, new_score = changes["feasibility_score"]
+                self._score_total += new_score - old_score
+            self.revision += 1
+
+    def index_text(self, project_id: int, source: str, text: str):
+        """Add text that get_projects searches in addition to the project fields"""
+        self.search_index.set_text(project_id, source, text)
+        with self._projects_lock:
+            self.revision += 1
+
+    def get_stats(self) -> Dict:
+        with self._projects_lock:
+            total = len(self.projects)
+            counts = dict(self._status_counts)
+            score_total = self._score_total
+            volume_total = self._volume_total
+        return {
+            "total": total,
+            "feasible": counts.get(ProjectStatus.FEASIBLE.value, 0),
+            "under_review": counts.get(ProjectStatus.UNDER_REVIEW.value, 0),
+            "approved": counts.get(ProjectStatus.APPROVED.value, 0),
+            "rejected": counts.get(ProjectStatus.REJECTED.value, 0),
+            "not_feasible": counts.get(ProjectStatus.NOT_FEASIBLE.value, 0),
+            "avg_score": score_total / total if total > 0 else 0,
+            "total_volume_sets": volume_total
+        }
+
+    def add_project(self, project: ProjectInfo, author: Optional[str] = None):
+        with self._projects_lock:
+            project.id = self.next_id
+            self.next_id += 1
+            project.version = 1
+            apply_volume_parse(project)
+            self._created[project.id] = datetime.datetime.now()
+            self._project_locks[project.id] = threading.Lock()
+            self._index[project.id] = project
+            # Replace instead of append so readers iterating the old list are unaffected
+            self.projects = self.projects + [project]
+            self._status_counts[project.status] = self._status_counts.get(project.status, 0) + 1
+            self._score_total += project.feasibility_score
+            self._volume_total += annual_volume(project)
+            self.revision += 1
+        
+        with self._lock_for(project.id):
+            # Version 1 records the fields the creator filled in; listeners run under the
+            # project lock, as for updates, so no later version can overtake this event
+            changes = {}
+            for f in fields(ProjectInfo):
+                if f.name in ("id", "version"):
+                    continue
+                default = f.default if f.default is not MISSING else (
+                    f.default_factory() if f.default_factory is not MISSING else None)
+                value = getattr(project, f.name)
+                if value != default:
+                    changes[f.name] = (default, value)
+            self._history.setdefault(project.id, []).append(
+                ProjectDelta(project.version, self._created[project.id], author, changes))
+            self._notify("added", project.id, changes)
+
+    def update_project(self, project_id: int, updates: Dict, expected_version: Optional[int] = None,
+                       author: Optional[str] = None, expected_values: Optional[Dict] = None) -> Optional[int]:
+        """Apply updates and return the new version.
+
+        When expected_version is given, raise ProjectConflictError if any field
+        being changed was written by someone else after that version. With
+        expected_values, the fields must still hold those values instead.
+        """
+        project = self._index.get(project_id)
+        if project is None:
+            return None
+        
+        with self._lock_for(project_id):
+            field_versions = self._field_versions.setdefault(project_id, {})
+            changes = {key: (getattr(project, key), value) for key, value in updates.items()
+                       if getattr(project, key) != value}
+            
+            if expected_version is not None and expected_version != project.version:
+                conflicts = [key for key in changes if field_versions.get(key, 0) > expected_version]
+                if conflicts:
+                    raise ProjectConflictError(project_id, expected_version, project.version, conflicts)
+            if expected_values is not None:
+                conflicts = [key for key, value in expected_values.items() if getattr(project, key) != value]
+                if conflicts:
+                    raise ProjectConflictError(project_id, project.version, project.version, conflicts)
+            
+            if not changes:
+                return project.version
+            
+            project.version += 1
+            for key, (_, value) in changes.items():
+                setattr(project, key, value)
+                field_versions[key] = project.version
+            if "expected_volume" in changes:
+                # Parse once here so readers never run the regexes
+                for key, change in apply_volume_parse(project).items():
+                    changes[key] = change
+                    field_versions[key] = project.version
+            self._append_history(project, author, changes)
+            self._record_change(project_id, changes)
+            self._notify("updated", project_id, changes)
+            return project.version
+
+    def _append_history(self, project: ProjectInfo, author: Optional[str], changes: Dict):
+        # Called with the project lock held, after project.version was bumped
+        now = datetime.datetime.now()
+        recorded = dict(changes)
+        last_updated = now.strftime("%Y-%m-%d")
+        if project.last_updated != last_updated:
+            recorded["last_updated"] = (project.last_updated, last_updated)
+            project.last_updated = last_updated
+        self._history.setdefault(project.id, []).append(ProjectDelta(project.version, now, author, recorded))
+
+    def get_delta(self, project_id: int, version: int) -> Optional[ProjectDelta]:
+        for delta in reversed(self._history.get(project_id, ())):
+            if delta.version == version:
+                return delta
+            if delta.version < version:
+                break
+        return None
+
+    def _rewind(self, project_id: int, keep: Callable[[ProjectDelta], bool]) -> Optional[ProjectInfo]:
+        """Copy of the project with every delta after the last one satisfying keep undone"""
+        project = self._index.get(project_id)
+        if project is None:
+            return None
+        with self._lock_for(project_id):
+            history = self._history.get(project_id, [])
+            values = {}
+            for delta in reversed(history):
+                # Version 1 is the creation; a project never exists without it
+                if keep(delta) or delta.version == 1:
+                    break
+                for key, (old, _) in delta.changes.items():
+                    values[key] = old
+            # Lists are replaced, never mutated, so the copy can share them with the live project
+            return replace(project, **values)
+
+    def get_project_version(self, project_id: int, version: int) -> Optional[ProjectInfo]:
+        return self._rewind(project_id, lambda delta: delta.version <= version)
+
+    def get_project_at(self, project_id: int, when: datetime.datetime) -> Optional[ProjectInfo]:
+        if self._created.get(project_id, datetime.datetime.max) > when:
+            return None
+        return self._rewind(project_id, lambda delta: delta.timestamp <= when)
+
+    def get_projects_at(self, when: datetime.datetime) -> List[ProjectInfo]:
+        """The whole portfolio as it was at when"""
+        snapshots = (self.get_project_at(p.id, when) for p in self.projects)
+        return [p for p in snapshots if p is not None]
+
+    def revert(self, project_id: int, version: int, author: Optional[str] = None) -> Optional[int]:
+        """Write back the values a version replaced and return the new version.
+
+        Raises ProjectConflictError if one of those fields no longer holds the
+        value that version wrote.
+        """
+        delta = self.get_delta(project_id, version)
+        if delta is None or delta.version == 1:
+            return None
+        changes = {key: change for key, change in delta.changes.items() if key != "last_updated"}
+        try:
+            return self.update_project(project_id, {key: old for key, (old, _) in changes.items()}, author=author,
+                                       expected_values={key: new for key, (_, new) in changes.items()})
+        except ProjectConflictError as e:
+            raise ProjectConflictError(project_id, version, e.current_version, e.fields) from None
+
+    def get_projects(self, query: Optional[ViewQuery] = None) -> List[ProjectInfo]:
+        """Return the projects matching query.
+
+        Results are shared between sessions asking for the same view, so
+        callers must not modify the returned list.
+        """
+        query = query or ViewQuery()
+        revision = self.revision
+        cached = self._view_cache.get(query)
+        if cached is not None and cached[0] == revision:
+            return cached[1]
+        
+        filtered = self.projects
+        
+        if query.status != "Todos":
+            filtered = [p for p in filtered if p.status == query.status]
+        
+        if query.priority != "Todas":
+            filtered = [p for p in filtered if p.priority == query.priority]
+        
+        if query.search_term:
+            search_term = query.search_term.lower()
+            filtered = [p for p in filtered 
+                       if search_term in p.project_name.lower() 
+                       or search_term in p.customer_name.lower()
+                       or self.search_index.matches(p.id, search_term)]
+        
+        if query.sort_by == "volume":
+            filtered = sorted(filtered, key=annual_volume, reverse=True)
+        
+        if len(self._view_cache) >= VIEW_CACHE_SIZE:
+            self._view_cache.clear()
+        self._view_cache[query] = (revision, filtered)
+        return filtered
+
+    def add_comment(self, project_id: int, comment: str, author: Optional[str] = None):
+        project = self._index.get(project_id)
+        if project is None:
+            return
+        
+        with self._lock_for(project_id):
+            new_comment = {
+                "comment": comment,
+                "date": datetime.datetime.now().strftime("%Y-%m-%d")
+            }
+            # Copy-on-write so earlier versions keep their comment list
+            changes = {"comments": (project.comments, project.comments + [new_comment])}
+            project.comments = changes["comments"][1]
+            project.version += 1
+            self._field_versions.setdefault(project_id, {})["comments"] = project.version
+            self._append_history(project, author, changes)
+            self._record_change(project_id, changes)
+            self._notify("commented", project_id, changes)
+
+# Global state instance
+state = FeasibilityState()
+
+# Interval over which state changes are coalesced into one pubsub message (seconds)
+BROADCAST_INTERVAL = 0.5
+
+# Pubsub topic carrying project change deltas
+PROJECTS_TOPIC = "projects"
+
+class ChangeBroadcaster:
+    """Publishes FeasibilityState changes to every session, one coalesced delta per interval"""
+    def __init__(self, interval: float = BROADCAST_INTERVAL):
+        self.interval = interval
+        self.pubsub = None
+        self.published = 0
+        # project id -> (event, project version the event produced)
+        self._pending: Dict[int, Tuple[str, int]] = {}
+        self._timer = None
+        self._lock = threading.Lock()
+
+    def attach(self, pubsub):
+        # Any session's client can publish; the hub behind it is shared by the app
+        self.pubsub = pubsub
+
+    def record(self, event: str, project_id: int, changes: Dict):
+        # Runs under the project lock, so this is the version the event produced
+        project = state.get_project(project_id)
+        version = project.version if project is not None else 0
+        with self._lock:
+            # A project added and then edited in the same interval is still new to other sessions
+            previous = self._pending.get(project_id)
+            if previous is not None and previous[0] == "added":
+                event = "added"
+            self._pending[project_id] = (event, max(version, previous[1] if previous else 0))
+            if self._timer is None:
+                self._timer = threading.Timer(self.interval, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def flush(self):
+        with self._lock:
+            delta = self._pending
+            self._pending = {}
+            self._timer = None
+        if not delta or self.pubsub is None:
+            return
+        try:
+            self.pubsub.send_all_on_topic(PROJECTS_TOPIC, {
+                "changes": {project_id: event for project_id, (event, _) in delta.items()},
+                "versions": {project_id: version for project_id, (_, version) in delta.items()},
+            })
+            self.published += 1
+        except Exception as e:
+            print(f"Error broadcasting project changes: {e}")
+
+broadcaster = ChangeBroadcaster()
+state.add_listener(broadcaster.record)
+
+# Background worker pool sizing
+THREAD_WORKERS = 4
+PROCESS_WORKERS = max(1, (os.cpu_count() or 2) - 1)
+MAX_QUEUED_JOBS = 32
+MAX_FINISHED_JOBS = 50
+
+class JobQueueFullError(Exception):
+    """Raised when the background queue already holds MAX_QUEUED_JOBS unfinished jobs"""
+
+@dataclass
+class Job:
+    id: int
+    name: str
+    kind: str
+    session_id: Optional[str]
+    status: str = JobStatus.QUEUED.value
+    progress: float = 0.0
+    result: Any = None
+    error: str = ""
+    exception: Optional[BaseException] = field(default=None, repr=False)
+    cancel_event: threading.Event = field(default_factory=threading.Event, repr=False)
+    future: Any = field(default=None, repr=False)
+    pool: Any = field(default=None, repr=False)
+
+    @property
+    def cancelled(self) -> bool:
+        return self.cancel_event.is_set()
+
+    def report_progress(self, fraction: float):
+        """Called by thread jobs to publish progress between 0 and 1"""
+        self.progress = min(max(fraction, 0.0), 1.0)
+        if self.pool is not None:
+            self.pool._job_changed(self)
+
+class BackgroundJobs:
+    """App-wide thread and process pools running work outside the Flet event handlers.
+
+    Thread jobs receive the Job as first argument so they can report progress
+    and check for cancellation. Process jobs must be top-level functions with
+    picklable arguments; they only report completion.
+    """
+    def __init__(self, thread_workers: int = THREAD_WORKERS, process_workers: int = PROCESS_WORKERS,
+                 max_queued: int = MAX_QUEUED_JOBS):
+        self.process_workers = process_workers
+        self._threads = ThreadPoolExecutor(max_workers=thread_workers, thread_name_prefix="feasibility-job")
+        # Created on first use so importing the module never spawns processes
+        self._processes = None
+        self._slots = threading.BoundedSemaphore(max_queued)
+        self._ids = itertools.count(1)
+        self._jobs: Dict[int, Job] = {}
+        self._watchers: Dict[str, Callable] = {}
+        self._lock = threading.Lock()
+
+    def _process_pool(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._processes is None:
+                self._processes = ProcessPoolExecutor(max_workers=self.process_workers)
+            return self._processes
+
+    def submit(self, name: str, fn: Callable, *args, page: Optional[ft.Page] = None,
+               on_result: Optional[Callable] = None, on_error: Optional[Callable] = None,
+               kind: str = "thread", **kwargs) -> Job:
+        """Queue fn and return its Job; on_result/on_error run on a worker thread.
+
+        on_error receives the exception fn raised, so callers can branch on its type.
+        """
+        if not self._slots.acquire(blocking=False):
+            raise JobQueueFullError(f"Demasiadas tareas en cola ({MAX_QUEUED_JOBS}). Intente más tarde.")
+        
+        job = Job(
+            id=next(self._ids),
+            name=name,
+            kind=kind,
+            session_id=page.session_id if page is not None else None,
+            pool=self
+        )
+        with self._lock:
+            self._jobs[job.id] = job
+        
+        try:
+            if kind == "process":
+                job.future = self._process_pool().submit(fn, *args, **kwargs)
+            else:
+                job.future = self._threads.submit(self._run_thread_job, job, fn, args, kwargs)
+        except Exception:
+            self._slots.release()
+            with self._lock:
+                self._jobs.pop(job.id, None)
+            raise
+        
+        job.future.add_done_callback(lambda future: self._finish(job, future, on_result, on_error))
+        self._job_changed(job)
+        return job
+
+    def _run_thread_job(self, job: Job, fn: Callable, args, kwargs):
+        if job.cancelled:
+            raise CancelledError()
+        job.status = JobStatus.RUNNING.value
+        self._job_changed(job)
+        return fn(job, *args, **kwargs)
+
+    def _finish(self, job: Job, future, on_result: Optional[Callable], on_error: Optional[Callable]):
+        self._slots.release()
+        try:
+            result = future.result()
+            if job.cancelled:
+                job.status = JobStatus.CANCELLED.value
+            else:
+                job.result = result
+                job.progress = 1.0
+                job.status = JobStatus.DONE.value
+        except CancelledError:
+            job.status = JobStatus.CANCELLED.value
+        except Exception as e:
+            job.status = JobStatus.FAILED.value
+            job.error = str(e)
+            job.exception = e
+            print(f"Background job '{job.name}' failed: {e}")
+        
+        try:
+            if job.status == JobStatus.DONE.value and on_result is not None:
+                on_result(job.result)
+            elif job.status == JobStatus.FAILED.value and on_error is not None:
+                on_error(job.exception)
+        except Exception as e:
+            print(f"Error in callback of job '{job.name}': {e}")
+        
+        self._prune()
+        self._job_changed(job)
+
+    def _prune(self):
+        with self._lock:
+            finished = [j for j in self._jobs.values()
+                        if j.status in (JobStatus.DONE.value, JobStatus.FAILED.value, JobStatus.CANCELLED.value)]
+            for j in finished[:max(0, len(finished) - MAX_FINISHED_JOBS)]:
+                del self._jobs[j.id]
+
+    def cancel(self, job_id: int):
+        """Cancel a queued job or ask a running thread job to stop"""
+        job = self._jobs.get(job_id)
+        if job is None:
+            return
+        job.cancel_event.set()
+        if job.future is not None:
+            job.future.cancel()
+        self._job_changed(job)
+
+    def get_jobs(self, session_id: Optional[str] = None) -> List[Job]:
+        with self._lock:
+            jobs = list(self._jobs.values())
+        if session_id is not None:
+            jobs = [j for j in jobs if j.session_id == session_id]
+        for j in jobs:
+            # Process jobs cannot report when they start, so ask their future
+            if j.status == JobStatus.QUEUED.value and j.future is not None and j.future.running():
+                j.status = JobStatus.RUNNING.value
+        return jobs
+
+    def watch(self, session_id: str, callback: Callable):
+        """Call callback(job) whenever a job of session_id changes"""
+        with self._lock:
+            self._watchers[session_id] = callback
+
+    def unwatch(self, session_id: str):
+        with self._lock:
+            self._watchers.pop(session_id, None)
+
+    def _job_changed(self, job: Job):
+        callback = self._watchers.get(job.session_id)
+        if callback is not None:
+            try:
+                callback(job)
+            except Exception as e:
+                print(f"Error notifying job watcher: {e}")
+
+    def shutdown(self):
+        for job in list(self._jobs.values()):
+            job.cancel_event.set()
+        self._threads.shutdown(wait=False, cancel_futures=True)
+        if self._processes is not None:
+            self._processes.shutdown(wait=False, cancel_futures=True)
+
+# Global background job pool
+jobs = BackgroundJobs()
+atexit.register(jobs.shutdown)
+
+# Attachment validation by content; the trailer catches truncated copies
+ATTACHMENT_SNIFF_BYTES = 1024
+ATTACHMENT_RULES = {
+    "pdf": {"label": "PDF", "magic": b"%PDF-", "trailer": b"%%EOF", "max_size": 200 * 1024 * 1024},
+    "step": {"label": "STEP", "magic": b"ISO-10303-21;", "trailer": b"END-ISO-10303-21", "max_size": 1024 * 1024 * 1024},
+}
+
+class AttachmentValidationError(ValueError):
+    """Raised when an attached file is not the type it claims to be or is damaged"""
+
+def validate_attachment(stream, size: int, kind: str):
+    """Check size limits, the magic signature and the trailer without reading the whole file"""
+    rules = ATTACHMENT_RULES[kind]
+    if size == 0:
+        raise AttachmentValidationError("el archivo está vacío")
+    if size > rules["max_size"]:
+        raise AttachmentValidationError(
+            f"excede el tamaño máximo de {rules['max_size'] // (1024 * 1024)} MB para archivos {rules['label']}")
+    
+    head = stream.read(ATTACHMENT_SNIFF_BYTES)
+    if rules["magic"] not in head:
+        raise AttachmentValidationError(f"el contenido no corresponde a un archivo {rules['label']}")
+    
+    stream.seek(max(0, size - ATTACHMENT_SNIFF_BYTES))
+    if rules["trailer"] not in stream.read(ATTACHMENT_SNIFF_BYTES):
+        raise AttachmentValidationError("el archivo está incompleto o dañado")
+    stream.seek(0)
+
+# Root directory for attachments and caches
+DATA_DIR = os.environ.get("FEASIBILITY_DATA_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "data"))
+ATTACHMENT_CHUNK_SIZE = 1024 * 1024
+
+class AttachmentStore:
+    """Content-addressed store for technical drawings keyed by SHA-256.
+
+    Files are streamed in ATTACHMENT_CHUNK_SIZE chunks, so a large STEP
+    assembly never has to fit in memory, and identical content attached to
+    several revisions or projects is stored once.
+    """
+    def __init__(self, root: str):
+        self.root = root
+        self.objects_dir = os.path.join(root, "objects")
+        self.tmp_dir = os.path.join(root, "tmp")
+
+    def path_for(self, digest: str) -> str:
+        return os.path.join(self.objects_dir, digest[:2], digest)
+
+    def contains(self, digest: str) -> bool:
+        return os.path.exists(self.path_for(digest))
+
+    def put_stream(self, stream, name: str, total_size: int = 0,
+                   progress: Optional[Callable[[float], None]] = None) -> Dict:
+        """Copy stream into the store while hashing it and return the attachment reference"""
+        os.makedirs(self.tmp_dir, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.tmp_dir)
+        sha256 = hashlib.sha256()
+        size = 0
+        try:
+            with os.fdopen(fd, "wb") as out:
+                while True:
+                    chunk = stream.read(ATTACHMENT_CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    sha256.update(chunk)
+                    out.write(chunk)
+                    size += len(chunk)
+                    if progress is not None and total_size:
+                        progress(size / total_size)
+            
+            digest = sha256.hexdigest()
+            target = self.path_for(digest)
+            if os.path.exists(target):
+                # Same drawing already stored
+                os.remove(tmp_path)
+            else:
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                os.replace(tmp_path, target)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        
+        return {"sha256": digest, "name": name, "size": size}
+
+    def put_file(self, path: str, progress: Optional[Callable[[float], None]] = None,
+                 kind: Optional[str] = None, name: Optional[str] = None) -> Dict:
+        """Validate (when kind is given) and store the file at path"""
+        with open(path, "rb") as source:
+            size = os.fstat(source.fileno()).st_size
+            if kind is not None:
+                validate_attachment(source, size, kind)
+            attachment = self.put_stream(source, name or os.path.basename(path), size, progress)
+        # Length check: the SHA-256 names the stored content, but there is no expected digest
+        # to compare it with, so a short read is how a source that changed or failed mid-copy shows up
+        if attachment["size"] != size:
+            raise AttachmentValidationError("el archivo cambió o se dañó durante la copia")
+        return attachment
+
+# Global attachment store
+attachments = AttachmentStore(os.path.join(DATA_DIR, "attachments"))
+
+def store_attachment(job: Job, path: str, kind: Optional[str] = None) -> Dict:
+    return attachments.put_file(path, progress=job.report_progress, kind=kind)
+
+# PDF preview rendering
+PREVIEW_CACHE_MAX_BYTES = 512 * 1024 * 1024
+PREVIEW_MAX_PAGES = 6
+THUMBNAIL_ZOOM = 0.3
+PREVIEW_ZOOM = 0.6
+
+def render_pdf_previews(pdf_path: str, out_dir: str, max_pages: int = PREVIEW_MAX_PAGES,
+                        thumbnail_zoom: float = THUMBNAIL_ZOOM, preview_zoom: float = PREVIEW_ZOOM) -> List[str]:
+    """Render the first-page thumbnail and low-resolution page previews (runs in the process pool)"""
+    tmp_dir = tempfile.mkdtemp(dir=os.path.dirname(out_dir))
+    try:
+        with pymupdf.open(pdf_path) as doc:
+            doc[0].get_pixmap(matrix=pymupdf.Matrix(thumbnail_zoom, thumbnail_zoom)).save(
+                os.path.join(tmp_dir, "thumbnail.png"))
+            for i in range(min(max_pages, doc.page_count)):
+                doc[i].get_pixmap(matrix=pymupdf.Matrix(preview_zoom, preview_zoom)).save(
+                    os.path.join(tmp_dir, f"page-{i:03d}.png"))
+        # Publish all files at once so readers never see a half-rendered entry
+        os.replace(tmp_dir, out_dir)
+    except Exception:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        if not os.path.isdir(out_dir):
+            raise
+    return sorted(os.listdir(out_dir))
+
+class PreviewCache:
+    """On-disk cache of rendered PDF previews keyed by attachment hash, evicted by total size"""
+    def __init__(self, root: str, max_bytes: int = PREVIEW_CACHE_MAX_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._waiting: Dict[str, List[Callable]] = {}
+        self._lock = threading.Lock()
+
+    def dir_for(self, digest: str) -> str:
+        return os.path.join(self.root, digest)
+
+    def get(self, digest: str) -> Optional[Dict]:
+        """Return {'thumbnail': path, 'pages': [paths]} if already rendered"""
+        entry_dir = self.dir_for(digest)
+        try:
+            names = sorted(os.listdir(entry_dir))
+            # Touch the entry so eviction treats it as recently used
+            os.utime(entry_dir)
+        except FileNotFoundError:
+            return None
+        return {
+            "thumbnail": os.path.join(entry_dir, "thumbnail.png"),
+            "pages": [os.path.join(entry_dir, n) for n in names if n.startswith("page-")]
+        }
+
+    def request(self, digest: str, page: Optional[ft.Page] = None, on_ready: Optional[Callable] = None):
+        """Render previews in the background unless cached; on_ready(entry) runs once they exist.
+
+        on_ready receives None when the previews could not be rendered.
+        """
+        cached = self.get(digest)
+        if cached is not None:
+            if on_ready is not None:
+                on_ready(cached)
+            return
+        if pymupdf is None:
+            return
+        
+        with self._lock:
+            waiting = self._waiting.get(digest)
+            if waiting is not None:
+                # Already rendering for another card or session
+                if on_ready is not None:
+                    waiting.append(on_ready)
+                return
+            self._waiting[digest] = [on_ready] if on_ready is not None else []
+        
+        os.makedirs(self.root, exist_ok=True)
+        try:
+            jobs.submit("Generar vista previa", render_pdf_previews, attachments.path_for(digest),
+                        self.dir_for(digest), page=page, kind="process",
+                        on_result=lambda names: self._finish(digest),
+                        on_error=lambda error: self._finish(digest))
+        except JobQueueFullError as e:
+            print(f"Skipped preview of {digest[:12]}: {e}")
+            self._finish(digest)
+
+    def _finish(self, digest: str):
+        with self._lock:
+            callbacks = self._waiting.pop(digest, [])
+        self.evict()
+        # None tells the waiting views to stop showing progress
+        entry = self.get(digest)
+        for callback in callbacks:
+            try:
+                callback(entry)
+            except Exception as e:
+                print(f"Error delivering preview: {e}")
+
+    def evict(self):
+        """Drop least recently used entries until the cache fits in max_bytes"""
+        entries = []
+        total = 0
+        for name in os.listdir(self.root):
+            entry_dir = os.path.join(self.root, name)
+            if not os.path.isdir(entry_dir) or name in self._waiting:
+                continue
+            size = sum(e.stat().st_size for e in os.scandir(entry_dir) if e.is_file())
+            entries.append((os.stat(entry_dir).st_mtime, size, entry_dir))
+            total += size
+        for _, size, entry_dir in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(entry_dir, ignore_errors=True)
+            total -= size
+
+# Global PDF preview cache
+previews = PreviewCache(os.path.join(DATA_DIR, "previews"))
+
+# STEP (ISO 10303-21) metadata extraction
+STEP_HEADER_MAX_BYTES = 1024 * 1024
+STEP_SCAN_OVERLAP = 16 * 1024
+STEP_MAX_PRODUCTS = 100
+
+STEP_STRING = rb"'((?:[^']|'')*)'"
+STEP_PRODUCT_RE = re.compile(rb"\bPRODUCT\s*\(\s*" + STEP_STRING + rb"\s*,\s*" + STEP_STRING + rb"\s*,\s*" + STEP_STRING)
+STEP_SI_UNIT_RE = re.compile(rb"\bSI_UNIT\s*\(\s*(?:\.(\w+)\.|\$|\*)\s*,\s*\.(\w+)\.\s*\)")
+STEP_CONVERSION_UNIT_RE = re.compile(rb"\bCONVERSION_BASED_UNIT\s*\(\s*" + STEP_STRING)
+
+def _step_strings(text: bytes) -> List[str]:
+    return [m.group(1).replace(b"''", b"'").decode("latin-1") for m in re.finditer(STEP_STRING, text)]
+
+def extract_step_metadata(path: str, chunk_size: int = ATTACHMENT_CHUNK_SIZE) -> Dict:
+    """Read the HEADER section and the product and unit entities of a STEP file.
+
+    The file is memory mapped and scanned chunk by chunk with a small overlap,
+    so memory use does not depend on the size of the assembly.
+    """
+    metadata = {
+        "file_name": "", "time_stamp": "", "preprocessor": "", "originating_system": "",
+        "description": "", "schemas": [], "products": [], "units": []
+    }
+    with open(path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        if size == 0:
+            raise ValueError("Archivo STEP vacío")
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            if data.find(b"ISO-10303-21", 0, 1024) == -1:
+                raise ValueError("El archivo no es un STEP ISO-10303-21")
+            header_start = data.find(b"HEADER;", 0, STEP_HEADER_MAX_BYTES)
+            header_end = data.find(b"ENDSEC;", max(header_start, 0), STEP_HEADER_MAX_BYTES)
+            if header_start == -1 or header_end == -1:
+                raise ValueError("Sección HEADER no encontrada")
+            
+            for statement in data[header_start:header_end].split(b";"):
+                statement = statement.strip()
+                if statement.startswith(b"FILE_NAME"):
+                    strings = _step_strings(statement)
+                    if strings:
+                        metadata["file_name"] = strings[0]
+                        metadata["time_stamp"] = strings[1] if len(strings) > 1 else ""
+                    if len(strings) >= 5:
+                        metadata["preprocessor"] = strings[-3]
+                        metadata["originating_system"] = strings[-2]
+                elif statement.startswith(b"FILE_SCHEMA"):
+                    metadata["schemas"] = _step_strings(statement)
+                elif statement.startswith(b"FILE_DESCRIPTION"):
+                    strings = _step_strings(statement)
+                    metadata["description"] = strings[0] if strings else ""
+            
+            units = set()
+            position = header_end
+            carry = b""
+            while position < size and len(metadata["products"]) < STEP_MAX_PRODUCTS:
+                buffer = carry + data[position:position + chunk_size]
+                position += chunk_size
+                # Matches starting in the overlap are picked up with the next chunk
+                cut = len(buffer) if position >= size else max(len(buffer) - STEP_SCAN_OVERLAP, 0)
+                for m in STEP_PRODUCT_RE.finditer(buffer, 0, len(buffer)):
+                    if m.start() >= cut:
+                        break
+                    product_id, name, description = [g.replace(b"''", b"'").decode("latin-1") for g in m.groups()]
+                    metadata["products"].append({"id": product_id, "name": name, "description": description})
+                for m in STEP_SI_UNIT_RE.finditer(buffer):
+                    if m.start() < cut:
+                        prefix, unit = m.groups()
+                        units.add(" ".join(g.decode("ascii") for g in (prefix, unit) if g))
+                for m in STEP_CONVERSION_UNIT_RE.finditer(buffer):
+                    if m.start() < cut:
+                        units.add(m.group(1).decode("latin-1"))
+                carry = buffer[cut:]
+            metadata["units"] = sorted(units)
+    return metadata
+
+class StepMetadataIndex:
+    """STEP metadata per attachment hash, cached on disk and indexed per project for search"""
+    def __init__(self, root: str):
+        self.root = root
+        self._by_project: Dict[int, Dict[str, Dict]] = {}
+        self._lock = threading.Lock()
+
+    def _cache_path(self, digest: str) -> str:
+        return os.path.join(self.root, f"{digest}.json")
+
+    def get(self, digest: str) -> Optional[Dict]:
+        try:
+            with open(self._cache_path(digest), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def for_project(self, project_id: int) -> Dict[str, Dict]:
+        with self._lock:
+            return dict(self._by_project.get(project_id, {}))
+
+    def request(self, project_id: int, attachment: Dict, page: Optional[ft.Page] = None):
+        """Index the attachment for project_id, extracting it in the process pool if needed"""
+        digest = attachment["sha256"]
+        cached = self.get(digest)
+        if cached is not None:
+            self._index(project_id, digest, cached)
+            return
+        
+        def on_extracted(metadata):
+            os.makedirs(self.root, exist_ok=True)
+            tmp_path = self._cache_path(digest) + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(metadata, f, ensure_ascii=False)
+            os.replace(tmp_path, self._cache_path(digest))
+            self._index(project_id, digest, metadata)
+        
+        jobs.submit(f"Leer STEP {attachment['name']}", extract_step_metadata, attachments.path_for(digest),
+                    page=page, kind="process", on_result=on_extracted)
+
+    def _index(self, project_id: int, digest: str, metadata: Dict):
+        with self._lock:
+            project_metadata = self._by_project.setdefault(project_id, {})
+            project_metadata[digest] = metadata
+            text = "\n".join(
+                " ".join([m["file_name"], m["originating_system"], m["description"]] +
+                         [f"{p['id']} {p['name']} {p['description']}" for p in m["products"]])
+                for m in project_metadata.values()
+            )
+        state.index_text(project_id, "step", text)
+
+# Global STEP metadata index
+step_metadata = StepMetadataIndex(os.path.join(DATA_DIR, "step_metadata"))
+
+# PDF text extraction
+PDF_TEXT_MAX_CHARS = 200000
+
+def extract_pdf_text(pdf_path: str, out_path: str, max_chars: int = PDF_TEXT_MAX_CHARS) -> str:
+    """Extract the text layer of a drawing PDF into out_path (runs in the process pool)"""
+    parts = []
+    length = 0
+    with pymupdf.open(pdf_path) as doc:
+        for pdf_page in doc:
+            text = pdf_page.get_text()
+            parts.append(text)
+            length += len(text)
+            if length >= max_chars:
+                break
+    text = "\n".join(parts)[:max_chars]
+    # A unique temporary name, so two workers extracting the same PDF never share one
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(out_path), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(text)
+        os.replace(tmp_path, out_path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return out_path
+
+class PdfTextIndex:
+    """Text of attached PDFs cached per content hash and fed into the project search index"""
+    def __init__(self, root: str):
+        self.root = root
+        self._by_project: Dict[int, Dict[str, str]] = {}
+        # Project ids waiting for a digest that is being extracted
+        self._waiting: Dict[str, List[int]] = {}
+        self._lock = threading.Lock()
+
+    def _cache_path(self, digest: str) -> str:
+        return os.path.join(self.root, f"{digest}.txt")
+
+    def get(self, digest: str) -> Optional[str]:
+        try:
+            with open(self._cache_path(digest), "r", encoding="utf-8") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def request(self, project_id: int, attachment: Dict, page: Optional[ft.Page] = None):
+        digest = attachment["sha256"]
+        cached = self.get(digest)
+        if cached is not None:
+            # Re-attaching a known drawing reuses the earlier extraction
+            self._index(project_id, digest, cached)
+            return
+        if pymupdf is None:
+            return
+        
+        with self._lock:
+            waiting = self._waiting.get(digest)
+            if waiting is not None:
+                # Already extracting for another project or session
+                waiting.append(project_id)
+                return
+            self._waiting[digest] = [project_id]
+        
+        os.makedirs(self.root, exist_ok=True)
+        try:
+            jobs.submit(f"Extraer texto {attachment['name']}", extract_pdf_text, attachments.path_for(digest),
+                        self._cache_path(digest), page=page, kind="process",
+                        on_result=lambda path: self._finish(digest),
+                        on_error=lambda error: self._finish(digest))
+        except JobQueueFullError:
+            with self._lock:
+                self._waiting.pop(digest, None)
+            raise
+
+    def _finish(self, digest: str):
+        with self._lock:
+            project_ids = self._waiting.pop(digest, [])
+        text = self.get(digest)
+        if text is None:
+            print(f"No text extracted for {digest[:12]}; {len(project_ids)} project(s) not indexed")
+            return
+        for project_id in project_ids:
+            self._index(project_id, digest, text)
+
+    def prune(self, project_id: int, digests: Set[str]):
+        """Forget text from PDFs no longer attached to the project"""
+        with self._lock:
+            project_texts = self._by_project.get(project_id, {})
+            if not set(project_texts) - digests:
+                return
+            for digest in set(project_texts) - digests:
+                del project_texts[digest]
+            joined = "\n".join(project_texts.values())
+        state.index_text(project_id, "pdf", joined)
+
+    def _index(self, project_id: int, digest: str, text: str):
+        with self._lock:
+            project_texts = self._by_project.setdefault(project_id, {})
+            project_texts[digest] = text
+            joined = "\n".join(project_texts.values())
+        state.index_text(project_id, "pdf", joined)
+
+# Global PDF text index
+pdf_text = PdfTextIndex(os.path.join(DATA_DIR, "pdf_text"))
+
+def index_project_attachments(page: Optional[ft.Page], project: ProjectInfo):
+    """Queue background extraction of searchable data from the project's attachments"""
+    pdf_text.prune(project.id, {a["sha256"] for a in project.technical_drawings_pdf})
+    for attachment in project.technical_drawings_step:
+        try:
+            step_metadata.request(project.id, attachment, page=page)
+        except JobQueueFullError as e:
+            print(f"Skipped indexing {attachment['name']}: {e}")
+    for attachment in project.technical_drawings_pdf:
+        try:
+            pdf_text.request(project.id, attachment, page=page)
+        except JobQueueFullError as e:
+            print(f"Skipped indexing {attachment['name']}: {e}")
+
+ATTACHMENT_FIELDS = {"technical_drawings_pdf", "technical_drawings_step"}
+
+def on_attachments_changed(event: str, project_id: int, changes: Dict):
+    # New projects, edits and undo/revert of the drawing lists all re-index
+    if event == "added" or ATTACHMENT_FIELDS.intersection(changes):
+        project = state.get_project(project_id)
+        if project is not None:
+            index_project_attachments(None, project)
+
+state.add_listener(on_attachments_changed)
+
+# Web uploads (requires FLET_SECRET_KEY to be set when running as a web app)
+UPLOAD_DIR = os.path.join(DATA_DIR, "uploads")
+UPLOAD_URL_EXPIRES = 3600
+MAX_CONCURRENT_UPLOADS_PER_SESSION = 2
+MAX_UPLOAD_ATTEMPTS = 3
+
+class IncompleteTransferError(Exception):
+    """Raised when fewer bytes arrived than the browser announced; the upload can be retried"""
+
+def ingest_upload(job: Job, upload_path: str, name: str, expected_size: int, kind: Optional[str] = None) -> Dict:
+    """Stream a finished upload into the attachment store after checking its length"""
+    received = os.path.getsize(upload_path)
+    if expected_size and received != expected_size:
+        raise IncompleteTransferError(f"Transferencia incompleta ({received} de {expected_size} bytes)")
+    try:
+        attachment = attachments.put_file(upload_path, progress=job.report_progress, kind=kind, name=name)
+    finally:
+        os.remove(upload_path)
+    return attachment
+
+@dataclass
+class UploadTask:
+    key: str
+    name: str
+    size: int
+    picker: Any
+    on_complete: Callable
+    on_failed: Callable
+    kind: Optional[str] = None
+    progress: float = 0.0
+    attempts: int = 0
+    status: str = "En cola"
+
+class UploadManager:
+    """Per-session queue of web uploads.
+
+    At most MAX_CONCURRENT_UPLOADS_PER_SESSION transfers run at once so large
+    CAD files from one user cannot starve the others. Dropped or truncated
+    transfers are retried, and finished files are streamed into the
+    attachment store, which hashes them.
+    """
+    def __init__(self, page: ft.Page, max_concurrent: int = MAX_CONCURRENT_UPLOADS_PER_SESSION):
+        self.page = page
+        self.max_concurrent = max_concurrent
+        self.on_change: Optional[Callable] = None
+        self._queue = deque()
+        # Keyed by task.key so files sharing a name are tracked separately
+        self._active: Dict[str, UploadTask] = {}
+        self._lock = threading.Lock()
+
+    def tasks(self) -> List[UploadTask]:
+        with self._lock:
+            return list(self._active.values()) + list(self._queue)
+
+    def enqueue(self, picker: ft.FilePicker, file, on_complete: Callable, on_failed: Callable,
+                kind: Optional[str] = None):
+        task = UploadTask(
+            key=f"{self.page.session_id}/{uuid.uuid4().hex}/{file.name}",
+            name=file.name,
+            size=file.size,
+            picker=picker,
+            on_complete=on_complete,
+            on_failed=on_failed,
+            kind=kind
+        )
+        with self._lock:
+            self._queue.append(task)
+        self._pump()
+
+    def _pump(self):
+        started = []
+        with self._lock:
+            waiting = deque()
+            while self._queue and len(self._active) < self.max_concurrent:
+                task = self._queue.popleft()
+                if self._find_active(task.picker, task.name) is not None:
+                    # Upload events only carry the file name, so same-named files go one at a time
+                    waiting.append(task)
+                    continue
+                task.attempts += 1
+                task.status = "Subiendo"
+                task.progress = 0.0
+                self._active[task.key] = task
+                started.append(task)
+            self._queue.extendleft(reversed(waiting))
+        for task in started:
+            task.picker.upload([ft.FilePickerUploadFile(
+                task.name,
+                upload_url=self.page.get_upload_url(task.key, UPLOAD_URL_EXPIRES)
+            )])
+        self._changed()
+
+    def _find_active(self, picker: ft.FilePicker, name: str) -> Optional[UploadTask]:
+        for task in self._active.values():
+            if task.picker is picker and task.name == name:
+                return task
+        return None
+
+    def handle_event(self, picker: ft.FilePicker, e: ft.FilePickerUploadEvent):
+        with self._lock:
+            task = self._find_active(picker, e.file_name)
+        if task is None:
+            return
+        
+        if e.error:
+            self._retry(task, e.error)
+        elif e.progress is not None and e.progress >= 1.0:
+            task.status = "Verificando"
+            try:
+                jobs.submit(f"Ensamblar {task.name}", ingest_upload, os.path.join(UPLOAD_DIR, task.key),
+                            task.name, task.size, task.kind, page=self.page,
+                            on_result=lambda attachment: self._complete(task, attachment),
+                            on_error=lambda error: self._upload_error(task, error))
+            except JobQueueFullError as ex:
+                self._fail(task, str(ex))
+        elif e.progress is not None:
+            task.progress = e.progress
+        self._changed()
+
+    def _upload_error(self, task: UploadTask, error: Exception):
+        # A file with the wrong content will not get better by sending it again
+        if isinstance(error, IncompleteTransferError):
+            self._retry(task, str(error))
+        else:
+            self._fail(task, str(error))
+
+    def _retry(self, task: UploadTask, error: str):
+        with self._lock:
+            self._active.pop(task.key, None)
+            if task.attempts < MAX_UPLOAD_ATTEMPTS:
+                # Flet restarts the transfer from the beginning; the partial file is overwritten
+                task.status = "Reintentando"
+                self._queue.appendleft(task)
+                retry = True
+            else:
+                retry = False
+        if retry:
+            print(f"Upload of {task.name} failed ({error}), retrying")
+            self._pump()
+        else:
+            self._fail(task, error)
+
+    def _fail(self, task: UploadTask, error: str):
+        with self._lock:
+            self._active.pop(task.key, None)
+        try:
+            os.remove(os.path.join(UPLOAD_DIR, task.key))
+        except FileNotFoundError:
+            pass
+        task.on_failed(error)
+        self._pump()
+
+    def _complete(self, task: UploadTask, attachment: Dict):
+        with self._lock:
+            self._active.pop(task.key, None)
+        task.on_complete(attachment)
+        self._pump()
+
+    def _changed(self):
+        if self.on_change is not None:
+            self.on_change()
+
+class PortfolioColumns:
+    """Numeric project fields stored column-wise so engines can evaluate the whole portfolio with NumPy"""
+    def __init__(self, fields: Dict[str, Callable[[ProjectInfo], float]]):
+        self.fields = fields
+        self.ids: List[int] = []
+        self._rows: Dict[int, int] = {}
+        self._columns = {name: np.zeros(64) for name in fields}
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def row(self, project_id: int) -> Optional[int]:
+        return self._rows.get(project_id)
+
+    def set(self, project: ProjectInfo) -> int:
+        row = self._rows.get(project.id)
+        if row is None:
+            row = len(self.ids)
+            if row == len(next(iter(self._columns.values()))):
+                # Grow geometrically so adding projects stays amortized O(1)
+                for name, column in self._columns.items():
+                    self._columns[name] = np.concatenate([column, np.zeros(len(column))])
+            self.ids.append(project.id)
+            self._rows[project.id] = row
+        for name, extract in self.fields.items():
+            self._columns[name][row] = extract(project)
+        return row
+
+    def __getitem__(self, name: str) -> np.ndarray:
+        return self._columns[name][:len(self.ids)]
+
+def as_fraction(percentage):
+    """OEE has no unit in the form and is entered either as 85 or 0.85"""
+    return np.where(percentage > 1, percentage / 100.0, percentage)
+
+def percent(value):
+    """Fields labelled (%), such as scrap and margin; 1 means 1 %, not 100 %"""
+    return np.asarray(value, dtype=float) / 100.0
+
+CAPACITY_FIELDS = VOLUME_FIELDS | {
+    "tool_characteristics_cavities", "strokes_per_minute", "oee",
+    "hours_per_shift", "press_number", "production_line"
+}
+
+class CapacityEngine:
+    """Press hours, shifts per week and utilization for every project, aggregated per press and line.
+
+    Inputs are kept in PortfolioColumns and refreshed one row at a time when a
+    project changes; the whole portfolio is then recomputed in one vectorized
+    pass the next time results are read.
+    """
+    def __init__(self):
+        self._press_codes: Dict[str, int] = {}
+        self._line_codes: Dict[str, int] = {}
+        self.columns = PortfolioColumns({
+            "volume": annual_volume,
+            "cavities": lambda p: p.tool_characteristics_cavities,
+            "spm": lambda p: p.strokes_per_minute,
+            "oee": lambda p: p.oee,
+            "hours_per_shift": lambda p: p.hours_per_shift,
+            "press": lambda p: self._code(self._press_codes, p.press_number),
+            "line": lambda p: self._code(self._line_codes, p.production_line),
+        })
+        self._results = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _code(codes: Dict[str, int], value: str) -> int:
+        # Code 0 is reserved for projects without a press or line
+        value = (value or "").strip()
+        if not value:
+            return 0
+        return codes.setdefault(value, len(codes) + 1)
+
+    def load(self, projects: List[ProjectInfo]):
+        with self._lock:
+            for project in projects:
+                self.columns.set(project)
+            self._results = None
+
+    def on_change(self, event: str, project_id: int, changes: Dict):
+        if event == "added" or CAPACITY_FIELDS.intersection(changes):
+            project = state.get_project(project_id)
+            if project is not None:
+                with self._lock:
+                    self.columns.set(project)
+                    self._results = None
+
+    def _compute(self) -> Dict:
+        c = self.columns
+        with np.errstate(divide="ignore", invalid="ignore"):
+            strokes_per_year = c["volume"] / np.maximum(c["cavities"], 1)
+            strokes_per_hour = c["spm"] * 60.0 * as_fraction(c["oee"])
+            press_hours = np.where(strokes_per_hour > 0, strokes_per_year / strokes_per_hour, np.nan)
+            hours_per_week = press_hours / WORKING_WEEKS_PER_YEAR
+            hours_per_shift = np.where(c["hours_per_shift"] > 0, c["hours_per_shift"], DEFAULT_HOURS_PER_SHIFT)
+            shifts_per_week = hours_per_week / hours_per_shift
+            utilization = hours_per_week / PRESS_HOURS_PER_WEEK
+        
+        # Projects missing SPM or OEE do not contribute load
+        load = np.nan_to_num(hours_per_week)
+        press = c["press"].astype(int)
+        line = c["line"].astype(int)
+        press_hours_per_week = np.bincount(press, weights=load, minlength=len(self._press_codes) + 1)
+        line_hours_per_week = np.bincount(line, weights=load, minlength=len(self._line_codes) + 1)
+        return {
+            "press_hours": press_hours,
+            "shifts_per_week": shifts_per_week,
+            "utilization": utilization,
+            "press_hours_per_week": press_hours_per_week,
+            "line_hours_per_week": line_hours_per_week,
+        }
+
+    def results(self) -> Dict:
+        with self._lock:
+            if self._results is None:
+                self._results = self._compute()
+            return self._results
+
+    def project_capacity(self, project_id: int) -> Optional[Dict]:
+        results = self.results()
+        row = self.columns.row(project_id)
+        if row is None or np.isnan(results["press_hours"][row]):
+            return None
+        press = int(self.columns["press"][row])
+        return {
+            "press_hours_per_year": float(results["press_hours"][row]),
+            "shifts_per_week": float(results["shifts_per_week"][row]),
+            "utilization": float(results["utilization"][row]),
+            "press_utilization": float(results["press_hours_per_week"][press] / PRESS_HOURS_PER_WEEK) if press else None,
+        }
+
+    def press_loads(self) -> List[Dict]:
+        hours = self.results()["press_hours_per_week"]
+        return [{"press": name, "hours_per_week": float(hours[code]),
+                 "utilization": float(hours[code] / PRESS_HOURS_PER_WEEK)}
+                for name, code in sorted(self._press_codes.items())]
+
+    def line_loads(self) -> List[Dict]:
+        hours = self.results()["line_hours_per_week"]
+        return [{"line": name, "hours_per_week": float(hours[code])}
+                for name, code in sorted(self._line_codes.items())]
+
+# Global capacity engine
+capacity = CapacityEngine()
+capacity.load(state.projects)
+state.add_listener(capacity.on_change)
+
+def parse_date(value: str) -> Optional[datetime.date]:
+    try:
+        return datetime.date.fromisoformat(value.strip())
+    except (AttributeError, ValueError):
+        return None
+
+# Press loading plan
+PLANNING_HORIZON_WEEKS = 104
+PRESS_CATALOG_PATH = os.path.join(DATA_DIR, "presses.json")
+PLANNED_STATUSES = {ProjectStatus.APPROVED.value, ProjectStatus.FEASIBLE.value}
+SCHEDULE_FIELDS = CAPACITY_FIELDS | {"status", "press_tonnage", "target_date_sop", "delivery_date", "project_life_years"}
+
+@dataclass
+class PressInfo:
+    press_number: str
+    production_line: str = ""
+    tonnage: float = 0.0
+    hours_per_week: float = PRESS_HOURS_PER_WEEK
+
+def load_press_catalog(path: str = PRESS_CATALOG_PATH, projects: Optional[List[ProjectInfo]] = None) -> List[PressInfo]:
+    """Read the press catalog, or derive one from the presses projects already mention"""
+    if os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as f:
+            return [PressInfo(**press) for press in json.load(f)]
+    
+    presses: Dict[str, PressInfo] = {}
+    for project in projects or []:
+        name = project.press_number.strip()
+        if not name:
+            continue
+        press = presses.setdefault(name, PressInfo(press_number=name))
+        press.tonnage = max(press.tonnage, project.press_tonnage)
+        press.production_line = press.production_line or project.production_line
+    return list(presses.values())
+
+class PressScheduler:
+    """Assigns approved and feasible projects to presses within tonnage and weekly hours.
+
+    Load is kept as a presses x weeks matrix. When a project changes only that
+    project is taken off its press and placed again; plan(full=True) rebuilds
+    everything, largest demand first.
+    """
+    def __init__(self, presses: List[PressInfo], horizon_weeks: int = PLANNING_HORIZON_WEEKS):
+        self.horizon_weeks = horizon_weeks
+        self._lock = threading.Lock()
+        self.set_presses(presses)
+
+    def set_presses(self, presses: List[PressInfo]):
+        with self._lock:
+            self.presses = presses
+            self._press_index = {p.press_number: i for i, p in enumerate(presses)}
+            self._hours = np.array([p.hours_per_week for p in presses], dtype=float)
+            self._tonnage = np.array([p.tonnage for p in presses], dtype=float)
+            today = datetime.date.today()
+            self.start_week = today - datetime.timedelta(days=today.weekday())
+            self._load = np.zeros((len(presses), self.horizon_weeks))
+            # project id -> (press index or -1, hours per week, first week, end week)
+            self._placements: Dict[int, Tuple[int, float, int, int]] = {}
+            # project id -> press_number the project had when it was placed
+            self._planned_from: Dict[int, str] = {}
+            self._dirty = set()
+            self._needs_full_plan = True
+
+    def on_change(self, event: str, project_id: int, changes: Dict):
+        if event == "added" or SCHEDULE_FIELDS.intersection(changes):
+            with self._lock:
+                if event == "added" or "press_number" in changes:
+                    project = state.get_project(project_id)
+                    if project is not None:
+                        self._add_press(project)
+                self._dirty.add(project_id)
+
+    def _add_press(self, project: ProjectInfo):
+        """Add the press a project names to the catalog if it is not there yet"""
+        name = project.press_number.strip()
+        if not name or name in self._press_index:
+            return
+        self.presses = self.presses + [PressInfo(press_number=name, production_line=project.production_line,
+                                                 tonnage=project.press_tonnage)]
+        self._press_index[name] = len(self.presses) - 1
+        self._hours = np.append(self._hours, PRESS_HOURS_PER_WEEK)
+        self._tonnage = np.append(self._tonnage, project.press_tonnage)
+        self._load = np.vstack([self._load, np.zeros(self.horizon_weeks)])
+
+    def _week_index(self, date: Optional[datetime.date]) -> int:
+        if date is None:
+            return 0
+        return int(np.clip((date - self.start_week).days // 7, 0, self.horizon_weeks))
+
+    def _demand(self, project: ProjectInfo) -> Tuple[float, int, int]:
+        if project.status not in PLANNED_STATUSES:
+            return 0.0, 0, 0
+        project_capacity = capacity.project_capacity(project.id)
+        if project_capacity is None:
+            return 0.0, 0, 0
+        start_date = parse_date(project.target_date_sop) or parse_date(project.delivery_date)
+        start = self._week_index(start_date)
+        if project.project_life_years and start_date is not None:
+            end = self._week_index(start_date + datetime.timedelta(weeks=52 * project.project_life_years))
+        else:
+            end = self.horizon_weeks
+        return project_capacity["press_hours_per_year"] / WORKING_WEEKS_PER_YEAR, start, end
+
+    def _remove(self, project_id: int):
+        placement = self._placements.pop(project_id, None)
+        if placement is not None:
+            press, demand, start, end = placement
+            if press >= 0:
+                self._load[press, start:end] -= demand
+
+    def _place(self, project: ProjectInfo):
+        demand, start, end = self._demand(project)
+        if demand <= 0 or start >= end or not self.presses:
+            return
+        
+        eligible = (self._tonnage == 0) | (self._tonnage >= project.press_tonnage)
+        peak = self._load[:, start:end].max(axis=1)
+        headroom = self._hours - peak - demand
+        fits = eligible & (headroom >= 0)
+        preferred = self._press_index.get(project.press_number.strip(), -1)
+        
+        if preferred >= 0 and fits[preferred]:
+            press = preferred
+        elif fits.any():
+            # Best fit: the press left with the least spare hours
+            press = int(np.argmin(np.where(fits, headroom, np.inf)))
+        elif eligible.any():
+            # Overloaded either way; choose the press that overloads least
+            press = int(np.argmax(np.where(eligible, headroom, -np.inf)))
+        else:
+            press = -1
+        
+        if press >= 0:
+            self._load[press, start:end] += demand
+        self._placements[project.id] = (press, demand, start, end)
+        self._planned_from[project.id] = project.press_number
+
+    def plan(self, full: bool = False) -> Dict:
+        with self._lock:
+            if full or self._needs_full_plan:
+                self._load[:] = 0
+                self._placements.clear()
+                candidates = [p for p in state.projects if p.status in PLANNED_STATUSES]
+                for project in sorted(candidates, key=lambda p: self._demand(p)[0], reverse=True):
+                    self._place(project)
+                self._needs_full_plan = False
+            else:
+                for project_id in self._dirty:
+                    self._remove(project_id)
+                    project = state.get_project(project_id)
+                    if project is not None:
+                        self._place(project)
+            self._dirty.clear()
+            return self._snapshot()
+
+    def _snapshot(self) -> Dict:
+        assignments = {}
+        for project_id, (press, demand, start, end) in self._placements.items():
+            assignments[project_id] = {
+                "press": self.presses[press] if press >= 0 else None,
+                "hours_per_week": demand,
+                "planned_from": self._planned_from.get(project_id, "")
+            }
+        
+        overloads = []
+        excess = self._load - self._hours[:, None]
+        for press, week in np.argwhere(excess > 1e-9):
+            overloads.append({
+                "press": self.presses[press].press_number,
+                "week": self.start_week + datetime.timedelta(weeks=int(week)),
+                "load": float(self._load[press, week]),
+                "available": float(self._hours[press])
+            })
+        
+        return {
+            "assignments": assignments,
+            "peak_utilization": {
+                p.press_number: float(self._load[i].max() / self._hours[i]) if self._hours[i] else 0.0
+                for i, p in enumerate(self.presses)
+            },
+            "overloads": sorted(overloads, key=lambda o: (o["week"], o["press"]))
+        }
+
+    def apply_plan(self, plan: Dict, author: Optional[str] = None) -> List[int]:
+        """Write the planned press and line back to the projects.
+
+        Projects whose press changed after the plan was made are skipped and
+        their ids returned.
+        """
+        skipped = []
+        for project_id, assignment in plan["assignments"].items():
+            press = assignment["press"]
+            project = state.get_project(project_id)
+            if press is None or project is None:
+                continue
+            updates = {"press_number": press.press_number}
+            if press.production_line:
+                updates["production_line"] = press.production_line
+            try:
+                state.update_project(project_id, updates, author=author,
+                                     expected_values={"press_number": assignment["planned_from"]})
+            except ProjectConflictError:
+                skipped.append(project_id)
+        return skipped
+
+# Global press scheduler
+scheduler = PressScheduler(load_press_catalog(projects=state.projects))
+state.add_listener(scheduler.on_change)
+
+# Steel coil assumptions (dimensions are entered in mm)
+STEEL_DENSITY_KG_PER_MM3 = 7.65e-6
+MASTER_COIL_WEIGHT_KG = 10000.0
+SLITTING_EDGE_TRIM_MM = 10.0
+
+COIL_FIELDS = VOLUME_FIELDS | {
+    "steel_thickness", "slitted_coil_width", "master_coil_width", "tool_characteristics_pitch",
+    "tool_characteristics_cavities", "process_scrap_percentage"
+}
+
+class CoilEstimator:
+    """Steel kg per set, master coils per year and slitting yield for every project.
+
+    Follows the CapacityEngine pattern: rows are refreshed only when one of
+    COIL_FIELDS changes and the cached results are dropped at the same time.
+    """
+    def __init__(self):
+        self.columns = PortfolioColumns({
+            "thickness": lambda p: p.steel_thickness,
+            "slit_width": lambda p: p.slitted_coil_width,
+            "master_width": lambda p: p.master_coil_width,
+            "pitch": lambda p: p.tool_characteristics_pitch,
+            "cavities": lambda p: p.tool_characteristics_cavities,
+            "scrap": lambda p: p.process_scrap_percentage,
+            "volume": annual_volume,
+        })
+        self._results = None
+        self._lock = threading.Lock()
+
+    def load(self, projects: List[ProjectInfo]):
+        with self._lock:
+            for project in projects:
+                self.columns.set(project)
+            self._results = None
+
+    def on_change(self, event: str, project_id: int, changes: Dict):
+        if event == "added" or COIL_FIELDS.intersection(changes):
+            project = state.get_project(project_id)
+            if project is not None:
+                with self._lock:
+                    self.columns.set(project)
+                    self._results = None
+
+    def _compute(self) -> Dict:
+        c = self.columns
+        with np.errstate(divide="ignore", invalid="ignore"):
+            # One stroke consumes one pitch of slitted strip and yields one set per cavity
+            strip_kg_per_stroke = c["pitch"] * c["slit_width"] * c["thickness"] * STEEL_DENSITY_KG_PER_MM3
+            net_kg_per_set = strip_kg_per_stroke / np.maximum(c["cavities"], 1)
+            scrap = np.clip(percent(c["scrap"]), 0.0, 0.99)
+            kg_per_set = net_kg_per_set / (1.0 - scrap)
+            kg_per_set = np.where(kg_per_set > 0, kg_per_set, np.nan)
+            
+            strips_per_master = np.floor((c["master_width"] - SLITTING_EDGE_TRIM_MM) / c["slit_width"])
+            strips_per_master = np.where((c["slit_width"] > 0) & (strips_per_master > 0), strips_per_master, np.nan)
+            slitting_yield = strips_per_master * c["slit_width"] / c["master_width"]
+            
+            slitted_kg_per_year = kg_per_set * c["volume"]
+            # Without a master width the strip is bought already slitted
+            master_kg_per_year = np.where(np.isnan(slitting_yield), slitted_kg_per_year,
+                                          slitted_kg_per_year / slitting_yield)
+            coils_per_year = master_kg_per_year / MASTER_COIL_WEIGHT_KG
+        return {
+            "kg_per_set": kg_per_set,
+            "strips_per_master": strips_per_master,
+            "slitting_yield": slitting_yield,
+            "steel_kg_per_year": master_kg_per_year,
+            "coils_per_year": coils_per_year,
+        }
+
+    def results(self) -> Dict:
+        with self._lock:
+            if self._results is None:
+                self._results = self._compute()
+            return self._results
+
+    def project_coil(self, project_id: int) -> Optional[Dict]:
+        results = self.results()
+        row = self.columns.row(project_id)
+        if row is None or np.isnan(results["kg_per_set"][row]):
+            return None
+        
+        def value(name):
+            number = results[name][row]
+            return None if np.isnan(number) else float(number)
+        return {name: value(name) for name in results}
+
+# Global coil estimator
+coils = CoilEstimator()
+coils.load(state.projects)
+state.add_listener(coils.on_change)
+
+# Material requirements rollup
+MATERIAL_HORIZON_MONTHS = 60
+RAMP_UP_FRACTION = 0.25
+INACTIVE_STATUSES = {ProjectStatus.NOT_FEASIBLE.value, ProjectStatus.REJECTED.value}
+MATERIAL_FIELDS = COIL_FIELDS | {
+    "aluminum_weight", "glue_primer_quantity", "steel_coating", "status",
+    "target_date_first_parts", "target_date_sop", "project_life_years"
+}
+STEEL = "Acero"
+ALUMINUM = "Aluminio"
+GLUE_PRIMER = "Pegamento/Primer"
+
+class MaterialRollup:
+    """Monthly steel, aluminum and glue/primer demand across active projects.
+
+    Each project's contribution is kept so an edit subtracts the old series and
+    adds the new one instead of rescanning the portfolio. Changes are queued by
+    the state listener and folded in the next time the totals are read.
+    Series are keyed by (material, coating); only steel carries a coating.
+    """
+    def __init__(self, horizon_months: int = MATERIAL_HORIZON_MONTHS):
+        today = datetime.date.today()
+        self.start_month = today.replace(day=1)
+        self.horizon_months = horizon_months
+        self._contributions: Dict[int, Dict[Tuple[str, str], np.ndarray]] = {}
+        self._totals: Dict[Tuple[str, str], np.ndarray] = {}
+        self._dirty = set()
+        self._lock = threading.Lock()
+
+    def load(self, projects: List[ProjectInfo]):
+        with self._lock:
+            self._dirty.update(p.id for p in projects)
+
+    def on_change(self, event: str, project_id: int, changes: Dict):
+        if event == "added" or MATERIAL_FIELDS.intersection(changes):
+            with self._lock:
+                self._dirty.add(project_id)
+
+    def _month_index(self, date: datetime.date) -> int:
+        months = (date.year - self.start_month.year) * 12 + date.month - self.start_month.month
+        return int(np.clip(months, 0, self.horizon_months))
+
+    def _profile(self, project: ProjectInfo) -> Optional[np.ndarray]:
+        """Fraction of the yearly run rate consumed in each month"""
+        sop = parse_date(project.target_date_sop)
+        first_parts = parse_date(project.target_date_first_parts)
+        if sop is None and first_parts is None:
+            return None
+        sop = sop or first_parts
+        profile = np.zeros(self.horizon_months)
+        if first_parts is not None and first_parts < sop:
+            profile[self._month_index(first_parts):self._month_index(sop)] = RAMP_UP_FRACTION
+        if project.project_life_years:
+            end = self._month_index(sop + datetime.timedelta(days=round(365.25 * project.project_life_years)))
+        else:
+            end = self.horizon_months
+        profile[self._month_index(sop):end] = 1.0
+        return profile / 12.0
+
+    def _contribution(self, project: ProjectInfo) -> Dict[Tuple[str, str], np.ndarray]:
+        volume = annual_volume(project)
+        if project.status in INACTIVE_STATUSES or volume <= 0:
+            return {}
+        profile = self._profile(project)
+        if profile is None:
+            return {}
+        
+        yearly = {}
+        project_coil = coils.project_coil(project.id)
+        if project_coil is not None:
+            yearly[(STEEL, project.steel_coating.strip() or "Sin recubrimiento")] = project_coil["steel_kg_per_year"]
+        if project.aluminum_weight > 0:
+            yearly[(ALUMINUM, "")] = project.aluminum_weight * volume
+        if project.glue_primer_quantity > 0:
+            yearly[(GLUE_PRIMER, "")] = project.glue_primer_quantity * volume
+        return {key: profile * quantity for key, quantity in yearly.items()}
+
+    def _apply(self, contribution: Dict[Tuple[str, str], np.ndarray], sign: float):
+        for key, series in contribution.items():
+            total = self._totals.setdefault(key, np.zeros(self.horizon_months))
+            total += sign * series
+
+    def totals(self) -> Dict[Tuple[str, str], np.ndarray]:
+        with self._lock:
+            for project_id in self._dirty:
+                self._apply(self._contributions.pop(project_id, {}), -1.0)
+                project = state.get_project(project_id)
+                if project is not None:
+                    contribution = self._contribution(project)
+                    self._apply(contribution, 1.0)
+                    self._contributions[project_id] = contribution
+            self._dirty.clear()
+            # Subtracting contributions leaves float residue; drop series that have cancelled out
+            return {key: series.copy() for key, series in self._totals.items() if np.abs(series).max() > 1e-6}
+
+    def months(self) -> List[datetime.date]:
+        year, month = self.start_month.year, self.start_month.month
+        return [datetime.date(year + (month - 1 + i) // 12, (month - 1 + i) % 12 + 1, 1)
+                for i in range(self.horizon_months)]
+
+# Global material rollup
+materials = MaterialRollup()
+materials.load(state.projects)
+state.add_listener(materials.on_change)
+
+# Quote risk simulation
+RISK_SAMPLES = 100_000
+RISK_PERCENTILES = (5, 50, 95)
+RISK_CHUNK_ELEMENTS = 4_000_000
+MATERIAL_COST_SHARE = 0.6
+TOOL_TRYOUT_WEEKS = 4
+RISK_FIELDS = {"target_price", "target_margin", "oee", "process_scrap_percentage",
+               "toolmaker_lead_time_weeks", "target_date_sop"}
+
+# Distributions as relative deviations from the quoted value:
+# ("normal", sd) or ("triangular", low, high) with the quoted value as the mode
+RISK_DISTRIBUTIONS = {
+    "price": ("normal", 0.03),
+    "oee": ("triangular", -0.15, 0.05),
+    "scrap": ("triangular", -0.2, 0.5),
+    "lead_time": ("triangular", 0.0, 0.5),
+}
+
+def sample_relative(rng: np.random.Generator, base: np.ndarray, spec: Tuple, samples: int) -> np.ndarray:
+    """Draw samples for each base value (one row per value)"""
+    shape = (len(base), samples)
+    if spec[0] == "normal":
+        factor = rng.normal(1.0, spec[1], shape)
+    elif spec[0] == "triangular":
+        factor = rng.triangular(1.0 + spec[1], 1.0, 1.0 + spec[2], shape)
+    else:
+        raise ValueError(f"Distribución desconocida: {spec[0]}")
+    return base[:, None] * factor
+
+class QuoteRiskSimulator:
+    """Monte Carlo margin-at-risk and on-time SOP probability per project.
+
+    The quoted cost is split into material (sensitive to scrap) and
+    conversion (sensitive to OEE). All projects are sampled together in
+    chunks of RISK_CHUNK_ELEMENTS draws to bound memory. Results are cached
+    per project and dropped when one of RISK_FIELDS changes.
+    """
+    def __init__(self, samples: int = RISK_SAMPLES, distributions: Optional[Dict] = None, seed: Optional[int] = None):
+        self.samples = samples
+        self.distributions = dict(distributions or RISK_DISTRIBUTIONS)
+        self.seed = seed
+        self.columns = PortfolioColumns({
+            "price": lambda p: p.target_price,
+            "margin": lambda p: p.target_margin,
+            "oee": lambda p: p.oee,
+            "scrap": lambda p: p.process_scrap_percentage,
+            "lead_time": lambda p: p.toolmaker_lead_time_weeks,
+            "sop": self._sop_ordinal,
+        })
+        self._cache: Dict[int, Dict] = {}
+        # Bumped when a project's inputs or the settings change, so a run that
+        # started earlier does not cache results computed from old inputs
+        self._generations: Dict[int, int] = {}
+        self._settings_generation = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _sop_ordinal(project: ProjectInfo) -> float:
+        sop = parse_date(project.target_date_sop)
+        return np.nan if sop is None else sop.toordinal()
+
+    def load(self, projects: List[ProjectInfo]):
+        with self._lock:
+            for project in projects:
+                self.columns.set(project)
+            self._cache.clear()
+            self._settings_generation += 1
+
+    def on_change(self, event: str, project_id: int, changes: Dict):
+        if event == "added" or RISK_FIELDS.intersection(changes):
+            project = state.get_project(project_id)
+            if project is not None:
+                with self._lock:
+                    self.columns.set(project)
+                    self._cache.pop(project_id, None)
+                    self._generations[project_id] = self._generations.get(project_id, 0) + 1
+
+    def configure(self, samples: Optional[int] = None, distributions: Optional[Dict] = None):
+        with self._lock:
+            if samples is not None:
+                self.samples = samples
+            if distributions is not None:
+                self.distributions.update(distributions)
+            self._cache.clear()
+            self._settings_generation += 1
+
+    @staticmethod
+    def _simulate(c: Dict[str, np.ndarray], samples: int, distributions: Dict,
+                  rng: np.random.Generator) -> List[Dict]:
+        price = c["price"]
+        margin = percent(c["margin"])
+        oee = as_fraction(c["oee"])
+        scrap = np.clip(percent(c["scrap"]), 0.0, 0.99)
+        lead_time = c["lead_time"]
+        weeks_to_sop = (c["sop"] - datetime.date.today().toordinal()) / 7.0
+        n = samples
+        
+        cost = price * (1.0 - margin)
+        price_s = sample_relative(rng, price, distributions["price"], n)
+        oee_s = np.clip(sample_relative(rng, oee, distributions["oee"], n), 0.01, 1.0)
+        scrap_s = np.clip(sample_relative(rng, scrap, distributions["scrap"], n), 0.0, 0.99)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            material = MATERIAL_COST_SHARE * (1.0 - scrap)[:, None] / (1.0 - scrap_s)
+            conversion = (1.0 - MATERIAL_COST_SHARE) * np.where(oee[:, None] > 0, oee[:, None] / oee_s, 1.0)
+            cost_s = cost[:, None] * (material + conversion)
+            margin_s = (price_s - cost_s) / price_s
+        lead_s = sample_relative(rng, lead_time, distributions["lead_time"], n)
+        on_time = (lead_s + TOOL_TRYOUT_WEEKS <= weeks_to_sop[:, None]).mean(axis=1)
+        
+        percentiles = np.percentile(margin_s, RISK_PERCENTILES, axis=1)
+        delivery = np.percentile(lead_s + TOOL_TRYOUT_WEEKS, RISK_PERCENTILES, axis=1)
+        results = []
+        for i in range(len(price)):
+            results.append({
+                "margin_percentiles": dict(zip(RISK_PERCENTILES, percentiles[:, i].tolist())),
+                "margin_at_risk": float(margin[i] - percentiles[0, i]),
+                "loss_probability": float((margin_s[i] < 0).mean()),
+                "tool_ready_weeks": dict(zip(RISK_PERCENTILES, delivery[:, i].tolist())),
+                "on_time_sop_probability": None if np.isnan(weeks_to_sop[i]) else float(on_time[i]),
+            })
+        return results
+
+    def run(self, project_ids: Optional[List[int]] = None) -> Dict[int, Dict]:
+        """Simulate the given projects (or the whole portfolio), reusing cached results.
+
+        Inputs are copied under the lock and simulated without it, so saves
+        that refresh a project's row never wait for a run.
+        """
+        with self._lock:
+            ids = list(self.columns.ids) if project_ids is None else project_ids
+            results = {pid: self._cache[pid] for pid in ids if pid in self._cache}
+            pending = [pid for pid in ids
+                       if pid not in self._cache and self.columns.row(pid) is not None
+                       and self.columns["price"][self.columns.row(pid)] > 0]
+            rows = np.array([self.columns.row(pid) for pid in pending], dtype=int)
+            inputs = {name: self.columns[name][rows].copy() for name in self.columns.fields}
+            generations = [self._generations.get(pid, 0) for pid in pending]
+            settings_generation = self._settings_generation
+            samples, distributions = self.samples, dict(self.distributions)
+        
+        rng = np.random.default_rng(self.seed)
+        chunk = max(1, RISK_CHUNK_ELEMENTS // max(samples, 1))
+        computed = {}
+        for start in range(0, len(rows), chunk):
+            chunk_inputs = {name: values[start:start + chunk] for name, values in inputs.items()}
+            computed.update(zip(pending[start:start + chunk], self._simulate(chunk_inputs, samples, distributions, rng)))
+        
+        with self._lock:
+            if settings_generation == self._settings_generation:
+                for pid, generation in zip(pending, generations):
+                    if self._generations.get(pid, 0) == generation:
+                        self._cache[pid] = computed[pid]
+        results.update(computed)
+        return {pid: results[pid] for pid in ids if pid in results}
+
+    def project_risk(self, project_id: int) -> Optional[Dict]:
+        return self.run([project_id]).get(project_id)
+
+# Global quote risk simulator
+risk = QuoteRiskSimulator()
+risk.load(state.projects)
+state.add_listener(risk.on_change)
+
+# Feasibility scoring rules
+MIN_TARGET_MARGIN = 0.15
+MAX_REALISTIC_OEE = 0.85
+MAX_ACCEPTABLE_SCRAP = 0.05
+SPEC_TOLERANCE = 0.01
+RESCORE_RETRY_SECONDS = 2.0
+DEFAULT_CATEGORY_WEIGHTS = {"technical": 0.35, "capacity": 0.25, "commercial": 0.25, "schedule": 0.15}
+CATEGORY_LABELS = {"technical": "Técnica", "capacity": "Capacidad", "commercial": "Comercial", "schedule": "Programa"}
+
+@dataclass(frozen=True)
+class FeasibilityRule:
+    """A rule returns a score between 0 and 1, or None when it does not apply"""
+    name: str
+    category: str
+    fields: frozenset
+    evaluate: Callable[[ProjectInfo], Optional[float]]
+
+def _linear(value: float, good: float, bad: float) -> float:
+    """1 at good, 0 at bad, linear in between"""
+    return float(np.clip((value - bad) / (good - bad), 0.0, 1.0))
+
+def rule_press_defined(p: ProjectInfo) -> Optional[float]:
+    if p.press_tonnage <= 0:
+        return 0.0
+    return 1.0 if p.press_number.strip() else 0.5
+
+def rule_steel_defined(p: ProjectInfo) -> Optional[float]:
+    return float(p.steel_thickness > 0) * 0.5 + float(p.slitted_coil_width > 0) * 0.5
+
+def rule_tool_spec_conformance(p: ProjectInfo) -> Optional[float]:
+    pairs = [(p.toolmaker_pitch, p.tool_characteristics_pitch),
+             (p.toolmaker_width, p.tool_characteristics_width),
+             (p.toolmaker_cavities, p.tool_characteristics_cavities)]
+    pairs = [(quoted, required) for quoted, required in pairs if quoted and required]
+    if not pairs:
+        return None
+    return sum(abs(quoted - required) <= SPEC_TOLERANCE * required for quoted, required in pairs) / len(pairs)
+
+def tool_life_millions(p: ProjectInfo) -> float:
+    """Strokes the tool is good for, in millions, by who provides it.
+
+    A customer-provided tool has its remaining life; otherwise the larger of
+    our guarantee and the toolmaker's applies.
+    """
+    if p.tool_provided_by_customer:
+        return p.tool_remaining_life
+    return max(p.tool_life_guarantee, p.toolmaker_life_guarantee)
+
+def rule_tool_life(p: ProjectInfo) -> Optional[float]:
+    if annual_volume(p) <= 0 or p.project_life_years <= 0:
+        return None
+    strokes = annual_volume(p) / max(p.tool_characteristics_cavities, 1) * p.project_life_years
+    return min(1.0, tool_life_millions(p) * 1e6 / strokes)
+
+def rule_press_load(p: ProjectInfo) -> Optional[float]:
+    strokes_per_hour = p.strokes_per_minute * 60.0 * float(as_fraction(p.oee))
+    if annual_volume(p) <= 0 or strokes_per_hour <= 0:
+        return 0.0
+    hours_per_week = annual_volume(p) / max(p.tool_characteristics_cavities, 1) / strokes_per_hour / WORKING_WEEKS_PER_YEAR
+    return _linear(hours_per_week / PRESS_HOURS_PER_WEEK, 0.5, 1.0)
+
+def rule_realistic_oee(p: ProjectInfo) -> Optional[float]:
+    if p.oee <= 0:
+        return 0.0
+    return _linear(float(as_fraction(p.oee)), MAX_REALISTIC_OEE, 0.95)
+
+def rule_margin(p: ProjectInfo) -> Optional[float]:
+    return _linear(float(percent(p.target_margin)), MIN_TARGET_MARGIN, 0.0)
+
+def rule_price_defined(p: ProjectInfo) -> Optional[float]:
+    return float(p.target_price > 0)
+
+def rule_scrap(p: ProjectInfo) -> Optional[float]:
+    return _linear(float(percent(p.process_scrap_percentage)), MAX_ACCEPTABLE_SCRAP, 3 * MAX_ACCEPTABLE_SCRAP)
+
+def rule_milestone_order(p: ProjectInfo) -> Optional[float]:
+    dates = [d for d in (parse_date(p.target_date_first_parts), parse_date(p.target_date_ppap),
+                         parse_date(p.target_date_sop)) if d is not None]
+    if len(dates) < 2:
+        return None
+    return float(dates == sorted(dates))
+
+def rule_tool_lead_time(p: ProjectInfo) -> Optional[float]:
+    due = parse_date(p.target_date_first_parts) or parse_date(p.target_date_sop)
+    if due is None or p.toolmaker_lead_time_weeks <= 0:
+        return None
+    weeks_available = (due - datetime.date.today()).days / 7.0
+    return _linear(weeks_available - p.toolmaker_lead_time_weeks - TOOL_TRYOUT_WEEKS, 0.0, -p.toolmaker_lead_time_weeks)
+
+FEASIBILITY_RULES = (
+    FeasibilityRule("press_defined", "technical", frozenset({"press_tonnage", "press_number"}), rule_press_defined),
+    FeasibilityRule("steel_defined", "technical", frozenset({"steel_thickness", "slitted_coil_width"}), rule_steel_defined),
+    FeasibilityRule("tool_spec_conformance", "technical", frozenset({
+        "toolmaker_pitch", "toolmaker_width", "toolmaker_cavities", "tool_characteristics_pitch",
+        "tool_characteristics_width", "tool_characteristics_cavities"}), rule_tool_spec_conformance),
+    FeasibilityRule("tool_life", "technical", frozenset({
+        "yearly_volume_sets", "expected_volume_sets", "tool_characteristics_cavities", "project_life_years", "tool_life_guarantee",
+        "toolmaker_life_guarantee", "tool_remaining_life", "tool_provided_by_customer"}), rule_tool_life),
+    FeasibilityRule("press_load", "capacity", frozenset({
+        "yearly_volume_sets", "expected_volume_sets", "tool_characteristics_cavities", "strokes_per_minute", "oee"}),
+        rule_press_load),
+    FeasibilityRule("realistic_oee", "capacity", frozenset({"oee"}), rule_realistic_oee),
+    FeasibilityRule("margin", "commercial", frozenset({"target_margin"}), rule_margin),
+    FeasibilityRule("price_defined", "commercial", frozenset({"target_price"}), rule_price_defined),
+    FeasibilityRule("scrap", "commercial", frozenset({"process_scrap_percentage"}), rule_scrap),
+    FeasibilityRule("milestone_order", "schedule", frozenset({
+        "target_date_first_parts", "target_date_ppap", "target_date_sop"}), rule_milestone_order),
+    FeasibilityRule("tool_lead_time", "schedule", frozenset({
+        "target_date_first_parts", "target_date_sop", "toolmaker_lead_time_weeks"}), rule_tool_lead_time),
+)
+
+def evaluate_rules(projects: List[ProjectInfo], rule_names: Optional[List[str]] = None) -> Dict[int, Dict[str, Optional[float]]]:
+    """Evaluate rules for several projects; top-level so it can run in the process pool"""
+    rules = [r for r in FEASIBILITY_RULES if rule_names is None or r.name in rule_names]
+    results = {}
+    for project in projects:
+        values = {}
+        for rule in rules:
+            try:
+                values[rule.name] = rule.evaluate(project)
+            except Exception as e:
+                print(f"Error evaluating rule '{rule.name}' for project {project.id}: {e}")
+                values[rule.name] = None
+        results[project.id] = values
+    return results
+
+class FeasibilityScorer:
+    """Keeps feasibility_score in step with the rules.
+
+    Rule results are cached per project. A change re-evaluates only the rules
+    whose declared fields were touched, then rewrites the score on a worker
+    thread, because state listeners run while the project lock is held.
+    """
+    _RULES = {rule.name: rule for rule in FEASIBILITY_RULES}
+
+    def __init__(self, weights: Optional[Dict[str, float]] = None):
+        self.weights = dict(weights or DEFAULT_CATEGORY_WEIGHTS)
+        self._rules_by_field: Dict[str, List[str]] = {}
+        for rule in FEASIBILITY_RULES:
+            for field_name in rule.fields:
+                self._rules_by_field.setdefault(field_name, []).append(rule.name)
+        self._results: Dict[int, Dict[str, Optional[float]]] = {}
+        # project id -> rule names to re-evaluate (None means all)
+        self._pending: Dict[int, Optional[set]] = {}
+        self._flush_queued = False
+        self._lock = threading.Lock()
+
+    def score_values(self, values: Dict[str, Optional[float]]) -> Tuple[int, Dict[str, float]]:
+        by_category: Dict[str, List[float]] = {}
+        for name, value in values.items():
+            if value is not None:
+                by_category.setdefault(self._RULES[name].category, []).append(value)
+        categories = {c: sum(v) / len(v) for c, v in by_category.items()}
+        weight_total = sum(self.weights.get(c, 0.0) for c in categories)
+        if weight_total <= 0:
+            return 0, categories
+        score = sum(self.weights.get(c, 0.0) * value for c, value in categories.items()) / weight_total
+        return int(round(score * 100)), categories
+
+    def score(self, project: ProjectInfo) -> int:
+        """Score a project that is not in the state yet"""
+        return self.score_values(evaluate_rules([project])[project.id])[0]
+
+    def breakdown(self, project_id: int) -> Dict[str, float]:
+        with self._lock:
+            values = self._results.get(project_id)
+        if values is None:
+            project = state.get_project(project_id)
+            if project is None:
+                return {}
+            values = evaluate_rules([project])[project_id]
+        return self.score_values(values)[1]
 
-# State management class
-class FeasibilityState:
+    def load(self, projects: List[ProjectInfo]):
+        """Score the initial projects on the calling thread"""
+        with self._lock:
+            self._results.update(evaluate_rules(projects))
+        for project in projects:
+            self._write_score(project.id)
+
+    def on_change(self, event: str, project_id: int, changes: Dict):
+        if event == "added":
+            rule_names = None
+        else:
+            rule_names = {name for f in changes for name in self._rules_by_field.get(f, ())}
+            if not rule_names:
+                return
+        self._mark_pending({project_id: rule_names})
+
+    def _mark_pending(self, rules_by_project: Dict[int, Optional[Set[str]]]):
+        """Queue rules to re-evaluate per project; None means every rule"""
+        with self._lock:
+            for project_id, rule_names in rules_by_project.items():
+                if project_id in self._pending:
+                    current = self._pending[project_id]
+                    self._pending[project_id] = None if current is None or rule_names is None else current | rule_names
+                else:
+                    self._pending[project_id] = rule_names
+        self._schedule_flush()
+
+    def _schedule_flush(self):
+        with self._lock:
+            if self._flush_queued or not self._pending:
+                return
+            self._flush_queued = True
+        try:
+            jobs.submit("Recalcular factibilidad", lambda job: self.flush())
+        except JobQueueFullError as e:
+            # Keep the pending rules and try again shortly instead of waiting for the next edit
+            print(f"Feasibility rescore postponed: {e}")
+            with self._lock:
+                self._flush_queued = False
+            timer = threading.Timer(RESCORE_RETRY_SECONDS, self._schedule_flush)
+            timer.daemon = True
+            timer.start()
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self._flush_queued = False
+        for project_id, rule_names in pending.items():
+            project = state.get_project(project_id)
+            if project is None:
+                continue
+            values = evaluate_rules([project], rule_names)[project_id]
+            with self._lock:
+                self._results.setdefault(project_id, {}).update(values)
+            self._write_score(project_id)
+
+    def _write_score(self, project_id: int):
+        with self._lock:
+            values = self._results.get(project_id)
+        project = state.get_project(project_id)
+        if values is None or project is None:
+            return
+        score = self.score_values(values)[0]
+        if score != project.feasibility_score:
+            state.update_project(project_id, {"feasibility_score": score})
+
+    def set_weights(self, weights: Dict[str, float], page: Optional[ft.Page] = None) -> List[Job]:
+        """Change category weights and rescore the whole portfolio in the process pool"""
+        with self._lock:
+            self.weights = dict(weights)
+        
+        projects = list(state.projects)
+        versions = {p.id: p.version for p in projects}
+        
+        def store(results):
+            # Projects edited while the batch ran keep their newer incremental values
+            fresh = {}
+            for project_id, values in results.items():
+                project = state.get_project(project_id)
+                if project is not None and project.version == versions[project_id]:
+                    fresh[project_id] = values
+            with self._lock:
+                self._results.update(fresh)
+            for project_id in results:
+                self._write_score(project_id)
+        
+        def requeue(batch):
+            # Rescored incrementally once the queue has room
+            self._mark_pending({p.id: None for p in batch})
+        
+        chunk = max(1, -(-len(projects) // jobs.process_workers))
+        submitted = []
+        for i in range(0, len(projects), chunk):
+            batch = projects[i:i + chunk]
+            try:
+                submitted.append(jobs.submit("Recalcular factibilidad del portafolio", evaluate_rules, batch,
+                                             page=page, on_result=store, kind="process",
+                                             on_error=lambda error, batch=batch: requeue(batch)))
+            except JobQueueFullError:
+                requeue(batch)
+        return submitted
+
+# Global feasibility scorer
+scoring = FeasibilityScorer()
+scoring.load(state.projects)
+state.add_listener(scoring.on_change)
+
+# What-if sensitivity analysis. Grid values are offsets from each project's
+# current value; OEE and scrap offsets are in percentage points.
+SENSITIVITY_CACHE_SIZE = 64
+DEFAULT_SENSITIVITY_GRIDS = {
+    "oee": (-15.0, -10.0, -5.0, 0.0, 5.0),
+    "strokes_per_minute": (-20.0, -10.0, 0.0, 10.0, 20.0),
+    "hours_per_shift": (-2.0, 0.0, 2.0, 4.0),
+    "process_scrap_percentage": (-1.0, 0.0, 2.0, 5.0),
+}
+SENSITIVITY_METRICS = ("margin", "press_hours_per_year", "shifts_per_week")
+SENSITIVITY_LABELS = {
+    "oee": "OEE", "strokes_per_minute": "SPM", "hours_per_shift": "Horas por turno",
+    "process_scrap_percentage": "Scrap", "margin": "Margen",
+    "press_hours_per_year": "Horas de prensa por año", "shifts_per_week": "Turnos por semana",
+}
+
+def _nearest_zero(values) -> int:
+    return int(np.argmin(np.abs(np.asarray(values))))
+
+class SensitivityAnalyzer:
+    """Sweeps OEE, SPM, hours per shift and scrap for one project or a selection.
+
+    The full grid is evaluated as a single broadcast over
+    (projects, oee, spm, hours, scrap); tornado and heatmap data are sliced
+    from it. Margins are averaged over the selection and hours are summed.
+    Results are cached by a hash of the inputs and the grids.
+    """
     def __init__(self):
-        self.projects = [
-            ProjectInfo(
-                id=1,
-                project_name="LUCID ATLAS IM",
-                customer_name="LUCID",
-                customer_contact="Nidhishri Tapadia",
-                customer_email="NidhishriTapadia@lucidmotors.com",
-                customer_phone="+1 608 692 6323",
-                project_description="Estampado de rotor y estator para motor IM + Die casting RT + Torneado RT + Lavado RT",
-                expected_volume="25,000 sets/año",
-                target_price=150,
-                target_margin=8.0,
-                delivery_date="2026-03-17",
-                technical_requirements="ISO 9001, IATF 16949, Especificados en dibujos",
-                quality_requirements="Especificados en dibujos",
-                regulatory_requirements="Normas automotrices mexicanas y estadounidenses, Especificados en dibujos",
-                priority=Priority.HIGH.value,
-                status=ProjectStatus.UNDER_REVIEW.value,
-                created_by="Jorge Valdés",
-                created_date="2025-10-16",
-                last_updated="2025-10-16",
-                assigned_departments=[Department.ENGINEERING.value, Department.QUALITY.value, Department.SALES.value, Department.PROJECTS.value],
-                feasibility_score=75,
-                risk_factors=["Alta competencia", "Requisitos técnicos complejos", "Nuevos procesos", "Mucha inversión", "Bajo volumen", "Dibujos no congelados"],
-                opportunities=["Mercado en crecimiento", "Cliente nuevo", "Nuevos procesos"],
-                comments=[
+        self._cache: Dict[str, Dict] = {}
+        self._lock = threading.Lock()
 
-                ],
-                technical_drawings_pdf=[],
-                technical_drawings_step=[]
-            ),
-            
-        ]
-        self.next_id = 3
-        self.filter_status = "Todos"
-        self.filter_priority = "Todas"
-        self.search_term = ""
+    @staticmethod
+    def _inputs(projects: List[ProjectInfo]) -> np.ndarray:
+        return np.array([[annual_volume(p), p.tool_characteristics_cavities, p.strokes_per_minute, p.oee,
+                          p.hours_per_shift, p.process_scrap_percentage, p.target_price, p.target_margin]
+                         for p in projects], dtype=float).reshape(-1, 8)
 
-    def add_project(self, project: ProjectInfo):
-        project.id = self.next_id
-        self.next_id += 1
-        self.projects.append(project)
+    def analyze(self, projects: List[ProjectInfo], grids: Optional[Dict[str, Tuple[float, ...]]] = None,
+                heatmap_axes: Tuple[str, str] = ("oee", "strokes_per_minute")) -> Dict:
+        grids = {name: tuple(float(v) for v in values)
+                 for name, values in (grids or DEFAULT_SENSITIVITY_GRIDS).items()}
+        for name in DEFAULT_SENSITIVITY_GRIDS:
+            grids.setdefault(name, (0.0,))
+        inputs = self._inputs(projects)
+        key = hashlib.sha256(
+            inputs.tobytes() + json.dumps([grids, heatmap_axes], sort_keys=True).encode("utf-8")
+        ).hexdigest()
+        
+        with self._lock:
+            cached = self._cache.get(key)
+        if cached is not None:
+            return cached
+        
+        result = self._compute(inputs, grids, heatmap_axes)
+        with self._lock:
+            if len(self._cache) >= SENSITIVITY_CACHE_SIZE:
+                self._cache.clear()
+            self._cache[key] = result
+        return result
 
-    def update_project(self, project_id: int, updates: Dict):
-        for project in self.projects:
-            if project.id == project_id:
-                for key, value in updates.items():
-                    setattr(project, key, value)
-                project.last_updated = datetime.datetime.now().strftime("%Y-%m-%d")
-                break
+    def _compute(self, inputs: np.ndarray, grids: Dict, heatmap_axes: Tuple[str, str]) -> Dict:
+        names = list(DEFAULT_SENSITIVITY_GRIDS)
+        volume, cavities, spm0, oee0, hours0, scrap0, price, margin0 = (inputs[:, i] for i in range(8))
+        oee0 = as_fraction(oee0)
+        scrap0 = percent(scrap0)
+        hours0 = np.where(hours0 > 0, hours0, DEFAULT_HOURS_PER_SHIFT)
+        
+        def axis(values, position):
+            shape = [1] * (len(names) + 1)
+            shape[position + 1] = len(values)
+            return np.asarray(values).reshape(shape)
+        
+        def per_project(values):
+            return values.reshape(-1, *([1] * len(names)))
+        
+        # As in CapacityEngine, a missing or zero OEE means no data rather than a tiny OEE
+        has_oee = per_project(oee0 > 0)
+        oee = np.where(has_oee, np.clip(per_project(oee0) + axis(grids["oee"], 0) / 100.0, 0.01, 1.0), np.nan)
+        spm = np.maximum(per_project(spm0) + axis(grids["strokes_per_minute"], 1), 0.0)
+        hours_per_shift = np.maximum(per_project(hours0) + axis(grids["hours_per_shift"], 2), 0.5)
+        scrap = np.clip(per_project(scrap0) + axis(grids["process_scrap_percentage"], 3) / 100.0, 0.0, 0.99)
+        
+        with np.errstate(divide="ignore", invalid="ignore"):
+            strokes_per_year = per_project(volume / np.maximum(cavities, 1))
+            press_hours = np.where((spm > 0) & has_oee, strokes_per_year / (spm * 60.0 * oee), np.nan)
+            shifts_per_week = press_hours / WORKING_WEEKS_PER_YEAR / hours_per_shift
+            # Same cost split as the risk simulator; conversion cost follows press hours
+            cost = per_project(price * (1.0 - percent(margin0)))
+            material = MATERIAL_COST_SHARE * per_project(1.0 - scrap0) / (1.0 - scrap)
+            conversion = (1.0 - MATERIAL_COST_SHARE) * np.where(
+                per_project(spm0 * oee0) > 0, per_project(spm0 * oee0) / (spm * oee), 1.0)
+            margin = np.where(per_project(price) > 0, 1.0 - cost * (material + conversion) / per_project(price), np.nan)
+        
+        full = np.ones((len(inputs),) + tuple(len(grids[n]) for n in names))
+        
+        def total(values):
+            # NaN where no project in the selection has the data
+            values = values * full
+            return np.where(np.isfinite(values).any(axis=0), np.nansum(values, axis=0), np.nan)
+        
+        metrics = {
+            "margin": np.nanmean(margin * full, axis=0) if len(inputs) else full[0] * np.nan,
+            "press_hours_per_year": total(press_hours),
+            "shifts_per_week": total(shifts_per_week),
+        }
+        base_index = tuple(_nearest_zero(grids[n]) for n in names)
+        
+        tornado = {}
+        for metric, values in metrics.items():
+            base = float(values[base_index])
+            bars = []
+            for position, name in enumerate(names):
+                index = list(base_index)
+                index[position] = slice(None)
+                swept = values[tuple(index)]
+                bars.append({
+                    "parameter": name,
+                    "low_offset": grids[name][0], "high_offset": grids[name][-1],
+                    "low": float(swept[0]), "high": float(swept[-1]),
+                    "swing": float(np.nanmax(swept) - np.nanmin(swept)) if np.isfinite(swept).any() else 0.0,
+                })
+            tornado[metric] = {"base": base, "bars": sorted(bars, key=lambda b: b["swing"], reverse=True)}
+        
+        x_name, y_name = heatmap_axes
+        heatmap = {}
+        for metric, values in metrics.items():
+            index = list(base_index)
+            index[names.index(x_name)] = slice(None)
+            index[names.index(y_name)] = slice(None)
+            cells = values[tuple(index)]
+            if names.index(x_name) > names.index(y_name):
+                cells = cells.T
+            heatmap[metric] = cells.tolist()
+        
+        return {
+            "grids": grids,
+            "tornado": tornado,
+            "heatmap": {"x": x_name, "y": y_name, "x_values": grids[x_name], "y_values": grids[y_name], "values": heatmap},
+            "grid": metrics,
+        }
 
-    def get_projects(self) -> List[ProjectInfo]:
-        filtered = self.projects
+# Global sensitivity analyzer
+sensitivity = SensitivityAnalyzer()
+
+# Tool life forecasting; guarantees and remaining life are in millions of strokes
+TOOL_WEAR_WARNING = 0.9
+TOOL_LIFE_FIELDS = VOLUME_FIELDS | {
+    "tool_life_guarantee", "toolmaker_life_guarantee", "tool_remaining_life", "tool_provided_by_customer",
+    "tool_characteristics_cavities", "project_life_years", "target_date_sop"
+}
+
+def _decimal_year(value: str) -> float:
+    date = parse_date(value)
+    if date is None:
+        return np.nan
+    return date.year + (date.timetuple().tm_yday - 1) / 365.25
+
+class ToolLifeForecaster:
+    """Projects when each tool wears out over the project life.
+
+    Tool life comes from tool_life_millions, as in the scoring rule. Inputs
+    are refreshed only when one of TOOL_LIFE_FIELDS changes and the
+    portfolio is re-evaluated in one vectorized pass on the next read.
+    """
+    def __init__(self):
+        self.columns = PortfolioColumns({
+            "life": tool_life_millions,
+            "volume": annual_volume,
+            "cavities": lambda p: p.tool_characteristics_cavities,
+            "life_years": lambda p: p.project_life_years,
+            "sop_year": lambda p: _decimal_year(p.target_date_sop),
+        })
+        self._results = None
+        self._lock = threading.Lock()
+
+    def load(self, projects: List[ProjectInfo]):
+        with self._lock:
+            for project in projects:
+                self.columns.set(project)
+            self._results = None
+
+    def on_change(self, event: str, project_id: int, changes: Dict):
+        if event == "added" or TOOL_LIFE_FIELDS.intersection(changes):
+            project = state.get_project(project_id)
+            if project is not None:
+                with self._lock:
+                    self.columns.set(project)
+                    self._results = None
+
+    def _compute(self) -> Dict:
+        c = self.columns
+        life_strokes = c["life"] * 1e6
+        with np.errstate(divide="ignore", invalid="ignore"):
+            strokes_per_year = c["volume"] / np.maximum(c["cavities"], 1)
+            valid = (strokes_per_year > 0) & (life_strokes > 0)
+            years_to_wear = np.where(valid, life_strokes / strokes_per_year, np.nan)
+            start = np.where(np.isnan(c["sop_year"]), datetime.date.today().year, c["sop_year"])
+            wear_out_year = np.floor(start + years_to_wear)
+            life_used = np.where(valid & (c["life_years"] > 0), c["life_years"] / years_to_wear, np.nan)
+            tools_needed = np.where(np.isnan(life_used), np.nan, np.ceil(np.maximum(life_used, 1.0) - 1e-9))
+        return {
+            "strokes_per_year": strokes_per_year,
+            "years_to_wear": years_to_wear,
+            "wear_out_year": wear_out_year,
+            "life_used": life_used,
+            "tools_needed": tools_needed,
+            "second_tool": life_used > 1.0,
+            "warning": (life_used > TOOL_WEAR_WARNING) & (life_used <= 1.0),
+        }
+
+    def results(self) -> Dict:
+        with self._lock:
+            if self._results is None:
+                self._results = self._compute()
+            return self._results
+
+    def project_forecast(self, project_id: int) -> Optional[Dict]:
+        results = self.results()
+        row = self.columns.row(project_id)
+        if row is None or np.isnan(results["years_to_wear"][row]):
+            return None
         
-        if self.filter_status != "Todos":
-            filtered = [p for p in filtered if p.status == self.filter_status]
+        def value(name):
+            number = results[name][row]
+            if results[name].dtype == bool:
+                return bool(number)
+            return None if np.isnan(number) else float(number)
+        return {name: value(name) for name in results}
+
+    def alerts(self) -> List[Dict]:
+        """Projects whose tool wears out before, or close to, the end of the project"""
+        results = self.results()
+        flagged = np.flatnonzero(results["second_tool"] | results["warning"])
+        return sorted((
+            {"project_id": self.columns.ids[row],
+             "second_tool": bool(results["second_tool"][row]),
+             "wear_out_year": int(results["wear_out_year"][row]),
+             "life_used": float(results["life_used"][row]),
+             "tools_needed": int(results["tools_needed"][row])}
+            for row in flagged
+        ), key=lambda a: a["life_used"], reverse=True)
+
+# Global tool life forecaster
+tool_life = ToolLifeForecaster()
+tool_life.load(state.projects)
+state.add_listener(tool_life.on_change)
+
+# Toolmaker quote ranking
+RFQ_WEIGHTS = {"cost": 0.5, "lead_time": 0.3, "conformance": 0.2}
+RFQ_SPEC_FIELDS = {
+    "tool_characteristics_pitch", "tool_characteristics_width", "tool_characteristics_cavities", "tool_raw_material"
+}
+QUOTE_NUMBER_FIELDS = ("price", "pitch", "width", "cavities", "life_guarantee", "lead_time_weeks")
+
+def normalize_quote(quote: Dict, project: ProjectInfo) -> Dict:
+    """Convert a raw quote to numbers and measure it against the customer tool characteristics"""
+    normalized = {"toolmaker": str(quote.get("toolmaker", "")).strip(),
+                  "raw_material": str(quote.get("raw_material", "")).strip()}
+    for name in QUOTE_NUMBER_FIELDS:
+        try:
+            normalized[name] = float(quote.get(name) or 0)
+        except (TypeError, ValueError):
+            normalized[name] = 0.0
+    
+    # Life guarantees are in millions of strokes
+    if normalized["price"] > 0 and normalized["life_guarantee"] > 0:
+        normalized["cost_per_million_strokes"] = normalized["price"] / normalized["life_guarantee"]
+    else:
+        normalized["cost_per_million_strokes"] = None
+    
+    checks = [(normalized["pitch"], project.tool_characteristics_pitch),
+              (normalized["width"], project.tool_characteristics_width),
+              (normalized["cavities"], project.tool_characteristics_cavities)]
+    conforming = [abs(quoted - required) <= SPEC_TOLERANCE * required for quoted, required in checks if required]
+    if project.tool_raw_material:
+        conforming.append(normalized["raw_material"] == project.tool_raw_material)
+    normalized["conformance"] = sum(conforming) / len(conforming) if conforming else 1.0
+    return normalized
+
+class ToolmakerQuoteRanker:
+    """Ranks each project's toolmaker quotes by cost per million strokes, lead time and conformance.
+
+    Normalized quotes are cached per project. Appending a quote normalizes
+    only the new one; editing the customer tool characteristics or replacing
+    the list renormalizes everything. Rankings are rebuilt lazily from the
+    normalized quotes since the best cost and lead time set the scale.
+    """
+    def __init__(self, weights: Optional[Dict[str, float]] = None):
+        self.weights = dict(weights or RFQ_WEIGHTS)
+        self._normalized: Dict[int, List[Dict]] = {}
+        self._rankings: Dict[int, List[Dict]] = {}
+        self._lock = threading.Lock()
+
+    def on_change(self, event: str, project_id: int, changes: Dict):
+        if RFQ_SPEC_FIELDS.intersection(changes):
+            with self._lock:
+                self._normalized.pop(project_id, None)
+                self._rankings.pop(project_id, None)
+        elif "toolmaker_quotes" in changes:
+            old, new = changes["toolmaker_quotes"]
+            project = state.get_project(project_id)
+            with self._lock:
+                cached = self._normalized.get(project_id)
+                if cached is not None and project is not None and len(cached) == len(old) and new[:len(old)] == old:
+                    cached.extend(normalize_quote(q, project) for q in new[len(old):])
+                else:
+                    self._normalized.pop(project_id, None)
+                self._rankings.pop(project_id, None)
+
+    def add_quote(self, project_id: int, quote: Dict, author: Optional[str] = None) -> Optional[int]:
+        project = state.get_project(project_id)
+        if project is None:
+            return None
+        while True:
+            # Compare-and-set on the list; a quote added meanwhile by another session is kept
+            quotes = project.toolmaker_quotes
+            try:
+                return state.update_project(project_id, {"toolmaker_quotes": quotes + [dict(quote)]},
+                                            author=author, expected_values={"toolmaker_quotes": quotes})
+            except ProjectConflictError:
+                continue
+
+    def select_quote(self, project_id: int, index: int, quotes: List[Dict],
+                     author: Optional[str] = None) -> Optional[int]:
+        """Copy quotes[index] into the project's toolmaker fields.
+
+        quotes is the list the user chose from; raises ProjectConflictError if
+        the project's quotes changed since.
+        """
+        project = state.get_project(project_id)
+        if project is None:
+            return None
+        if index >= len(quotes):
+            raise ProjectConflictError(project_id, project.version, project.version, ["toolmaker_quotes"])
+        quote = normalize_quote(quotes[index], project)
+        return state.update_project(project_id, {
+            "toolmaker_name": quote["toolmaker"],
+            "toolmaker_pitch": quote["pitch"],
+            "toolmaker_width": quote["width"],
+            "toolmaker_cavities": int(quote["cavities"]),
+            "toolmaker_raw_material": quote["raw_material"],
+            "toolmaker_life_guarantee": int(quote["life_guarantee"]),
+            "toolmaker_lead_time_weeks": int(quote["lead_time_weeks"]),
+        }, author=author, expected_values={"toolmaker_quotes": quotes})
+
+    def ranking(self, project_id: int) -> List[Dict]:
+        with self._lock:
+            cached = self._rankings.get(project_id)
+            if cached is not None:
+                return cached
+            project = state.get_project(project_id)
+            if project is None:
+                return []
+            normalized = self._normalized.get(project_id)
+            if normalized is None:
+                normalized = [normalize_quote(q, project) for q in project.toolmaker_quotes]
+                self._normalized[project_id] = normalized
+            ranking = self._rank(normalized)
+            self._rankings[project_id] = ranking
+            return ranking
+
+    def _rank(self, normalized: List[Dict]) -> List[Dict]:
+        costs = [q["cost_per_million_strokes"] for q in normalized if q["cost_per_million_strokes"]]
+        leads = [q["lead_time_weeks"] for q in normalized if q["lead_time_weeks"] > 0]
+        best_cost = min(costs) if costs else None
+        best_lead = min(leads) if leads else None
         
-        if self.filter_priority != "Todas":
-            filtered = [p for p in filtered if p.priority == self.filter_priority]
+        ranked = []
+        for index, quote in enumerate(normalized):
+            cost = quote["cost_per_million_strokes"]
+            score = (
+                self.weights["cost"] * (best_cost / cost if cost else 0.0) +
+                self.weights["lead_time"] * (best_lead / quote["lead_time_weeks"] if quote["lead_time_weeks"] > 0 else 0.0) +
+                self.weights["conformance"] * quote["conformance"]
+            ) / sum(self.weights.values())
+            ranked.append(dict(quote, index=index, score=score))
+        ranked.sort(key=lambda q: q["score"], reverse=True)
+        for rank, quote in enumerate(ranked, start=1):
+            quote["rank"] = rank
+        return ranked
+
+# Global toolmaker quote ranker
+rfq = ToolmakerQuoteRanker()
+state.add_listener(rfq.on_change)
+
+# Cross-project milestone timeline
+MILESTONES = ("tool", "first_parts", "ppap", "sop")
+MILESTONE_LABELS = {"tool": "Herramental", "first_parts": "Primeras Piezas", "ppap": "PPAP", "sop": "SOP"}
+MILESTONE_FIELDS = {"tool": None, "first_parts": "target_date_first_parts", "ppap": "target_date_ppap", "sop": "target_date_sop"}
+# Used between milestones when one of the two dates is missing
+DEFAULT_MILESTONE_GAP_DAYS = {"first_parts": 0, "ppap": 56, "sop": 28}
+TOOLMAKER_PARALLEL_BUILDS = 2
+TIMELINE_FIELDS = {
+    "target_date_first_parts", "target_date_ppap", "target_date_sop", "delivery_date",
+    "toolmaker_lead_time_weeks", "toolmaker_name", "press_number", "status"
+}
+
+class TimelineEngine:
+    """Milestone dependency graph across projects with earliest dates, slack and the critical path.
+
+    Within a project: tool ready -> first parts -> PPAP -> SOP, with the
+    planned gaps as lags. Across projects, launches on a shared press are
+    serialized (the next project's first parts wait for the previous PPAP)
+    and a toolmaker builds at most TOOLMAKER_PARALLEL_BUILDS tools at once.
+    Both couplings order projects by planned SOP, so the graph stays acyclic.
+
+    Dates are day ordinals. When a project changes, the coupling edges are
+    rebuilt (cheap) and earliest/latest dates are re-propagated only from
+    the nodes whose inputs changed.
+    """
+    def __init__(self):
+        self._planned: Dict[Tuple[int, str], Optional[int]] = {}
+        self._deadline: Dict[Tuple[int, str], Optional[int]] = {}
+        self._tool_weeks: Dict[int, int] = {}
+        self._groups: Dict[int, Tuple[str, str]] = {}
+        self._preds: Dict[Tuple[int, str], List[Tuple[Tuple[int, str], int]]] = {}
+        self._succs: Dict[Tuple[int, str], List[Tuple[Tuple[int, str], int]]] = {}
+        self.earliest: Dict[Tuple[int, str], float] = {}
+        self.latest: Dict[Tuple[int, str], float] = {}
+        self._dirty = set()
+        self._today = None
+        self._lock = threading.Lock()
+
+    def load(self, projects: List[ProjectInfo]):
+        with self._lock:
+            self._dirty.update(p.id for p in projects)
+
+    def on_change(self, event: str, project_id: int, changes: Dict):
+        if event == "added" or TIMELINE_FIELDS.intersection(changes):
+            with self._lock:
+                self._dirty.add(project_id)
+
+    def _read_project(self, project: Optional[ProjectInfo], project_id: int):
+        active = project is not None and project.status not in INACTIVE_STATUSES
+        for milestone, field_name in MILESTONE_FIELDS.items():
+            node = (project_id, milestone)
+            if not active:
+                self._planned.pop(node, None)
+                self._deadline.pop(node, None)
+                continue
+            date = parse_date(getattr(project, field_name)) if field_name else None
+            self._planned[node] = date.toordinal() if date else None
+            self._deadline[node] = None
+        if active:
+            delivery = parse_date(project.delivery_date)
+            sop_node = (project_id, "sop")
+            self._deadline[sop_node] = delivery.toordinal() if delivery else self._planned[sop_node]
+            self._tool_weeks[project_id] = project.toolmaker_lead_time_weeks
+            self._groups[project_id] = (project.press_number.strip(), project.toolmaker_name.strip())
+        else:
+            self._tool_weeks.pop(project_id, None)
+            self._groups.pop(project_id, None)
+
+    def _tool_ready_days(self, project_id: int) -> int:
+        """Days from ordering a tool to having it tried out, or 0 without a lead time"""
+        weeks = self._tool_weeks.get(project_id, 0)
+        return (weeks + TOOL_TRYOUT_WEEKS) * 7 if weeks else 0
+
+    def _lag(self, pred: Tuple[int, str], succ: Tuple[int, str]) -> int:
+        if pred[0] != succ[0]:
+            return 0
+        planned_pred, planned_succ = self._planned.get(pred), self._planned.get(succ)
+        if planned_pred is not None and planned_succ is not None:
+            return max(planned_succ - planned_pred, 0)
+        return DEFAULT_MILESTONE_GAP_DAYS[succ[1]]
+
+    def _build_edges(self) -> Dict:
+        preds = {(pid, m): [] for pid in self._groups for m in MILESTONES}
+        for pid in self._groups:
+            for pred, succ in zip(MILESTONES, MILESTONES[1:]):
+                preds[(pid, succ)].append(((pid, pred), self._lag((pid, pred), (pid, succ))))
         
-        if self.search_term:
-            filtered = [p for p in filtered 
-                       if self.search_term.lower() in p.project_name.lower() 
-                       or self.search_term.lower() in p.customer_name.lower()]
+        def launch_order(pid):
+            sop = self._planned.get((pid, "sop"))
+            return (sop if sop is not None else float("inf"), pid)
         
-        return filtered
+        by_press: Dict[str, List[int]] = {}
+        by_toolmaker: Dict[str, List[int]] = {}
+        for pid, (press, toolmaker) in self._groups.items():
+            if press:
+                by_press.setdefault(press, []).append(pid)
+            if toolmaker:
+                by_toolmaker.setdefault(toolmaker, []).append(pid)
+        for members in by_press.values():
+            members.sort(key=launch_order)
+            for previous, following in zip(members, members[1:]):
+                preds[(following, "first_parts")].append(((previous, "ppap"), 0))
+        for members in by_toolmaker.values():
+            members.sort(key=launch_order)
+            for previous, following in zip(members, members[TOOLMAKER_PARALLEL_BUILDS:]):
+                # The build slot frees up when an earlier tool is ready
+                preds[(following, "tool")].append(((previous, "tool"), self._tool_ready_days(following)))
+        return preds
 
-    def add_comment(self, project_id: int, comment: str):
-        for project in self.projects:
-            if project.id == project_id:
-                new_comment = {
-                    "comment": comment,
-                    "date": datetime.datetime.now().strftime("%Y-%m-%d")
+    def _compute_earliest(self, node: Tuple[int, str]) -> float:
+        candidates = [self.earliest[pred] + lag for pred, lag in self._preds.get(node, ()) if pred in self.earliest]
+        if node[1] == "tool":
+            candidates.append(self._today + self._tool_ready_days(node[0]))
+        planned = self._planned.get(node)
+        if planned is not None:
+            candidates.append(planned)
+        return max(candidates) if candidates else float(self._today)
+
+    def _compute_latest(self, node: Tuple[int, str]) -> float:
+        candidates = [self.latest[succ] - lag for succ, lag in self._succs.get(node, ()) if succ in self.latest]
+        deadline = self._deadline.get(node)
+        if deadline is not None:
+            candidates.append(deadline)
+        return min(candidates) if candidates else float("inf")
+
+    def _propagate(self, start, compute, values, neighbours):
+        """Re-evaluate start nodes and push changes along neighbours until nothing moves"""
+        queue = deque(start)
+        queued = set(start)
+        while queue:
+            node = queue.popleft()
+            queued.discard(node)
+            value = compute(node)
+            if values.get(node) != value:
+                values[node] = value
+                for other, _ in neighbours.get(node, ()):
+                    if other not in queued:
+                        queued.add(other)
+                        queue.append(other)
+
+    def refresh(self):
+        with self._lock:
+            today = datetime.date.today().toordinal()
+            if today != self._today:
+                # Tool-ready dates are measured from today
+                self._today = today
+                self._dirty.update(self._groups)
+            if not self._dirty:
+                return
+            
+            for project_id in self._dirty:
+                self._read_project(state.get_project(project_id), project_id)
+            preds = self._build_edges()
+            succs: Dict[Tuple[int, str], List] = {}
+            for node, node_preds in preds.items():
+                for pred, lag in node_preds:
+                    succs.setdefault(pred, []).append((node, lag))
+            
+            dirty_nodes = {(pid, m) for pid in self._dirty for m in MILESTONES}
+            changed_preds = {node for node in preds if preds[node] != self._preds.get(node)}
+            changed_succs = {node for node in set(succs) | set(self._succs) if succs.get(node) != self._succs.get(node)}
+            for node in dirty_nodes - set(preds):
+                self.earliest.pop(node, None)
+                self.latest.pop(node, None)
+            self._preds, self._succs = preds, succs
+            self._dirty.clear()
+            
+            live = set(preds)
+            self._propagate([n for n in sorted((dirty_nodes | changed_preds) & live)],
+                            self._compute_earliest, self.earliest, self._succs)
+            self._propagate([n for n in sorted((dirty_nodes | changed_succs) & live, reverse=True)],
+                            self._compute_latest, self.latest, self._preds)
+
+    def slack(self, node: Tuple[int, str]) -> Optional[float]:
+        latest = self.latest.get(node, float("inf"))
+        return None if latest == float("inf") else latest - self.earliest[node]
+
+    def critical_path(self) -> List[Tuple[int, str]]:
+        """Chain of binding predecessors ending at the SOP with the least slack"""
+        self.refresh()
+        with self._lock:
+            sops = [(self.slack((pid, "sop")), (pid, "sop")) for pid in self._groups]
+            sops = [(s, n) for s, n in sops if s is not None]
+            if not sops:
+                return []
+            node = min(sops)[1]
+            path = [node]
+            while True:
+                binding = [pred for pred, lag in self._preds.get(node, ())
+                           if self.earliest.get(pred, float("-inf")) + lag == self.earliest[node]]
+                if not binding:
+                    break
+                node = min(binding, key=lambda n: (self.slack(n) if self.slack(n) is not None else float("inf")))
+                path.append(node)
+            return path[::-1]
+
+    def project_schedule(self, project_id: int) -> Optional[Dict]:
+        self.refresh()
+        with self._lock:
+            if project_id not in self._groups:
+                return None
+            schedule = {}
+            for milestone in MILESTONES:
+                node = (project_id, milestone)
+                planned = self._planned.get(node)
+                earliest = self.earliest.get(node)
+                schedule[milestone] = {
+                    "planned": datetime.date.fromordinal(planned) if planned is not None else None,
+                    "forecast": datetime.date.fromordinal(int(earliest)) if earliest is not None else None,
+                    "slip_days": int(earliest - planned) if planned is not None and earliest is not None else 0,
+                    "slack_days": self.slack(node),
                 }
-                project.comments.append(new_comment)
-                project.last_updated = datetime.datetime.now().strftime("%Y-%m-%d")
-                break
+            return schedule
 
-# Global state instance
-state = FeasibilityState()
+    def timeline(self) -> Dict[int, Dict]:
+        self.refresh()
+        with self._lock:
+            project_ids = list(self._groups)
+        return {pid: self.project_schedule(pid) for pid in project_ids}
+
+# Global timeline engine
+timeline = TimelineEngine()
+timeline.load(state.projects)
+state.add_listener(timeline.on_change)
+
+# Field-level audit log
+AUDIT_LOG_PATH = os.path.join(DATA_DIR, "audit.log")
+AUDIT_COMPACT_EVERY = 1000
+AUDIT_COALESCE_SECONDS = 60
+AUDIT_ENTRIES_SHOWN = 20
+# Projects live in memory, so ids are only meaningful within one run of the app
+AUDIT_RUN_ID = uuid.uuid4().hex[:12]
+
+def encode_change(old, new):
+    """Lists that only grew are stored as the appended items"""
+    if isinstance(old, list) and isinstance(new, list) and len(new) > len(old) and new[:len(old)] == old:
+        return {"append": new[len(old):]}
+    return [old, new]
+
+def merge_changes(first: Dict, second: Dict) -> Optional[Dict]:
+    """Combine two consecutive encoded diffs, or None if they cannot be combined"""
+    merged = dict(first)
+    for key, change in second.items():
+        previous = merged.get(key)
+        if previous is None:
+            merged[key] = change
+        elif isinstance(change, list):
+            if isinstance(previous, dict):
+                return None
+            merged[key] = [previous[0], change[1]]
+        elif isinstance(previous, dict):
+            merged[key] = {"append": previous["append"] + change["append"]}
+        else:
+            merged[key] = [previous[0], previous[1] + change["append"]]
+    return {key: c for key, c in merged.items() if not (isinstance(c, list) and c[0] == c[1])}
+
+def decode_change(change) -> Tuple[Any, Any]:
+    """(old, new); for appends old is None and new holds only the appended items"""
+    if isinstance(change, dict):
+        return None, change["append"]
+    return change[0], change[1]
+
+class AuditIndex:
+    """Per-project and per-field entry ids over (timestamp, file offset) lists"""
+    def __init__(self):
+        self.offsets: List[int] = []
+        self.times: List[float] = []
+        self.ends: List[float] = []
+        self.by_project: Dict[Tuple[str, int], List[int]] = {}
+        self.by_field: Dict[str, List[int]] = {}
+
+    def add(self, entry: Dict, offset: int):
+        entry_id = len(self.offsets)
+        self.offsets.append(offset)
+        self.times.append(entry["t"])
+        self.ends.append(entry.get("t1", entry["t"]))
+        self.by_project.setdefault((entry["r"], entry["p"]), []).append(entry_id)
+        for field_name in entry["c"]:
+            self.by_field.setdefault(field_name, []).append(entry_id)
+
+def audit_lines(f, start: int, end: Optional[int] = None):
+    """Yield (offset, line) from a binary file, from start up to end or EOF"""
+    f.seek(start)
+    offset = start
+    while end is None or offset < end:
+        line = f.readline()
+        if not line:
+            break
+        yield offset, line
+        offset += len(line)
+
+class AuditLog:
+    """Append-only JSON-lines log of every field change, with who made it and when.
+
+    Each line holds one project version as a field-level diff. An in-memory
+    index of (timestamp, file offset) per project and per field answers
+    queries with a bisect instead of scanning the log. Every
+    AUDIT_COMPACT_EVERY entries the file is rewritten with runs of edits by
+    the same user on the same project within AUDIT_COALESCE_SECONDS merged
+    into one entry, stamped "t" with the first edit and "t1" with the last.
+
+    Building the index and compacting stream the file without holding the
+    append lock; it is only taken to read the tail written meanwhile and to
+    swap in the result, so saves never wait on a full scan.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self._index: Optional[AuditIndex] = None
+        self._appended = 0
+        self._compacting = False
+        self._file = None
+        self._lock = threading.Lock()
+        # Serializes index builds and compactions, which both scan the file off-lock
+        self._rebuild_lock = threading.Lock()
+
+    def _open(self):
+        if self._file is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self._file = open(self.path, "ab")
+
+    @staticmethod
+    def _index_lines(index: AuditIndex, lines):
+        for offset, line in lines:
+            try:
+                index.add(json.loads(line), offset)
+            except ValueError:
+                print(f"Skipping unreadable audit entry at offset {offset}")
+
+    def _ensure_index(self):
+        if self._index is not None:
+            return
+        with self._rebuild_lock:
+            if self._index is not None:
+                return
+            with self._lock:
+                self._open()
+                end = self._file.tell()
+            index = AuditIndex()
+            with open(self.path, "rb") as f:
+                self._index_lines(index, audit_lines(f, 0, end))
+                with self._lock:
+                    # Entries appended during the scan; later ones are indexed by on_change
+                    self._index_lines(index, audit_lines(f, end))
+                    self._index = index
+
+    def on_change(self, event: str, project_id: int, changes: Dict):
+        project = state.get_project(project_id)
+        if project is None:
+            return
+        # Every event, creation included, is delivered under the project lock, so the
+        # current version and its delta are the ones this event produced
+        version = 1 if event == "added" else project.version
+        delta = state.get_delta(project_id, version)
+        entry = {
+            "t": (delta.timestamp if delta else datetime.datetime.now()).timestamp(),
+            "u": (delta.author if delta else None) or "sistema",
+            "r": AUDIT_RUN_ID,
+            "p": project_id,
+            "v": version,
+            "e": event,
+            "c": {key: encode_change(old, new) for key, (old, new) in (delta.changes if delta else changes).items()},
+        }
+        line = (json.dumps(entry, ensure_ascii=False, default=str) + "\n").encode("utf-8")
+        with self._lock:
+            try:
+                self._open()
+                offset = self._file.tell()
+                self._file.write(line)
+                self._file.flush()
+            except OSError as e:
+                print(f"Error writing audit log: {e}")
+                return
+            # Until the index is built its tail scan picks this entry up
+            if self._index is not None:
+                self._index.add(entry, offset)
+            self._appended += 1
+            compact = self._appended >= AUDIT_COMPACT_EVERY and not self._compacting
+            if compact:
+                self._compacting = True
+                self._appended = 0
+        if compact:
+            try:
+                jobs.submit("Compactar bitácora", lambda job: self.compact())
+            except JobQueueFullError:
+                with self._lock:
+                    self._compacting = False
+
+    def query(self, project_id: Optional[int] = None, field_name: Optional[str] = None,
+              since: Optional[datetime.datetime] = None, until: Optional[datetime.datetime] = None) -> List[Dict]:
+        """Entries for a project and/or field with an edit in [since, until), oldest first.
+
+        A merged entry is returned whole when any part of its burst falls in the
+        range. Project queries cover the current run; field-only queries cover
+        the whole log.
+        """
+        self._ensure_index()
+        with self._lock:
+            index = self._index
+            candidates = None
+            if project_id is not None:
+                candidates = index.by_project.get((AUDIT_RUN_ID, project_id), [])
+            if field_name is not None:
+                by_field = index.by_field.get(field_name, [])
+                candidates = by_field if candidates is None else sorted(set(candidates).intersection(by_field))
+            if candidates is None:
+                candidates = range(len(index.offsets))
+            # Entry ids are in log order, so their first timestamps are sorted too;
+            # a burst spans at most AUDIT_COALESCE_SECONDS
+            times = [index.times[i] for i in candidates]
+            start = bisect.bisect_left(times, since.timestamp() - AUDIT_COALESCE_SECONDS) if since else 0
+            end = bisect.bisect_left(times, until.timestamp()) if until else len(times)
+            selected = [i for i in candidates[start:end] if since is None or index.ends[i] >= since.timestamp()]
+
+            # Read while holding the lock so compaction cannot swap the file under these offsets
+            entries = []
+            with open(self.path, "rb") as f:
+                for i in selected:
+                    f.seek(index.offsets[i])
+                    entry = json.loads(f.readline())
+                    if field_name is not None:
+                        entry["c"] = {field_name: entry["c"][field_name]}
+                    entries.append(entry)
+        return entries
+
+    @staticmethod
+    def _merged_entries(lines):
+        """Stream entries with bursts merged, holding only the last AUDIT_COALESCE_SECONDS"""
+        pending = deque()
+        last: Dict[Tuple[str, int], Dict] = {}
+        for _, line in lines:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue
+            # An entry that started more than a window ago can absorb nothing newer
+            while pending and pending[0]["t"] < entry["t"] - AUDIT_COALESCE_SECONDS:
+                front = pending.popleft()
+                if last.get((front["r"], front["p"])) is front:
+                    del last[(front["r"], front["p"])]
+                yield front
+            key = (entry["r"], entry["p"])
+            previous = last.get(key)
+            combined = None
+            if (previous is not None and previous["u"] == entry["u"] and previous["e"] == entry["e"] == "updated"
+                    and entry.get("t1", entry["t"]) - previous["t"] <= AUDIT_COALESCE_SECONDS):
+                combined = merge_changes(previous["c"], entry["c"])
+            if combined is not None:
+                # "t" stays the first edit so the log stays in time order; "t1" is the last
+                previous["c"], previous["v"] = combined, entry["v"]
+                previous["t1"] = entry.get("t1", entry["t"])
+            else:
+                last[key] = entry
+                pending.append(entry)
+        yield from pending
+
+    def compact(self):
+        """Merge bursts of edits and rewrite the log atomically"""
+        tmp_path = self.path + ".tmp"
+        try:
+            with self._rebuild_lock:
+                with self._lock:
+                    self._open()
+                    end = self._file.tell()
+                index = AuditIndex()
+                with open(self.path, "rb") as src, open(tmp_path, "wb") as dst:
+                    for entry in self._merged_entries(audit_lines(src, 0, end)):
+                        index.add(entry, dst.tell())
+                        dst.write((json.dumps(entry, ensure_ascii=False, default=str) + "\n").encode("utf-8"))
+                    with self._lock:
+                        # Copy what was appended during the rewrite, then swap
+                        for offset, line in audit_lines(src, end):
+                            try:
+                                index.add(json.loads(line), dst.tell())
+                            except ValueError:
+                                continue
+                            dst.write(line)
+                        dst.flush()
+                        self._file.close()
+                        self._file = None
+                        os.replace(tmp_path, self.path)
+                        self._index = index
+        except OSError as e:
+            print(f"Error compacting audit log: {e}")
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+        finally:
+            with self._lock:
+                self._compacting = False
+                try:
+                    self._open()
+                except OSError as e:
+                    print(f"Error reopening audit log: {e}")
+
+# Global audit log
+audit = AuditLog(AUDIT_LOG_PATH)
+state.add_listener(audit.on_change)
+
+def preview_image(path: str, **kwargs) -> ft.Image:
+    # Embedded as base64 so previews also work in web deployments
+    with open(path, "rb") as f:
+        return ft.Image(src_base64=base64.b64encode(f.read()).decode("ascii"), **kwargs)
 
 # Global modal reference for better management
 current_modal = None
 
-# Global project list reference for updates
-project_list_ref = None
+# Frame interval used to coalesce page.update() calls (seconds)
+UPDATE_FRAME_INTERVAL = 1 / 60
+
+class UpdateScheduler:
+    """Coalesces page.update() requests made within one frame into a single diff push"""
+    def __init__(self, page: ft.Page, frame_interval: float = UPDATE_FRAME_INTERVAL):
+        self.page = page
+        self.frame_interval = frame_interval
+        self.requested = 0
+        self.flushed = 0
+        self._pending = False
+        self._timer = None
+        self._lock = threading.Lock()
+
+    def request(self):
+        with self._lock:
+            self.requested += 1
+            self._pending = True
+            if self._timer is None:
+                self._timer = threading.Timer(self.frame_interval, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def flush(self):
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            if not self._pending:
+                return
+            self._pending = False
+            self.flushed += 1
+        try:
+            self.page.update()
+        except Exception as e:
+            print(f"Error flushing page update: {e}")
+
+    def stats(self) -> Dict:
+        return {
+            "requested": self.requested,
+            "flushed": self.flushed,
+            "coalesced": self.requested - self.flushed
+        }
+
+MAX_UNDO_STEPS = 100
+
+class UndoHistory:
+    """Per-session undo/redo over the project versions this session wrote.
+
+    Entries are (project id, version). Undoing reverts that version, which
+    writes a new version; redoing reverts the undo in turn.
+    """
+    def __init__(self, session_id: Optional[str], max_steps: int = MAX_UNDO_STEPS):
+        self.session_id = session_id
+        self._undo: deque = deque(maxlen=max_steps)
+        self._redo: deque = deque(maxlen=max_steps)
+        self._lock = threading.Lock()
+
+    def record(self, project_id: int, version: Optional[int]):
+        """Remember a save; ignored when the save changed nothing"""
+        delta = state.get_delta(project_id, version) if version is not None else None
+        if delta is None or delta.author != self.session_id:
+            return
+        with self._lock:
+            self._undo.append((project_id, version))
+            self._redo.clear()
+
+    @property
+    def can_undo(self) -> bool:
+        return bool(self._undo)
+
+    @property
+    def can_redo(self) -> bool:
+        return bool(self._redo)
+
+    def _step(self, source: deque, target: deque) -> Optional[int]:
+        with self._lock:
+            if not source:
+                return None
+            project_id, version = source.pop()
+        try:
+            new_version = state.revert(project_id, version, author=self.session_id)
+        except ProjectConflictError:
+            # Someone else edited those fields since; this step can no longer be applied
+            with self._lock:
+                target.clear()
+            raise
+        with self._lock:
+            if new_version is not None and new_version != version:
+                target.append((project_id, new_version))
+        return project_id
+
+    def undo(self) -> Optional[int]:
+        """Revert the latest save and return its project id"""
+        return self._step(self._undo, self._redo)
+
+    def redo(self) -> Optional[int]:
+        return self._step(self._redo, self._undo)
+
+class SessionContext:
+    """Per-session state that must not be shared through the global FeasibilityState"""
+    def __init__(self, page: ft.Page):
+        self.page = page
+        self.updates = UpdateScheduler(page)
+        self.uploads = UploadManager(page)
+        self.query = ViewQuery()
+        self.history = UndoHistory(page.session_id)
+        # Dashboard controls refreshed by update_dashboard
+        self.project_list: Optional[ft.Row] = None
+        self.stats_row: Optional[ft.Row] = None
+        # Project cards by id, rebuilt only when the project changes
+        self.cards: Dict[int, ft.Control] = {}
+        # Project version each cached card was built from
+        self.card_versions: Dict[int, int] = {}
+        self.lock = threading.RLock()
+
+    def card_for(self, project: ProjectInfo) -> ft.Control:
+        card = self.cards.get(project.id)
+        if card is None:
+            self.card_versions[project.id] = project.version
+            card = create_project_card(project, self.page)
+            self.cards[project.id] = card
+        return card
+
+# Per-session contexts keyed by Flet session id
+sessions: Dict[str, SessionContext] = {}
+sessions_lock = threading.Lock()
+
+def get_session(page: ft.Page) -> SessionContext:
+    with sessions_lock:
+        session = sessions.get(page.session_id)
+        if session is None:
+            session = SessionContext(page)
+            sessions[page.session_id] = session
+        return session
+
+def drop_session(page: ft.Page):
+    with sessions_lock:
+        session = sessions.pop(page.session_id, None)
+    if session is not None:
+        try:
+            page.pubsub.unsubscribe_all()
+        except Exception as e:
+            print(f"Error unsubscribing session: {e}")
+        jobs.unwatch(page.session_id)
+        session.updates.flush()
+        print(f"Session {page.session_id} closed, updates: {session.updates.stats()}")
 
-# Global statistics reference for updates
-stats_row_ref = None
+def request_update(page: ft.Page):
+    """Schedule a page.update() for the current frame instead of pushing immediately"""
+    get_session(page).updates.request()
 
 def force_close_all_modals(page: ft.Page):
     """Emergency function to close all modals and clear overlays"""
@@ -216,7 +3575,7 @@ def force_close_all_modals(page: ft.Page):
         # Clear all overlays
         page.overlay.clear()
         current_modal = None
-        page.update()
+        request_update(page)
         print("All modals force closed")
     except Exception as e:
         print(f"Error force closing modals: {e}")
@@ -292,6 +3651,14 @@ def create_project_card(project: ProjectInfo, page: ft.Page):
             ft.Icon(ft.Icons.SCHEDULE, size=12, color="#4A90E2"),
             ft.Text(f"OEE: {project.oee if project.oee else 'N/A'}", size=10, color="#6B7280")
         ]))
+    
+    forecast = tool_life.project_forecast(project.id)
+    if forecast is not None and forecast["second_tool"]:
+        column_controls.insert(-1, ft.Row([
+            ft.Icon(ft.Icons.WARNING_AMBER, size=12, color="#E53E3E"),
+            ft.Text(f"Herramental se desgasta en {forecast['wear_out_year']:.0f}: requiere segundo tool",
+                    size=10, color="#E53E3E")
+        ]))
 
     return ft.Container(
         content=ft.Column(column_controls),
@@ -328,11 +3695,11 @@ def show_project_details_modal(page: ft.Page, project: ProjectInfo):
     
     def add_comment(e):
         if new_comment_field.value.strip():
-            state.add_comment(project.id, new_comment_field.value)
+            state.add_comment(project.id, new_comment_field.value, author=page.session_id)
             new_comment_field.value = ""
             # Update the comments section without recreating the entire modal
             update_comments_section()
-            page.update()
+            request_update(page)
     
     def update_comments_section():
         # Clear existing comments and rebuild
@@ -371,11 +3738,271 @@ def show_project_details_modal(page: ft.Page, project: ProjectInfo):
     # Initialize the comments section
     update_comments_section()
 
+    # Toolmaker quotes, best ranked first
+    quotes_list = ft.Column([])
+    quote_toolmaker_field = ft.TextField(label="Fabricante", width=150, dense=True)
+    quote_price_field = ft.TextField(label="Precio", width=90, dense=True)
+    quote_pitch_field = ft.TextField(label="Pitch", width=80, dense=True)
+    quote_width_field = ft.TextField(label="Ancho", width=80, dense=True)
+    quote_cavities_field = ft.TextField(label="Cavidades", width=90, dense=True)
+    quote_material_field = ft.TextField(label="Materia Prima", width=120, dense=True)
+    quote_life_field = ft.TextField(label="Vida (M golpes)", width=110, dense=True)
+    quote_lead_field = ft.TextField(label="Entrega (sem)", width=100, dense=True)
+    quote_fields = [quote_toolmaker_field, quote_price_field, quote_pitch_field, quote_width_field,
+                    quote_cavities_field, quote_material_field, quote_life_field, quote_lead_field]
+    
+    def add_quote(e):
+        if not quote_toolmaker_field.value or not quote_toolmaker_field.value.strip():
+            quote_toolmaker_field.error_text = "Requerido"
+            request_update(page)
+            return
+        quote_toolmaker_field.error_text = None
+        version = rfq.add_quote(project.id, {
+            "toolmaker": quote_toolmaker_field.value,
+            "price": quote_price_field.value,
+            "pitch": quote_pitch_field.value,
+            "width": quote_width_field.value,
+            "cavities": quote_cavities_field.value,
+            "raw_material": quote_material_field.value,
+            "life_guarantee": quote_life_field.value,
+            "lead_time_weeks": quote_lead_field.value,
+        }, author=page.session_id)
+        get_session(page).history.record(project.id, version)
+        for quote_field in quote_fields:
+            quote_field.value = ""
+        update_quotes_section()
+        request_update(page)
+    
+    def select_quote(index: int, quotes: List[Dict]):
+        try:
+            version = rfq.select_quote(project.id, index, quotes, author=page.session_id)
+        except ProjectConflictError:
+            update_quotes_section()
+            quote_error_text.value = "Las cotizaciones cambiaron mientras elegía; revise la lista y seleccione de nuevo"
+            quote_error_text.visible = True
+            request_update(page)
+            return
+        get_session(page).history.record(project.id, version)
+        close_modal(modal, page)
+        update_dashboard(page)
+    
+    quote_error_text = ft.Text("", size=12, color="#E53E3E", visible=False)
+    
+    def update_quotes_section():
+        quotes_list.controls.clear()
+        quotes_list.controls.append(ft.Text("Cotizaciones de Fabricantes", size=16, weight="bold", color="#9C27B0"))
+        quote_error_text.visible = False
+        # The list the ranking indexes into; selecting checks it is still current
+        shown_quotes = project.toolmaker_quotes
+        for quote in rfq.ranking(project.id):
+            cost = quote["cost_per_million_strokes"]
+            quotes_list.controls.append(ft.Container(
+                content=ft.Row([
+                    ft.Text(f"#{quote['rank']}", size=12, weight="bold", color="#9C27B0"),
+                    ft.Column([
+                        ft.Text(quote["toolmaker"], size=12, weight="bold"),
+                        ft.Text(
+                            f"${cost:,.0f} por millón de golpes" if cost else "Costo por millón no disponible",
+                            size=11
+                        ),
+                        ft.Text(
+                            f"Entrega: {quote['lead_time_weeks']:.0f} semanas · "
+                            f"Conformidad: {quote['conformance']:.0%} · Puntaje: {quote['score']:.0%}",
+                            size=11, color="#6B7280"
+                        )
+                    ], expand=True),
+                    ft.TextButton("Seleccionar",
+                                  on_click=lambda e, index=quote["index"]: select_quote(index, shown_quotes))
+                ]),
+                bgcolor=ft.Colors.GREY_100,
+                padding=10,
+                margin=5,
+                border_radius=8
+            ))
+        quotes_list.controls.extend([
+            quote_error_text,
+            ft.Row(quote_fields, wrap=True),
+            ft.ElevatedButton(
+                "Agregar Cotización",
+                on_click=add_quote,
+                bgcolor="#9C27B0",
+                color=ft.Colors.WHITE
+            )
+        ])
+    
+    update_quotes_section()
+
+    # Capacity demand from the capacity engine
+    project_capacity = capacity.project_capacity(project.id)
+    if project_capacity is None:
+        capacity_section = ft.Column([
+            ft.Text("Capacidad de Prensa", size=16, weight="bold", color="#F5A623"),
+            ft.Text("Faltan volumen, SPM u OEE para calcular la capacidad", size=12, color=ft.Colors.GREY)
+        ])
+    else:
+        capacity_section = ft.Column([
+            ft.Text("Capacidad de Prensa", size=16, weight="bold", color="#F5A623"),
+            ft.Text(f"Horas de prensa por año: {project_capacity['press_hours_per_year']:,.0f}", size=12),
+            ft.Text(f"Turnos por semana: {project_capacity['shifts_per_week']:.1f}", size=12),
+            ft.Text(f"Utilización de prensa por este proyecto: {project_capacity['utilization']:.0%}", size=12),
+            ft.Text(
+                f"Utilización total de la prensa {project.press_number}: {project_capacity['press_utilization']:.0%}"
+                if project_capacity["press_utilization"] is not None else "Prensa no asignada",
+                size=12
+            )
+        ])
+
+    # Steel consumption from the coil estimator
+    project_coil = coils.project_coil(project.id)
+    if project_coil is None:
+        coil_section = ft.Column([
+            ft.Text("Consumo de Acero", size=16, weight="bold", color="#F5A623"),
+            ft.Text("Faltan espesor, ancho de cinta o paso para estimar el consumo", size=12, color=ft.Colors.GREY)
+        ])
+    else:
+        coil_section = ft.Column([
+            ft.Text("Consumo de Acero", size=16, weight="bold", color="#F5A623"),
+            ft.Text(f"Acero por set: {project_coil['kg_per_set']:.3f} kg", size=12),
+            ft.Text(f"Acero por año: {project_coil['steel_kg_per_year'] / 1000:,.1f} t", size=12),
+            ft.Text(f"Master coils por año: {project_coil['coils_per_year']:,.1f}", size=12),
+            ft.Text(
+                f"Rendimiento de corte: {project_coil['slitting_yield']:.1%} "
+                f"({project_coil['strips_per_master']:.0f} cintas por master coil)"
+                if project_coil["slitting_yield"] is not None else "Rendimiento de corte: sin ancho de master coil",
+                size=12
+            )
+        ])
+
+    # Tool wear forecast
+    forecast = tool_life.project_forecast(project.id)
+    if forecast is None:
+        tool_life_section = ft.Column([
+            ft.Text("Vida del Herramental", size=16, weight="bold", color="#F5A623"),
+            ft.Text("Faltan volumen, cavidades o vida garantizada para pronosticar el desgaste", size=12, color=ft.Colors.GREY)
+        ])
+    else:
+        tool_life_section = ft.Column([
+            ft.Text("Vida del Herramental", size=16, weight="bold", color="#F5A623"),
+            ft.Text(f"Golpes por año: {forecast['strokes_per_year'] / 1e6:,.2f} millones", size=12),
+            ft.Text(f"Años hasta el desgaste: {forecast['years_to_wear']:.1f} (año {forecast['wear_out_year']:.0f})", size=12)
+        ])
+        if forecast["second_tool"]:
+            tool_life_section.controls.append(ft.Text(
+                f"Se requieren {forecast['tools_needed']:.0f} herramentales para la vida del proyecto "
+                f"({forecast['life_used']:.0%} de la vida garantizada)", size=12, weight="bold", color="#E53E3E"))
+        elif forecast["warning"]:
+            tool_life_section.controls.append(ft.Text(
+                f"El proyecto consume {forecast['life_used']:.0%} de la vida garantizada", size=12, color="#F5A623"))
+
+    # Quote risk from the Monte Carlo simulator
+    project_risk = risk.project_risk(project.id)
+    if project_risk is None:
+        risk_section = ft.Column([
+            ft.Text("Riesgo de Cotización", size=16, weight="bold", color="#E53E3E"),
+            ft.Text("Falta el precio objetivo para simular el riesgo", size=12, color=ft.Colors.GREY)
+        ])
+    else:
+        margin_p = project_risk["margin_percentiles"]
+        ready_p = project_risk["tool_ready_weeks"]
+        risk_section = ft.Column([
+            ft.Text("Riesgo de Cotización", size=16, weight="bold", color="#E53E3E"),
+            ft.Text(f"Margen P5 / P50 / P95: {margin_p[5]:.1%} / {margin_p[50]:.1%} / {margin_p[95]:.1%}", size=12),
+            ft.Text(f"Margen en riesgo (vs. objetivo): {project_risk['margin_at_risk']:.1%}", size=12),
+            ft.Text(f"Probabilidad de pérdida: {project_risk['loss_probability']:.1%}", size=12),
+            ft.Text(f"Herramental listo (semanas) P5 / P50 / P95: {ready_p[5]:.0f} / {ready_p[50]:.0f} / {ready_p[95]:.0f}", size=12),
+            ft.Text(
+                f"Probabilidad de llegar a tiempo al SOP: {project_risk['on_time_sop_probability']:.0%}"
+                if project_risk["on_time_sop_probability"] is not None else "Sin fecha de SOP",
+                size=12
+            )
+        ])
+
+    # What-if sensitivity of the margin and press hours
+    tornado = sensitivity.analyze([project])["tornado"]
+    sensitivity_section = ft.Column([
+        ft.Text("Sensibilidad (¿Qué pasa si?)", size=16, weight="bold", color="#4A90E2")
+    ])
+    for metric, fmt in (("margin", "{:.1%}"), ("press_hours_per_year", "{:,.0f} h")):
+        if not np.isfinite(tornado[metric]["base"]):
+            continue
+        sensitivity_section.controls.append(ft.Text(
+            f"{SENSITIVITY_LABELS[metric]} base: {fmt.format(tornado[metric]['base'])}", size=12, weight="bold"))
+        for bar in tornado[metric]["bars"]:
+            if bar["swing"] > 0:
+                sensitivity_section.controls.append(ft.Text(
+                    f"{SENSITIVITY_LABELS[bar['parameter']]} {bar['low_offset']:+g} → {fmt.format(bar['low'])}, "
+                    f"{bar['high_offset']:+g} → {fmt.format(bar['high'])}", size=12))
+    if len(sensitivity_section.controls) == 1:
+        sensitivity_section.controls.append(
+            ft.Text("Faltan precio, SPM u OEE para el análisis de sensibilidad", size=12, color=ft.Colors.GREY))
+
+    # Field-level change history from the audit log
+    history_section = ft.Column([
+        ft.Text("Historial de Cambios", size=16, weight="bold", color="#6B7280")
+    ])
+    for entry in reversed(audit.query(project_id=project.id)[-AUDIT_ENTRIES_SHOWN:]):
+        when = datetime.datetime.fromtimestamp(entry.get("t1", entry["t"])).strftime("%Y-%m-%d %H:%M")
+        for field_name, change in entry["c"].items():
+            if field_name == "last_updated":
+                continue
+            old, new = decode_change(change)
+            description = f"agregó {len(new)} elemento(s)" if isinstance(change, dict) else f"{old} → {new}"
+            history_section.controls.append(ft.Text(
+                f"{when} · {entry['u'][:8]} · {field_name}: {description}", size=11, color="#6B7280"))
+    if len(history_section.controls) == 1:
+        history_section.controls.append(ft.Text("Sin cambios registrados", size=12, color=ft.Colors.GREY))
+
+    # Technical drawings with cached previews
+    drawings_section = ft.Column([
+        ft.Text("Documentos Técnicos", size=16, weight="bold", color="#4A90E2")
+    ])
+    
+    def create_drawing_preview(attachment: Dict):
+        preview_row = ft.Row([ft.ProgressRing(width=16, height=16)], scroll=ft.ScrollMode.AUTO)
+        
+        def show_previews(entry):
+            if entry is None:
+                preview_row.controls = [ft.Text("Vista previa no disponible", size=12, color=ft.Colors.GREY)]
+            else:
+                preview_row.controls = [preview_image(path, height=160, tooltip=os.path.basename(path))
+                                        for path in entry["pages"]]
+            request_update(page)
+        
+        if pymupdf is None:
+            preview_row.controls.clear()
+        else:
+            previews.request(attachment["sha256"], page=page, on_ready=show_previews)
+        return ft.Column([
+            ft.Row([
+                ft.Icon(ft.Icons.PICTURE_AS_PDF, color="#E53E3E", size=16),
+                ft.Text(attachment["name"], size=12)
+            ]),
+            preview_row
+        ])
+    
+    for attachment in project.technical_drawings_pdf:
+        drawings_section.controls.append(create_drawing_preview(attachment))
+    for attachment in project.technical_drawings_step:
+        drawings_section.controls.append(ft.Row([
+            ft.Icon(ft.Icons.ENGINEERING, color="#4A90E2", size=16),
+            ft.Text(attachment["name"], size=12)
+        ]))
+        metadata = step_metadata.get(attachment["sha256"])
+        if metadata:
+            drawings_section.controls.append(ft.Column([
+                ft.Text(f"Sistema de origen: {metadata['originating_system'] or 'No especificado'}", size=11),
+                ft.Text(f"Esquema: {', '.join(metadata['schemas']) or 'No especificado'}", size=11),
+                ft.Text(f"Unidades: {', '.join(metadata['units']) or 'No especificado'}", size=11),
+                ft.Text(f"Productos: {', '.join(p['name'] or p['id'] for p in metadata['products'][:10]) or 'No especificado'}", size=11)
+            ], spacing=2))
+    if not project.technical_drawings_pdf and not project.technical_drawings_step:
+        drawings_section.controls.append(ft.Text("Sin documentos adjuntos", size=12, color=ft.Colors.GREY))
+
     modal_content = ft.Container(
         content=ft.Column([
             ft.Row([
                 ft.Text("Detalles del Proyecto", size=20, weight="bold", expand=True),
-                ft.IconButton(ft.Icons.CLOSE, on_click=lambda e: setattr(modal, "open", False) or page.update())
+                ft.IconButton(ft.Icons.CLOSE, on_click=lambda e: setattr(modal, "open", False) or request_update(page))
             ]),
             ft.Divider(),
             
@@ -393,7 +4020,11 @@ def show_project_details_modal(page: ft.Page, project: ProjectInfo):
                         border_radius=12,
                         padding=ft.padding.symmetric(horizontal=12, vertical=4)
                     ),
-                    ft.Text(f"Score: {project.feasibility_score}%", size=14, weight="bold", color="#4A90E2")
+                    ft.Text(f"Score: {project.feasibility_score}%", size=14, weight="bold", color="#4A90E2"),
+                    ft.Text(
+                        " · ".join(f"{CATEGORY_LABELS[c]} {v:.0%}" for c, v in scoring.breakdown(project.id).items()),
+                        size=11, color="#6B7280"
+                    )
                 ])
             ]),
             
@@ -472,6 +4103,31 @@ def show_project_details_modal(page: ft.Page, project: ProjectInfo):
             
             ft.Divider(),
             
+            # Capacity
+            capacity_section,
+            
+            ft.Divider(),
+            
+            # Steel consumption
+            coil_section,
+            
+            ft.Divider(),
+            
+            # Tool life
+            tool_life_section,
+            
+            ft.Divider(),
+            
+            # Quote risk
+            risk_section,
+            
+            ft.Divider(),
+            
+            # Sensitivity
+            sensitivity_section,
+            
+            ft.Divider(),
+            
             # Sales Information
             ft.Row([
                 ft.Column([
@@ -523,6 +4179,13 @@ def show_project_details_modal(page: ft.Page, project: ProjectInfo):
                 ], expand=True)
             ]),
             
+            quotes_list,
+            
+            ft.Divider(),
+            
+            # Technical drawings
+            drawings_section,
+            
             ft.Divider(),
             
             # Risk and opportunities
@@ -540,7 +4203,12 @@ def show_project_details_modal(page: ft.Page, project: ProjectInfo):
             ft.Divider(),
             
             # Comments section
-            comments_list
+            comments_list,
+            
+            ft.Divider(),
+            
+            # Change history
+            history_section
         ], scroll=ft.ScrollMode.AUTO),
         width=800,
         height=600,
@@ -591,7 +4259,7 @@ def show_project_details_modal(page: ft.Page, project: ProjectInfo):
     # Clear any existing modals and add this one
     page.overlay.clear()
     page.overlay.append(overlay)
-    page.update()
+    request_update(page)
 
 def close_modal(modal, page: ft.Page):
     """Properly close the modal and clean up"""
@@ -606,7 +4274,7 @@ def close_modal(modal, page: ft.Page):
         page.overlay.clear()
         
         # Force a complete page refresh
-        page.update()
+        request_update(page)
         
         print("Modal closed successfully")
         
@@ -616,7 +4284,7 @@ def close_modal(modal, page: ft.Page):
         try:
             page.overlay.clear()
             current_modal = None
-            page.update()
+            request_update(page)
             print("Emergency modal cleanup completed")
         except:
             pass
@@ -628,6 +4296,9 @@ def edit_project_modal(page: ft.Page, project: ProjectInfo):
     # Force close any existing modals first
     force_close_all_modals(page)
     
+    # Version the form was loaded from, checked on save
+    base_version = project.version
+    
     # Form fields with pre-filled values
     project_name_field = ft.TextField(
         label="Nombre del Proyecto *", 
@@ -787,13 +4458,13 @@ def edit_project_modal(page: ft.Page, project: ProjectInfo):
         new_field = create_risk_field(len(risk_fields))
         risk_fields.append(new_field)
         risk_factors_container.controls.append(new_field)
-        page.update()
+        request_update(page)
     
     def add_opp_field(e):
         new_field = create_opp_field(len(opp_fields))
         opp_fields.append(new_field)
         opportunities_container.controls.append(new_field)
-        page.update()
+        request_update(page)
     
     def remove_risk_field(field_to_remove):
         if field_to_remove in risk_fields:
@@ -802,7 +4473,7 @@ def edit_project_modal(page: ft.Page, project: ProjectInfo):
             # Update labels
             for i, field in enumerate(risk_fields):
                 field.label = f"Factor de Riesgo {i + 1}"
-            page.update()
+            request_update(page)
     
     def remove_opp_field(field_to_remove):
         if field_to_remove in opp_fields:
@@ -811,7 +4482,7 @@ def edit_project_modal(page: ft.Page, project: ProjectInfo):
             # Update labels
             for i, field in enumerate(opp_fields):
                 field.label = f"Oportunidad {i + 1}"
-            page.update()
+            request_update(page)
     
     # Initialize with existing data
     for i, risk in enumerate(project.risk_factors):
@@ -877,14 +4548,14 @@ def edit_project_modal(page: ft.Page, project: ProjectInfo):
         if missing_fields:
             error_text.value = f"Campos requeridos faltantes: {', '.join(missing_fields)}"
             error_text.visible = True
-            page.update()
+            request_update(page)
             return False
         
         # Validate email format
         if customer_email_field.value and "@" not in customer_email_field.value:
             error_text.value = "Formato de email inválido"
             error_text.visible = True
-            page.update()
+            request_update(page)
             return False
         
         # Validate numeric fields
@@ -896,51 +4567,61 @@ def edit_project_modal(page: ft.Page, project: ProjectInfo):
         except ValueError:
             error_text.value = "Los campos de precio y margen deben ser números válidos"
             error_text.visible = True
-            page.update()
+            request_update(page)
             return False
         
         error_text.visible = False
-        page.update()
+        request_update(page)
         return True
 
+    def form_values() -> Dict:
+        return {
+            'project_name': project_name_field.value.strip(),
+            'customer_name': customer_name_field.value.strip(),
+            'customer_contact': customer_contact_field.value.strip(),
+            'customer_email': customer_email_field.value.strip(),
+            'customer_phone': customer_phone_field.value.strip() if customer_phone_field.value else "",
+            'project_description': description_field.value.strip(),
+            'expected_volume': volume_field.value.strip(),
+            'target_price': float(price_field.value) if price_field.value else 0.0,
+            'target_margin': float(margin_field.value) if margin_field.value else 0.0,
+            'delivery_date': delivery_field.value.strip(),
+            'technical_requirements': tech_requirements_field.value.strip() if tech_requirements_field.value else "",
+            'quality_requirements': quality_requirements_field.value.strip() if quality_requirements_field.value else "",
+            'regulatory_requirements': regulatory_requirements_field.value.strip() if regulatory_requirements_field.value else "",
+            'priority': priority_dropdown.value,
+            'status': status_dropdown.value,
+            'assigned_departments': [dept for dept in [dept1_dropdown.value, dept2_dropdown.value, dept3_dropdown.value] if dept],
+            'risk_factors': [risk.strip() for risk in [field.value for field in risk_fields] if risk and risk.strip()],
+            'opportunities': [opp.strip() for opp in [field.value for field in opp_fields] if opp and opp.strip()]
+        }
+    
+    # Values as loaded, so a save only submits the fields the user actually changed
+    initial_values = form_values()
+
     def save_changes(e):
         if not validate_form():
             return
             
         try:
-            # Update project with new values
-            updates = {
-                'project_name': project_name_field.value.strip(),
-                'customer_name': customer_name_field.value.strip(),
-                'customer_contact': customer_contact_field.value.strip(),
-                'customer_email': customer_email_field.value.strip(),
-                'customer_phone': customer_phone_field.value.strip() if customer_phone_field.value else "",
-                'project_description': description_field.value.strip(),
-                'expected_volume': volume_field.value.strip(),
-                'target_price': float(price_field.value) if price_field.value else 0.0,
-                'target_margin': float(margin_field.value) if margin_field.value else 0.0,
-                'delivery_date': delivery_field.value.strip(),
-                'technical_requirements': tech_requirements_field.value.strip() if tech_requirements_field.value else "",
-                'quality_requirements': quality_requirements_field.value.strip() if quality_requirements_field.value else "",
-                'regulatory_requirements': regulatory_requirements_field.value.strip() if regulatory_requirements_field.value else "",
-                'priority': priority_dropdown.value,
-                'status': status_dropdown.value,
-                'assigned_departments': [dept for dept in [dept1_dropdown.value, dept2_dropdown.value, dept3_dropdown.value] if dept],
-                'risk_factors': [risk.strip() for risk in [field.value for field in risk_fields] if risk and risk.strip()],
-                'opportunities': [opp.strip() for opp in [field.value for field in opp_fields] if opp and opp.strip()]
-            }
+            updates = {key: value for key, value in form_values().items() if value != initial_values[key]}
+            if not updates:
+                close_modal(modal, page)
+                return
             
-            state.update_project(project.id, updates)
+            version = state.update_project(project.id, updates, expected_version=base_version, author=page.session_id)
+            get_session(page).history.record(project.id, version)
             close_modal(modal, page)
-            # Small delay to ensure modal is fully closed before refreshing
-            import time
-            time.sleep(0.1)
             update_dashboard(page)  # Refresh the dashboard after updating project
             
+        except ProjectConflictError as ex:
+            error_text.value = str(ex)
+            error_text.visible = True
+            request_update(page)
         except Exception as ex:
             error_text.value = f"Error al actualizar el proyecto: {str(ex)}"
             error_text.visible = True
-            page.update()
+            request_update(page)
 
     def clear_form(e):
         # Clear all fields
@@ -961,7 +4642,7 @@ def edit_project_modal(page: ft.Page, project: ProjectInfo):
             dropdown.value = None
         
         error_text.visible = False
-        page.update()
+        request_update(page)
 
     # Create tabbed interface for better organization
     basic_info_tab = ft.Column([
@@ -1139,7 +4820,7 @@ def edit_project_modal(page: ft.Page, project: ProjectInfo):
     current_modal = overlay
     page.overlay.append(overlay)
     
-    page.update()
+    request_update(page)
 
 def create_new_project_form(page: ft.Page):
     global current_modal
@@ -1258,30 +4939,69 @@ def create_new_project_form(page: ft.Page):
     pdf_files = []
     step_files = []
     
+    uploads = get_session(page).uploads
+    # Rejections from files validated in parallel, shown together
+    attachment_errors = []
+    # Attach jobs and uploads not finished yet; saving waits for them
+    pending_attachments = set()
+    
+    def attach_file(picker: ft.FilePicker, file, target: List[Dict], kind: str):
+        token = object()
+        pending_attachments.add(token)
+        
+        def on_stored(attachment):
+            pending_attachments.discard(token)
+            target.append(attachment)
+            if target is pdf_files:
+                previews.request(attachment["sha256"], page=page, on_ready=lambda entry: update_document_display())
+            update_document_display()
+        
+        def on_failed(error):
+            pending_attachments.discard(token)
+            attachment_errors.append(f"{file.name}: {error}")
+            error_text.value = "Archivos rechazados: " + "; ".join(attachment_errors[-5:])
+            error_text.visible = True
+            update_document_display()
+        
+        if file.path is None:
+            # Web deployments get no server-side path; the file has to be uploaded
+            uploads.enqueue(picker, file, on_complete=on_stored, on_failed=on_failed, kind=kind)
+            return
+        
+        # Validate and copy into the attachment store off the UI thread; files picked
+        # together are checked in parallel by the worker pool
+        try:
+            jobs.submit(f"Adjuntar {file.name}", store_attachment, file.path, kind,
+                        page=page, on_result=on_stored, on_error=on_failed)
+        except JobQueueFullError as ex:
+            on_failed(str(ex))
+    
     def on_pdf_file_picked(e: ft.FilePickerResultEvent):
         if e.files:
+            attachment_errors.clear()
             for file in e.files:
                 # Validate file extension
-                if file.path.lower().endswith('.pdf'):
-                    pdf_files.append(file.path)
+                if file.name.lower().endswith('.pdf'):
+                    attach_file(pdf_picker, file, pdf_files, "pdf")
                 else:
                     # Show error message for invalid file type
-                    error_text.value = f"Archivo inválido: {file.path.split('/')[-1]}. Solo se permiten archivos PDF."
+                    error_text.value = f"Archivo inválido: {file.name}. Solo se permiten archivos PDF."
                     error_text.visible = True
-                    page.update()
+                    request_update(page)
             update_document_display()
     
     def on_step_file_picked(e: ft.FilePickerResultEvent):
         if e.files:
+            attachment_errors.clear()
             for file in e.files:
                 # Validate file extension
-                if file.path.lower().endswith(('.stp', '.step')):
-                    step_files.append(file.path)
+                if file.name.lower().endswith(('.stp', '.step')):
+                    attach_file(step_picker, file, step_files, "step")
                 else:
                     # Show error message for invalid file type
-                    error_text.value = f"Archivo inválido: {file.path.split('/')[-1]}. Solo se permiten archivos STEP (.stp, .step)."
+                    error_text.value = f"Archivo inválido: {file.name}. Solo se permiten archivos STEP (.stp, .step)."
                     error_text.visible = True
-                    page.update()
+                    request_update(page)
             update_document_display()
     
     def update_document_display():
@@ -1290,12 +5010,14 @@ def create_new_project_form(page: ft.Page):
         step_display.controls.clear()
         
         # Add PDF files
-        for i, file_path in enumerate(pdf_files):
+        for i, attachment in enumerate(pdf_files):
+            entry = previews.get(attachment["sha256"])
             pdf_display.controls.append(
                 ft.Container(
                     content=ft.Row([
+                        preview_image(entry["thumbnail"], height=48) if entry else
                         ft.Icon(ft.Icons.PICTURE_AS_PDF, color="#E53E3E", size=16),
-                        ft.Text(f"PDF {i+1}: {file_path.split('/')[-1]}", size=12),
+                        ft.Text(f"PDF {i+1}: {attachment['name']}", size=12),
                         ft.IconButton(
                             ft.Icons.DELETE,
                             on_click=lambda e, idx=i: remove_pdf_file(idx),
@@ -1311,12 +5033,12 @@ def create_new_project_form(page: ft.Page):
             )
         
         # Add STEP files
-        for i, file_path in enumerate(step_files):
+        for i, attachment in enumerate(step_files):
             step_display.controls.append(
                 ft.Container(
                     content=ft.Row([
                         ft.Icon(ft.Icons.ENGINEERING, color="#4A90E2", size=16),
-                        ft.Text(f"STEP {i+1}: {file_path.split('/')[-1]}", size=12),
+                        ft.Text(f"STEP {i+1}: {attachment['name']}", size=12),
                         ft.IconButton(
                             ft.Icons.DELETE,
                             on_click=lambda e, idx=i: remove_step_file(idx),
@@ -1331,7 +5053,18 @@ def create_new_project_form(page: ft.Page):
                 )
             )
         
-        page.update()
+        # Add uploads still in progress
+        for task in uploads.tasks():
+            display = pdf_display if task.picker is pdf_picker else step_display
+            display.controls.append(
+                ft.Row([
+                    ft.Icon(ft.Icons.CLOUD_UPLOAD, color="#6B7280", size=16),
+                    ft.Text(f"{task.name} ({task.status})", size=12, expand=True),
+                    ft.ProgressBar(value=task.progress, width=120, color="#4A90E2")
+                ])
+            )
+        
+        request_update(page)
     
     def remove_pdf_file(index):
         if 0 <= index < len(pdf_files):
@@ -1345,11 +5078,14 @@ def create_new_project_form(page: ft.Page):
     
     # File pickers
     pdf_picker = ft.FilePicker(
-        on_result=on_pdf_file_picked
+        on_result=on_pdf_file_picked,
+        on_upload=lambda e: uploads.handle_event(pdf_picker, e)
     )
     step_picker = ft.FilePicker(
-        on_result=on_step_file_picked
+        on_result=on_step_file_picked,
+        on_upload=lambda e: uploads.handle_event(step_picker, e)
     )
+    uploads.on_change = update_document_display
     
     # Document display containers
     pdf_display = ft.Column([])
@@ -1423,13 +5159,13 @@ def create_new_project_form(page: ft.Page):
         new_field = create_new_risk_field(len(new_risk_fields))
         new_risk_fields.append(new_field)
         new_risk_factors_container.controls.append(new_field)
-        page.update()
+        request_update(page)
     
     def add_new_opp_field(e):
         new_field = create_new_opp_field(len(new_opp_fields))
         new_opp_fields.append(new_field)
         new_opportunities_container.controls.append(new_field)
-        page.update()
+        request_update(page)
     
     # Add initial fields
     initial_risk = create_new_risk_field(0)
@@ -1492,14 +5228,14 @@ def create_new_project_form(page: ft.Page):
         if missing_fields:
             error_text.value = f"Campos requeridos faltantes: {', '.join(missing_fields)}"
             error_text.visible = True
-            page.update()
+            request_update(page)
             return False
         
         # Validate email format
         if customer_email_field.value and "@" not in customer_email_field.value:
             error_text.value = "Formato de email inválido"
             error_text.visible = True
-            page.update()
+            request_update(page)
             return False
         
         # Validate numeric fields
@@ -1511,40 +5247,24 @@ def create_new_project_form(page: ft.Page):
         except ValueError:
             error_text.value = "Los campos de precio y margen deben ser números válidos"
             error_text.visible = True
-            page.update()
+            request_update(page)
             return False
         
         error_text.visible = False
-        page.update()
+        request_update(page)
         return True
 
     def save_project(e):
         if not validate_form():
             return
+        if pending_attachments:
+            # A job finishing after the save would append to a list the project no longer uses
+            error_text.value = f"Espere a que terminen de adjuntarse {len(pending_attachments)} archivo(s) antes de guardar"
+            error_text.visible = True
+            request_update(page)
+            return
             
         try:
-            # Calculate initial feasibility score based on form completeness
-            completeness_score = 0
-            total_fields = 15  # Total number of important fields
-            
-            if project_name_field.value: completeness_score += 1
-            if customer_name_field.value: completeness_score += 1
-            if customer_contact_field.value: completeness_score += 1
-            if customer_email_field.value: completeness_score += 1
-            if description_field.value: completeness_score += 1
-            if volume_field.value: completeness_score += 1
-            if price_field.value: completeness_score += 1
-            if delivery_field.value: completeness_score += 1
-            if tech_requirements_field.value: completeness_score += 1
-            if quality_requirements_field.value: completeness_score += 1
-            if regulatory_requirements_field.value: completeness_score += 1
-            if dept1_dropdown.value: completeness_score += 1
-            if new_risk_fields and new_risk_fields[0].value: completeness_score += 1
-            if new_opp_fields and new_opp_fields[0].value: completeness_score += 1
-            if priority_dropdown.value: completeness_score += 1
-            
-            initial_score = int((completeness_score / total_fields) * 100)
-            
             new_project = ProjectInfo(
                 id=0,  # Will be set by state
                 project_name=project_name_field.value.strip(),
@@ -1566,7 +5286,7 @@ def create_new_project_form(page: ft.Page):
                 created_date=datetime.datetime.now().strftime("%Y-%m-%d"),
                 last_updated=datetime.datetime.now().strftime("%Y-%m-%d"),
                 assigned_departments=[dept for dept in [dept1_dropdown.value, dept2_dropdown.value, dept3_dropdown.value] if dept],
-                feasibility_score=initial_score,
+                feasibility_score=0,
                 risk_factors=[risk.strip() for risk in [field.value for field in new_risk_fields] if risk and risk.strip()],
                 opportunities=[opp.strip() for opp in [field.value for field in new_opp_fields] if opp and opp.strip()],
                 comments=[],
@@ -1619,18 +5339,17 @@ def create_new_project_form(page: ft.Page):
                 toolmaker_life_guarantee=int(toolmaker_life_guarantee_field.value) if toolmaker_life_guarantee_field.value else 0,
                 toolmaker_lead_time_weeks=int(toolmaker_lead_time_field.value) if toolmaker_lead_time_field.value else 0
             )
+            apply_volume_parse(new_project)
+            new_project.feasibility_score = scoring.score(new_project)
             
-            state.add_project(new_project)
+            state.add_project(new_project, author=page.session_id)
             close_modal(modal, page)
-            # Small delay to ensure modal is fully closed before refreshing
-            import time
-            time.sleep(0.1)
             update_dashboard(page)  # Refresh the dashboard after adding project
             
         except Exception as ex:
             error_text.value = f"Error al guardar el proyecto: {str(ex)}"
             error_text.visible = True
-            page.update()
+            request_update(page)
 
     def clear_form(e):
         # Clear all fields
@@ -1656,7 +5375,7 @@ def create_new_project_form(page: ft.Page):
             dropdown.value = None
         
         error_text.visible = False
-        page.update()
+        request_update(page)
 
     # Additional General Information fields
     offer_number_field = ft.TextField(
@@ -2607,29 +6326,510 @@ def create_new_project_form(page: ft.Page):
     print(f"Buttons created: Cancel={cancel_button.text}, Save={save_button.text}")
     print(f"Cancel button visible: {cancel_button.visible}, Save button visible: {save_button.visible}")
     
-    page.update()
+    request_update(page)
+
+
+def show_press_plan_modal(page: ft.Page, full: bool = False):
+    """Show the proposed press assignment and the weeks where a press is overloaded"""
+    force_close_all_modals(page)
+    plan = scheduler.plan(full=full)
+    
+    def apply_plan(e):
+        skipped = [state.get_project(pid) for pid in scheduler.apply_plan(plan, author=page.session_id)]
+        update_dashboard(page)
+        if not skipped:
+            close_modal(modal, page)
+            return
+        # Keep the modal open so the user sees which projects were left alone
+        conflict_text.value = ("Cambiaron de prensa después del plan y no se modificaron: " +
+                               ", ".join(p.project_name for p in skipped if p))
+        conflict_text.visible = True
+        request_update(page)
+    
+    conflict_text = ft.Text("", size=12, color="#E53E3E", visible=False)
+    
+    def replan_all(e):
+        scheduler.set_presses(load_press_catalog(projects=state.projects))
+        show_press_plan_modal(page, full=True)
+    
+    press_rows = []
+    for press in scheduler.presses:
+        assigned = [state.get_project(pid) for pid, a in plan["assignments"].items()
+                    if a["press"] is not None and a["press"].press_number == press.press_number]
+        utilization = plan["peak_utilization"][press.press_number]
+        press_rows.append(ft.Container(
+            content=ft.Column([
+                ft.Row([
+                    ft.Icon(ft.Icons.PRECISION_MANUFACTURING, color="#F5A623", size=16),
+                    ft.Text(f"{press.press_number} ({press.production_line or 'Sin línea'}, {press.tonnage:.0f} t)",
+                            size=13, weight="bold", expand=True),
+                    ft.Text(f"Pico: {utilization:.0%}", size=12,
+                            color="#E53E3E" if utilization > 1 else "#00BFA5")
+                ]),
+                ft.Text(", ".join(p.project_name for p in assigned if p) or "Sin proyectos asignados",
+                        size=11, color="#6B7280")
+            ]),
+            bgcolor=ft.Colors.GREY_100,
+            padding=10,
+            border_radius=8
+        ))
+    
+    unassigned = [state.get_project(pid) for pid, a in plan["assignments"].items() if a["press"] is None]
+    # Load from the presses and lines the projects currently name, all statuses included
+    load_rows = [
+        ft.Text(f"Prensa {load['press']}: {load['hours_per_week']:.1f} h/semana ({load['utilization']:.0%})",
+                size=11, color="#E53E3E" if load["utilization"] > 1 else "#374151")
+        for load in capacity.press_loads()
+    ] + [
+        ft.Text(f"Línea {load['line']}: {load['hours_per_week']:.1f} h/semana", size=11, color="#374151")
+        for load in capacity.line_loads()
+    ]
+    overload_rows = [
+        ft.Text(f"Semana {o['week']}: {o['press']} con {o['load']:.1f} h de {o['available']:.0f} h disponibles",
+                size=11, color="#E53E3E")
+        for o in plan["overloads"][:50]
+    ]
+    
+    modal = ft.Container(
+        content=ft.Column([
+            ft.Row([
+                ft.Text("Plan de Carga de Prensas", size=18, weight="bold", expand=True),
+                ft.IconButton(ft.Icons.CLOSE, on_click=lambda e: close_modal(modal, page), tooltip="Cerrar")
+            ]),
+            ft.Divider(),
+            ft.Column(
+                press_rows +
+                ([ft.Text("Sin prensa con tonelaje suficiente: " + ", ".join(p.project_name for p in unassigned if p),
+                          size=12, color="#E53E3E")] if unassigned else []) +
+                [ft.Divider(), ft.Text("Carga Actual por Prensa y Línea", size=16, weight="bold")] +
+                (load_rows or [ft.Text("Ningún proyecto tiene prensa o línea asignada", size=12, color=ft.Colors.GREY)]) +
+                [ft.Divider(), ft.Text("Sobrecargas por Semana", size=16, weight="bold")] +
+                (overload_rows or [ft.Text("Sin sobrecargas en el horizonte de planeación", size=12, color="#00BFA5")]),
+                scroll=ft.ScrollMode.AUTO,
+                expand=True
+            ),
+            conflict_text,
+            ft.Row([
+                ft.ElevatedButton("Replanificar Todo", icon=ft.Icons.REFRESH, on_click=replan_all),
+                ft.ElevatedButton("Aplicar Asignación", icon=ft.Icons.SAVE, on_click=apply_plan,
+                                  bgcolor="#00BFA5", color=ft.Colors.WHITE)
+            ], alignment=ft.MainAxisAlignment.END)
+        ], expand=True),
+        bgcolor=ft.Colors.WHITE,
+        border_radius=10,
+        padding=20,
+        width=800,
+        height=700,
+        shadow=ft.BoxShadow(blur_radius=20, spread_radius=5, color=ft.Colors.BLACK26)
+    )
+    
+    overlay = ft.Container(
+        content=modal,
+        bgcolor=ft.Colors.BLACK26,
+        alignment=ft.alignment.center,
+        expand=True,
+        on_click=lambda e: close_modal(modal, page) if e.target == overlay else None
+    )
+    page.overlay.append(overlay)
+    request_update(page)
+
+
+def show_material_requirements_modal(page: ft.Page, months: int = 12):
+    """Show monthly material demand for the next months"""
+    force_close_all_modals(page)
+    totals = materials.totals()
+    month_labels = [m.strftime("%m/%y") for m in materials.months()[:months]]
+    units = {STEEL: "t", ALUMINUM: "kg", GLUE_PRIMER: "u"}
+    
+    rows = []
+    for (material, coating), series in sorted(totals.items()):
+        values = series[:months] / 1000 if material == STEEL else series[:months]
+        rows.append(ft.DataRow(cells=[
+            ft.DataCell(ft.Text(f"{material} {coating}".strip() + f" ({units[material]})", size=11))
+        ] + [ft.DataCell(ft.Text(f"{v:,.1f}", size=11)) for v in values]))
+    
+    modal = ft.Container(
+        content=ft.Column([
+            ft.Row([
+                ft.Text("Requerimientos de Material por Mes", size=18, weight="bold", expand=True),
+                ft.IconButton(ft.Icons.CLOSE, on_click=lambda e: close_modal(modal, page), tooltip="Cerrar")
+            ]),
+            ft.Divider(),
+            ft.Row([
+                ft.DataTable(
+                    columns=[ft.DataColumn(ft.Text("Material", size=12, weight="bold"))] +
+                            [ft.DataColumn(ft.Text(label, size=12, weight="bold"), numeric=True) for label in month_labels],
+                    rows=rows,
+                    column_spacing=12
+                )
+            ], scroll=ft.ScrollMode.AUTO) if rows else
+            ft.Text("Sin demanda de material: faltan fechas, volumen o datos de acero", size=12, color=ft.Colors.GREY)
+        ], scroll=ft.ScrollMode.AUTO, expand=True),
+        bgcolor=ft.Colors.WHITE,
+        border_radius=10,
+        padding=20,
+        width=1000,
+        height=500,
+        shadow=ft.BoxShadow(blur_radius=20, spread_radius=5, color=ft.Colors.BLACK26)
+    )
+    
+    overlay = ft.Container(
+        content=modal,
+        bgcolor=ft.Colors.BLACK26,
+        alignment=ft.alignment.center,
+        expand=True,
+        on_click=lambda e: close_modal(modal, page) if e.target == overlay else None
+    )
+    page.overlay.append(overlay)
+    request_update(page)
+
+
+def show_scoring_weights_modal(page: ft.Page):
+    """Edit the feasibility category weights; the portfolio is rescored in the background"""
+    force_close_all_modals(page)
+    weight_fields = {
+        category: ft.TextField(label=f"{label} (%)", value=f"{scoring.weights.get(category, 0.0) * 100:g}", width=160)
+        for category, label in CATEGORY_LABELS.items()
+    }
+    error_text = ft.Text("", size=12, color="#E53E3E", visible=False)
+    
+    def save_weights(e):
+        try:
+            weights = {category: float(field.value or 0) / 100.0 for category, field in weight_fields.items()}
+        except ValueError:
+            weights = None
+        if weights is None or any(w < 0 for w in weights.values()) or sum(weights.values()) <= 0:
+            error_text.value = "Los pesos deben ser números positivos y no todos cero"
+            error_text.visible = True
+            request_update(page)
+            return
+        scoring.set_weights(weights, page=page)
+        close_modal(modal, page)
+    
+    modal = ft.Container(
+        content=ft.Column([
+            ft.Row([
+                ft.Text("Pesos de Factibilidad", size=18, weight="bold", expand=True),
+                ft.IconButton(ft.Icons.CLOSE, on_click=lambda e: close_modal(modal, page), tooltip="Cerrar")
+            ]),
+            ft.Divider(),
+            ft.Text("Los puntajes se recalculan en segundo plano al guardar.", size=12, color="#6B7280"),
+            ft.Row(list(weight_fields.values()), wrap=True),
+            error_text,
+            ft.Row([
+                ft.ElevatedButton("Guardar Pesos", icon=ft.Icons.SAVE, on_click=save_weights,
+                                  bgcolor="#00BFA5", color=ft.Colors.WHITE)
+            ], alignment=ft.MainAxisAlignment.END)
+        ]),
+        bgcolor=ft.Colors.WHITE,
+        border_radius=10,
+        padding=20,
+        width=720,
+        shadow=ft.BoxShadow(blur_radius=20, spread_radius=5, color=ft.Colors.BLACK26)
+    )
+    
+    overlay = ft.Container(
+        content=modal,
+        bgcolor=ft.Colors.BLACK26,
+        alignment=ft.alignment.center,
+        expand=True,
+        on_click=lambda e: close_modal(modal, page) if e.target == overlay else None
+    )
+    page.overlay.append(overlay)
+    request_update(page)
+
+
+GANTT_WINDOW_DAYS = 182
+GANTT_DAY_WIDTH = 4
+GANTT_LABEL_WIDTH = 180
+
+def show_timeline_modal(page: ft.Page):
+    """Gantt view of forecast milestones; only the visible window is drawn"""
+    force_close_all_modals(page)
+    today = datetime.date.today()
+    window = {"start": today - datetime.timedelta(days=today.weekday())}
+    gantt_rows = ft.Column([], scroll=ft.ScrollMode.AUTO, expand=True)
+    window_label = ft.Text("", size=12, weight="bold")
+    
+    def bar(start: datetime.date, end: datetime.date, color: str, tooltip: str) -> Optional[ft.Container]:
+        first = max((start - window["start"]).days, 0)
+        last = min((end - window["start"]).days, GANTT_WINDOW_DAYS)
+        if last < first:
+            return None
+        return ft.Container(left=first * GANTT_DAY_WIDTH, top=4, width=max((last - first) * GANTT_DAY_WIDTH, 3),
+                            height=12, bgcolor=color, border_radius=3, tooltip=tooltip)
+    
+    def render():
+        window_end = window["start"] + datetime.timedelta(days=GANTT_WINDOW_DAYS)
+        window_label.value = f"{window['start']:%d/%m/%Y} - {window_end:%d/%m/%Y}"
+        critical = {pid for pid, _ in timeline.critical_path()}
+        schedules = timeline.timeline()
+        
+        header = [ft.Container(width=GANTT_LABEL_WIDTH)]
+        month = window["start"].replace(day=1)
+        ticks = []
+        while month < window_end:
+            if month >= window["start"]:
+                ticks.append(ft.Container(
+                    content=ft.Text(f"{month:%m/%y}", size=10, color="#6B7280"),
+                    left=(month - window["start"]).days * GANTT_DAY_WIDTH, top=0
+                ))
+            month = (month + datetime.timedelta(days=32)).replace(day=1)
+        header.append(ft.Stack(ticks, width=GANTT_WINDOW_DAYS * GANTT_DAY_WIDTH, height=16))
+        rows = [ft.Row(header, spacing=0)]
+        
+        for pid, schedule in sorted(schedules.items(), key=lambda item: item[1]["sop"]["forecast"] or datetime.date.max):
+            start = today
+            end = schedule["sop"]["forecast"] or schedule["first_parts"]["forecast"]
+            # Skip projects that do not touch the visible window
+            if end is None or end < window["start"] or start > window_end:
+                continue
+            project = state.get_project(pid)
+            if project is None:
+                continue
+            
+            late = schedule["sop"]["slip_days"] > 0 or (schedule["sop"]["slack_days"] or 0) < 0
+            bars = [
+                bar(today, schedule["tool"]["forecast"], "#9C27B0",
+                    f"Herramental listo: {schedule['tool']['forecast']:%d/%m/%Y}"),
+                bar(schedule["first_parts"]["forecast"], schedule["sop"]["forecast"],
+                    "#E53E3E" if late else "#00BFA5",
+                    f"Primeras piezas {schedule['first_parts']['forecast']:%d/%m/%Y} · "
+                    f"PPAP {schedule['ppap']['forecast']:%d/%m/%Y} · SOP {schedule['sop']['forecast']:%d/%m/%Y}"),
+            ]
+            planned_sop = schedule["sop"]["planned"]
+            if planned_sop is not None:
+                bars.append(bar(planned_sop, planned_sop, "#1F2937", f"SOP planeado: {planned_sop:%d/%m/%Y}"))
+            
+            rows.append(ft.Row([
+                ft.Container(
+                    content=ft.Text(project.project_name, size=11, weight="bold" if pid in critical else None,
+                                    color="#E53E3E" if pid in critical else None, no_wrap=True),
+                    width=GANTT_LABEL_WIDTH,
+                    tooltip="En la ruta crítica" if pid in critical else None
+                ),
+                ft.Stack([b for b in bars if b is not None], width=GANTT_WINDOW_DAYS * GANTT_DAY_WIDTH, height=20)
+            ], spacing=0))
+        
+        if len(rows) == 1:
+            rows.append(ft.Text("Sin hitos en esta ventana", size=12, color=ft.Colors.GREY))
+        gantt_rows.controls = rows
+        request_update(page)
+    
+    def shift(weeks: int):
+        window["start"] += datetime.timedelta(weeks=weeks)
+        render()
+    
+    modal = ft.Container(
+        content=ft.Column([
+            ft.Row([
+                ft.Text("Cronograma de Proyectos", size=18, weight="bold", expand=True),
+                ft.IconButton(ft.Icons.CHEVRON_LEFT, on_click=lambda e: shift(-13), tooltip="Anterior"),
+                window_label,
+                ft.IconButton(ft.Icons.CHEVRON_RIGHT, on_click=lambda e: shift(13), tooltip="Siguiente"),
+                ft.IconButton(ft.Icons.CLOSE, on_click=lambda e: close_modal(modal, page), tooltip="Cerrar")
+            ]),
+            ft.Text("Morado: construcción del herramental · Verde/rojo: primeras piezas a SOP · "
+                    "Nombres en rojo: ruta crítica", size=11, color="#6B7280"),
+            ft.Divider(),
+            gantt_rows
+        ], expand=True),
+        bgcolor=ft.Colors.WHITE,
+        border_radius=10,
+        padding=20,
+        width=GANTT_LABEL_WIDTH + GANTT_WINDOW_DAYS * GANTT_DAY_WIDTH + 60,
+        height=650,
+        shadow=ft.BoxShadow(blur_radius=20, spread_radius=5, color=ft.Colors.BLACK26)
+    )
+    
+    overlay = ft.Container(
+        content=modal,
+        bgcolor=ft.Colors.BLACK26,
+        alignment=ft.alignment.center,
+        expand=True,
+        on_click=lambda e: close_modal(modal, page) if e.target == overlay else None
+    )
+    page.overlay.append(overlay)
+    render()
+
+
+def show_data_quality_modal(page: ft.Page):
+    """List expected_volume values that could not be used"""
+    force_close_all_modals(page)
+    issues = volume_data_quality_report(state.projects)
+    stats = state.get_stats()
+    
+    modal = ft.Container(
+        content=ft.Column([
+            ft.Row([
+                ft.Text("Calidad de Datos: Volumen", size=18, weight="bold", expand=True),
+                ft.IconButton(ft.Icons.CLOSE, on_click=lambda e: close_modal(modal, page), tooltip="Cerrar")
+            ]),
+            ft.Text(f"Volumen anual del portafolio: {stats['total_volume_sets']:,.0f} sets", size=12),
+            ft.Divider(),
+            ft.Column(
+                [ft.Container(
+                    content=ft.Column([
+                        ft.Text(issue["project_name"], size=12, weight="bold"),
+                        ft.Text(f"\"{issue['expected_volume']}\": {issue['problem']}", size=11, color="#E53E3E")
+                    ]),
+                    bgcolor=ft.Colors.GREY_100,
+                    padding=10,
+                    border_radius=8
+                ) for issue in issues] or
+                [ft.Text("Todos los volúmenes esperados son válidos", size=12, color="#00BFA5")],
+                scroll=ft.ScrollMode.AUTO,
+                expand=True
+            )
+        ], expand=True),
+        bgcolor=ft.Colors.WHITE,
+        border_radius=10,
+        padding=20,
+        width=600,
+        height=500,
+        shadow=ft.BoxShadow(blur_radius=20, spread_radius=5, color=ft.Colors.BLACK26)
+    )
+    
+    overlay = ft.Container(
+        content=modal,
+        bgcolor=ft.Colors.BLACK26,
+        alignment=ft.alignment.center,
+        expand=True,
+        on_click=lambda e: close_modal(modal, page) if e.target == overlay else None
+    )
+    page.overlay.append(overlay)
+    request_update(page)
+
+
+def show_tool_wear_modal(page: ft.Page):
+    """Portfolio list of tools that wear out before, or close to, the end of their project"""
+    force_close_all_modals(page)
+    rows = []
+    for alert in tool_life.alerts():
+        project = state.get_project(alert["project_id"])
+        if project is None:
+            continue
+        rows.append(ft.Container(
+            content=ft.Column([
+                ft.Text(project.project_name, size=12, weight="bold"),
+                ft.Text(
+                    f"Se desgasta en {alert['wear_out_year']} · {alert['life_used']:.0%} de la vida usada · "
+                    f"{alert['tools_needed']} herramental(es) necesarios",
+                    size=11, color="#E53E3E" if alert["second_tool"] else "#F5A623"
+                )
+            ]),
+            bgcolor=ft.Colors.GREY_100,
+            padding=10,
+            border_radius=8,
+            on_click=lambda e, project=project: show_project_details_modal(page, project)
+        ))
+    
+    modal = ft.Container(
+        content=ft.Column([
+            ft.Row([
+                ft.Text("Desgaste de Herramentales", size=18, weight="bold", expand=True),
+                ft.IconButton(ft.Icons.CLOSE, on_click=lambda e: close_modal(modal, page), tooltip="Cerrar")
+            ]),
+            ft.Divider(),
+            ft.Column(
+                rows or [ft.Text("Ningún herramental se desgasta antes del fin de su proyecto", size=12, color="#00BFA5")],
+                scroll=ft.ScrollMode.AUTO,
+                expand=True
+            )
+        ], expand=True),
+        bgcolor=ft.Colors.WHITE,
+        border_radius=10,
+        padding=20,
+        width=600,
+        height=500,
+        shadow=ft.BoxShadow(blur_radius=20, spread_radius=5, color=ft.Colors.BLACK26)
+    )
+    
+    overlay = ft.Container(
+        content=modal,
+        bgcolor=ft.Colors.BLACK26,
+        alignment=ft.alignment.center,
+        expand=True,
+        on_click=lambda e: close_modal(modal, page) if e.target == overlay else None
+    )
+    page.overlay.append(overlay)
+    request_update(page)
+
+
+def create_jobs_panel(page: ft.Page):
+    """Status panel listing this session's background jobs"""
+    jobs_list = ft.Column([], spacing=5)
+    panel = ft.Container(
+        content=ft.Column([
+            ft.Row([
+                ft.Icon(ft.Icons.PENDING_ACTIONS, color="#4A90E2", size=20),
+                ft.Text("Tareas en Segundo Plano", size=14, weight="bold")
+            ]),
+            jobs_list
+        ]),
+        bgcolor=ft.Colors.WHITE,
+        padding=15,
+        border_radius=10,
+        visible=False
+    )
+    
+    def refresh(job=None):
+        session_jobs = jobs.get_jobs(page.session_id)
+        jobs_list.controls = [
+            ft.Row([
+                ft.Text(j.name, size=12, expand=True),
+                ft.Text(j.status, size=11, color="#E53E3E" if j.error else "#6B7280", tooltip=j.error or None),
+                ft.ProgressBar(value=j.progress, width=150, color="#4A90E2"),
+                ft.IconButton(
+                    ft.Icons.CANCEL,
+                    on_click=lambda e, job_id=j.id: jobs.cancel(job_id),
+                    icon_color="#E53E3E",
+                    icon_size=16,
+                    tooltip="Cancelar",
+                    visible=j.status in (JobStatus.QUEUED.value, JobStatus.RUNNING.value)
+                )
+            ])
+            for j in session_jobs
+        ]
+        panel.visible = bool(session_jobs)
+        request_update(page)
+    
+    jobs.watch(page.session_id, refresh)
+    return panel
+
 
+def update_dashboard(page: ft.Page, changed_ids: Optional[List[int]] = None):
+    """Refresh the dashboard after modal operations.
 
-def update_dashboard(page: ft.Page):
-    """Refresh the dashboard after modal operations"""
-    global project_list_ref, stats_row_ref
+    With changed_ids only those project cards are rebuilt and the rest are reused.
+    """
+    session = get_session(page)
+    project_list_ref = session.project_list
+    stats_row_ref = session.stats_row
+    session.lock.acquire()
     try:
         # Update project list if reference exists
         if project_list_ref is not None:
-            project_list_ref.controls.clear()
-            projects = state.get_projects()
-            project_list_ref.controls.extend([create_project_card(p, page) for p in projects])
+            if changed_ids is None:
+                session.cards.clear()
+                session.card_versions.clear()
+            else:
+                for project_id in changed_ids:
+                    session.cards.pop(project_id, None)
+                    session.card_versions.pop(project_id, None)
+            projects = state.get_projects(session.query)
+            project_list_ref.controls = [session.card_for(p) for p in projects]
         
         # Update statistics if reference exists
         if stats_row_ref is not None:
-            # Recalculate statistics
-            total = len(state.projects)
-            feasible = len([p for p in state.projects if p.status == ProjectStatus.FEASIBLE.value])
-            under_review = len([p for p in state.projects if p.status == ProjectStatus.UNDER_REVIEW.value])
-            approved = len([p for p in state.projects if p.status == ProjectStatus.APPROVED.value])
-            rejected = len([p for p in state.projects if p.status == ProjectStatus.REJECTED.value])
-            not_feasible = len([p for p in state.projects if p.status == ProjectStatus.NOT_FEASIBLE.value])
-            avg_score = sum(p.feasibility_score for p in state.projects) / total if total > 0 else 0
+            stats = state.get_stats()
+            total = stats["total"]
+            feasible = stats["feasible"]
+            under_review = stats["under_review"]
+            approved = stats["approved"]
+            rejected = stats["rejected"]
+            not_feasible = stats["not_feasible"]
+            avg_score = stats["avg_score"]
             
             # Update the statistics containers
             if len(stats_row_ref.controls) >= 7:
@@ -2669,11 +6869,13 @@ def update_dashboard(page: ft.Page):
                     not_feasible_container.content.controls[1].value = str(not_feasible)
         
         # Force a complete page refresh to ensure all components are updated
-        page.update()
+        request_update(page)
     except Exception as e:
         print(f"Error updating dashboard: {e}")
         # Fallback: just update the page
-        page.update()
+        request_update(page)
+    finally:
+        session.lock.release()
 
 
 def main(page: ft.Page):
@@ -2688,29 +6890,49 @@ def main(page: ft.Page):
             force_close_all_modals(page)
     
     page.on_keyboard_event = on_keyboard
+    page.on_close = lambda e: drop_session(page)
 
     # Header
+    session = get_session(page)
+
+    # Undo/redo of this session's own saves
+    history_status = ft.Text("", size=11, color="#E53E3E")
+    
+    def step_history(step):
+        try:
+            history_status.value = "" if step() is not None else "Nada que deshacer o rehacer"
+        except ProjectConflictError as ex:
+            history_status.value = str(ex)
+        update_dashboard(page)
+        request_update(page)
+    
     header = ft.Row(
         alignment="start",
         controls=[
             ft.Row([
                 ft.Icon(ft.Icons.ASSESSMENT, color="#4A90E2", size=24),
                 ft.Text("Portal de Factibilidad", size=20, weight="bold", color="#4A90E2")
-            ])
+            ], expand=True),
+            history_status,
+            ft.IconButton(ft.Icons.UNDO, tooltip="Deshacer", on_click=lambda e: step_history(session.history.undo)),
+            ft.IconButton(ft.Icons.REDO, tooltip="Rehacer", on_click=lambda e: step_history(session.history.redo))
         ]
     )
 
     # Filters and search
     def update_filters(e):
-        state.filter_status = status_filter.value
-        state.filter_priority = priority_filter.value
-        state.search_term = search_field.value
+        session.query = ViewQuery(
+            status=status_filter.value,
+            priority=priority_filter.value,
+            search_term=search_field.value or "",
+            sort_by=sort_dropdown.value or ""
+        )
         update_project_list()
-        page.update()
+        request_update(page)
 
     status_filter = ft.Dropdown(
         label="Filtrar por Estado",
-        value=state.filter_status,
+        value=session.query.status,
         options=[ft.dropdown.Option("Todos")] + [ft.dropdown.Option(s.value) for s in ProjectStatus],
         on_change=update_filters,
         width=200
@@ -2718,14 +6940,22 @@ def main(page: ft.Page):
 
     priority_filter = ft.Dropdown(
         label="Filtrar por Prioridad",
-        value=state.filter_priority,
+        value=session.query.priority,
         options=[ft.dropdown.Option("Todas")] + [ft.dropdown.Option(p.value) for p in Priority],
         on_change=update_filters,
         width=200
     )
 
+    sort_dropdown = ft.Dropdown(
+        label="Ordenar por",
+        value=session.query.sort_by,
+        options=[ft.dropdown.Option("", "Sin orden"), ft.dropdown.Option("volume", "Volumen anual")],
+        on_change=update_filters,
+        width=170
+    )
+
     search_field = ft.TextField(
-        label="Buscar proyecto o cliente",
+        label="Buscar proyecto, cliente o planos",
         on_change=update_filters,
         prefix_icon=ft.Icons.SEARCH,
         width=300
@@ -2734,36 +6964,29 @@ def main(page: ft.Page):
     # Project list
     project_list = ft.Row([], wrap=True, spacing=10)
     
-    # Set global reference for updates
-    global project_list_ref
-    project_list_ref = project_list
+    # Set session reference for updates
+    session.project_list = project_list
 
     def update_project_list():
-        project_list.controls.clear()
-        projects = state.get_projects()
-        project_list.controls.extend([create_project_card(p, page) for p in projects])
+        with session.lock:
+            projects = state.get_projects(session.query)
+            project_list.controls = [session.card_for(p) for p in projects]
 
-    # Statistics
-    def get_stats():
-        total = len(state.projects)
-        feasible = len([p for p in state.projects if p.status == ProjectStatus.FEASIBLE.value])
-        under_review = len([p for p in state.projects if p.status == ProjectStatus.UNDER_REVIEW.value])
-        approved = len([p for p in state.projects if p.status == ProjectStatus.APPROVED.value])
-        rejected = len([p for p in state.projects if p.status == ProjectStatus.REJECTED.value])
-        not_feasible = len([p for p in state.projects if p.status == ProjectStatus.NOT_FEASIBLE.value])
-        avg_score = sum(p.feasibility_score for p in state.projects) / total if total > 0 else 0
-        
-        return {
-            "total": total,
-            "feasible": feasible,
-            "under_review": under_review,
-            "approved": approved,
-            "rejected": rejected,
-            "not_feasible": not_feasible,
-            "avg_score": avg_score
-        }
+    # Apply changes published by other sessions
+    def on_projects_changed(topic, message):
+        # Skip projects whose card already shows that version, e.g. this session's own saves.
+        # Projects without a card are refreshed too, since a change may bring them into the view.
+        with session.lock:
+            stale = [project_id for project_id, version in message["versions"].items()
+                     if session.card_versions.get(project_id, -1) < version]
+        if stale:
+            update_dashboard(page, changed_ids=stale)
+
+    broadcaster.attach(page.pubsub)
+    page.pubsub.subscribe_topic(PROJECTS_TOPIC, on_projects_changed)
 
-    stats = get_stats()
+    # Statistics
+    stats = state.get_stats()
     stats_row = ft.Row([
         ft.Container(
             content=ft.Column([
@@ -2837,9 +7060,8 @@ def main(page: ft.Page):
         )
     ])
     
-    # Set global reference for statistics updates
-    global stats_row_ref
-    stats_row_ref = stats_row
+    # Set session reference for statistics updates
+    session.stats_row = stats_row
 
     # Main layout
     page.add(
@@ -2855,8 +7077,39 @@ def main(page: ft.Page):
                     color=ft.Colors.WHITE,
                     on_click=lambda e: create_new_project_form(page)
                 ),
+                ft.ElevatedButton(
+                    "Plan de Prensas",
+                    icon=ft.Icons.PRECISION_MANUFACTURING,
+                    on_click=lambda e: show_press_plan_modal(page)
+                ),
+                ft.ElevatedButton(
+                    "Materiales",
+                    icon=ft.Icons.INVENTORY,
+                    on_click=lambda e: show_material_requirements_modal(page)
+                ),
+                ft.ElevatedButton(
+                    "Pesos de Factibilidad",
+                    icon=ft.Icons.TUNE,
+                    on_click=lambda e: show_scoring_weights_modal(page)
+                ),
+                ft.ElevatedButton(
+                    "Herramentales",
+                    icon=ft.Icons.BUILD,
+                    on_click=lambda e: show_tool_wear_modal(page)
+                ),
+                ft.ElevatedButton(
+                    "Cronograma",
+                    icon=ft.Icons.TIMELINE,
+                    on_click=lambda e: show_timeline_modal(page)
+                ),
+                ft.ElevatedButton(
+                    "Calidad de Datos",
+                    icon=ft.Icons.FACT_CHECK,
+                    on_click=lambda e: show_data_quality_modal(page)
+                ),
                 status_filter,
                 priority_filter,
+                sort_dropdown,
                 search_field
             ], alignment="spaceBetween"),
             
@@ -2865,6 +7118,9 @@ def main(page: ft.Page):
             # Statistics
             stats_row,
             
+            # Background jobs
+            create_jobs_panel(page),
+            
             ft.Divider(),
             
             # Project list
@@ -2875,7 +7131,7 @@ def main(page: ft.Page):
 
     # Initialize project list
     update_project_list()
-    page.update()
+    request_update(page)
 
 if __name__ == "__main__":
-    ft.app(main)
+    ft.app(main, upload_dir=UPLOAD_DIR)